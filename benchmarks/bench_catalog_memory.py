@@ -0,0 +1,110 @@
+"""
+Benchmark the memory used per library file as the library grows.
+
+Loads the same files from the library index database as the Drive shaped dicts the index used to keep, and as
+catalog records, and measures both with tracemalloc. Then measures the whole loaded index (catalog and search
+indexes), and the results of a search matching many files: a list of files against a ResultSet.
+
+Usage: python3 benchmarks/bench_catalog_memory.py [files...]
+"""
+import os
+import random
+import sqlite3
+import string
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "bool_bot"))
+
+import catalog
+import library_index
+
+FILE_COUNTS = [1000, 10000, 50000]
+FOLDER_COUNT = 50
+
+QUERIES = ["justin", "kurt", "jey", "beach", "sus", "x"]
+
+
+def random_word():
+    return "".join(random.choice(string.ascii_lowercase) for _ in range(random.randint(4, 10)))
+
+
+def drive_files(file_count):
+    folders = [{"id": "folder{0}".format(i), "name": random_word(), "parents": ["root"]} for i in range(FOLDER_COUNT)]
+    files = []
+    for i in range(file_count):
+        id = "1{0:032d}".format(i)
+        files.append({
+            "id": id,
+            "name": "{0}{1}.jpg".format(random_word(), random.choice(QUERIES)),
+            "description": " ".join(random_word() for _ in range(3)),
+            "mimeType": "image/jpeg",
+            "parents": [random.choice(folders)["id"]],
+            "webViewLink": "https://drive.google.com/file/d/{0}/view?usp=drivesdk".format(id),
+            "md5Checksum": "{0:032x}".format(random.getrandbits(128)),
+            "modifiedTime": "2020-10-05T12:00:00.000Z",
+        })
+    return folders, files
+
+
+def dict_record(row):
+    # How library_index kept a file before the catalog
+    file = {}
+    for field, value in zip(library_index.FILE_FIELDS, row):
+        if field == "parents":
+            file[field] = [value]
+        elif value is not None or field in ("id", "name", "mimeType"):
+            file[field] = value
+    return file
+
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size, kept
+
+
+def main():
+    file_counts = [int(count) for count in sys.argv[1:]] or FILE_COUNTS
+    random.seed(1)
+
+    print("{0:>8} | {1:>12} | {2:>12} | {3:>12} | {4:>20} | {5:>20}".format(
+        "files", "dict B/file", "record B/file", "index B/file", "list result B/match", "ResultSet B/match"))
+
+    for file_count in file_counts:
+        folders, files = drive_files(file_count)
+        library = library_index.LibraryIndex(os.path.join(tempfile.mkdtemp(), "library.db"))
+        library.replace(folders, files)
+
+        connection = sqlite3.connect(library.path)
+        rows = connection.execute("SELECT {0} FROM files".format(", ".join(library_index.FILE_COLUMNS))).fetchall()
+        connection.close()
+
+        # Fresh strings for every measure, like a load from SQLite
+        copy = lambda: [tuple(value[:1] + value[1:] if isinstance(value, str) else value for value in row) for row in rows]
+
+        dict_bytes, kept = measure(lambda: {row[0]: dict_record(row) for row in copy()})
+        del kept
+        record_bytes, kept = measure(lambda: catalog.Catalog([catalog.FileRecord(*row) for row in copy()]))
+        del kept
+
+        loaded = library_index.LibraryIndex(library.path)
+        index_bytes, _ = measure(loaded.load)
+
+        ids = [file["id"] for file in loaded.search("e")]
+        list_bytes, kept = measure(lambda: [loaded.get_file(id) for id in ids])
+        del kept
+        # Not the search itself, its freed tuples stay on the tuple free list
+        result_bytes, kept = measure(lambda: loaded._files.results(ids))
+
+        print("{0:>8} | {1:>12.0f} | {2:>13.0f} | {3:>12.0f} | {4:>20.1f} | {5:>20.1f}".format(
+            file_count, dict_bytes / file_count, record_bytes / file_count, index_bytes / file_count,
+            list_bytes / float(len(ids)), result_bytes / float(len(kept))))
+
+
+if __name__ == "__main__":
+    main()
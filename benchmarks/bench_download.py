@@ -0,0 +1,61 @@
+"""
+Benchmark downloading big files against a fake Drive with a fixed latency per request and bandwidth per connection.
+
+Compares one request for the whole file (how google_drive_feat downloaded with MediaIoBaseDownload) with
+drive_download fetching ranges at the same time, for a few chunk sizes.
+
+Usage: python3 benchmarks/bench_download.py [latency_ms] [mb_per_second_per_connection]
+"""
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "bool_bot"))
+
+import drive_download
+import drive_limits
+import fake_drive
+import google_drive_feat
+
+FILE_SIZES = [1, 4, 8, 32]
+CHUNK_SIZES = [512 * 1024, 1024 * 1024, 2 * 1024 * 1024]
+PARALLELISM = 4
+
+
+def measure(drive, id, chunk_size, parallelism):
+    drive.calls.clear()
+    buffer = io.BytesIO()
+    start = time.perf_counter()
+    drive_download.RangeDownload(id, buffer, drive.items[id]["md5Checksum"], chunk_size, parallelism).run()
+    return time.perf_counter() - start, drive.calls["files.get_media"]
+
+
+def main():
+    latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.05
+    bandwidth = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    # Measures the downloads, not the Drive quota
+    drive_limits.set_rate_limit(0)
+
+    drive = fake_drive.FakeDrive(latency=latency, bandwidth=bandwidth * 1024 * 1024)
+    google_drive_feat.set_service(drive)
+
+    print("{0:>8} | {1:>16} | {2}".format("MB", "whole file", " | ".join(
+        "{0:>7}KB ranges x{1}".format(chunk_size // 1024, PARALLELISM) for chunk_size in CHUNK_SIZES)))
+
+    for megabytes in FILE_SIZES:
+        size = megabytes * 1024 * 1024
+        id = drive.add_file("video{0}.mp4".format(megabytes), mimeType="video/mp4", size=size)
+
+        seconds, requests = measure(drive, id, size, 1)
+        row = ["{0:>6.2f}s {1:>4.0f}MB/s".format(seconds, megabytes / seconds)]
+        for chunk_size in CHUNK_SIZES:
+            seconds, requests = measure(drive, id, chunk_size, PARALLELISM)
+            row.append("{0:>6.2f}s {1:>7.0f}MB/s".format(seconds, megabytes / seconds))
+
+        print("{0:>8} | {1}".format(megabytes, " | ".join(row)))
+
+
+if __name__ == "__main__":
+    main()
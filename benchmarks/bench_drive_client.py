@@ -0,0 +1,63 @@
+"""
+Benchmark the per command overhead of getting a Drive service.
+
+Compares the old path (unpickle token.pickle and build the service on every call) with the cached
+google_drive_feat.get_service(). Runs offline with dummy credentials, no Drive requests are made.
+
+Usage: python3 benchmarks/bench_drive_client.py [iterations]
+"""
+import datetime
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "bool_bot"))
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+import google_drive_feat
+
+
+def uncached_service():
+    """
+    What every google_drive_feat function used to do before calling Drive
+    """
+    with open('token.pickle', 'rb') as token:
+        creds = pickle.load(token)
+    return build('drive', 'v3', credentials=creds, cache_discovery=False)
+
+
+def timeit(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    os.chdir(tempfile.mkdtemp())
+    creds = Credentials(token="dummy", refresh_token="dummy", client_id="id", client_secret="secret",
+                        token_uri="https://oauth2.googleapis.com/token")
+    creds.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    with open('token.pickle', 'wb') as token:
+        pickle.dump(creds, token)
+
+    google_drive_feat.reset_client()
+    google_drive_feat.get_service()
+
+    uncached = timeit(uncached_service, iterations)
+    cached = timeit(google_drive_feat.get_service, iterations)
+
+    print("authenticate() + build() per call: {0:8.3f} ms".format(uncached * 1000))
+    print("cached get_service() per call:     {0:8.3f} ms".format(cached * 1000))
+    # !photo r used to pay this twice (get_files_search and get_folder_ids)
+    print("saved per !photo r:                {0:8.3f} ms".format((uncached - cached) * 2 * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark listing every photo of the library against a fake Drive with a fixed latency per request.
+
+Compares one query per folder run one after the other (how get_files_search used to list, with pagination added so
+nothing is truncated) with list_files_in_parents, which batches parents into queries run in parallel.
+
+Usage: python3 benchmarks/bench_folder_listing.py [latency_ms]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "bool_bot"))
+
+import drive_limits
+import fake_drive
+import google_drive_feat
+
+FILES_PER_FOLDER = 25
+FOLDER_COUNTS = [10, 50, 100, 300, 600]
+
+
+def per_folder(folder_ids):
+    files = []
+    for id in folder_ids:
+        files.extend(google_drive_feat.list_files("'{0}' in parents and trashed = false".format(id), "id, name"))
+    return files
+
+
+def batched(folder_ids):
+    return google_drive_feat.list_files_in_parents(folder_ids, "trashed = false", "id, name")
+
+
+def measure(drive, func, folder_ids):
+    drive.calls.clear()
+    start = time.perf_counter()
+    files = func(folder_ids)
+    return time.perf_counter() - start, drive.calls["files.list"], len(files)
+
+
+def main():
+    latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.02
+
+    # Measures the listing itself, not the Drive quota
+    drive_limits.set_rate_limit(0)
+
+    print("{0:>8} {1:>8} | {2:>10} {3:>8} | {4:>10} {5:>8}".format(
+        "folders", "files", "per folder", "requests", "batched", "requests"))
+
+    for folder_count in FOLDER_COUNTS:
+        drive = fake_drive.FakeDrive(latency=latency)
+        root = drive.add_folder("Photos")
+        folder_ids = []
+        for i in range(folder_count):
+            folder = drive.add_folder("folder{0}".format(i), root)
+            folder_ids.append(folder)
+            for j in range(FILES_PER_FOLDER):
+                drive.add_file("photo{0}-{1}.jpg".format(i, j), folder)
+
+        google_drive_feat.set_service(drive)
+        old_time, old_calls, old_files = measure(drive, per_folder, folder_ids)
+        new_time, new_calls, new_files = measure(drive, batched, folder_ids)
+        assert old_files == new_files == folder_count * FILES_PER_FOLDER
+
+        print("{0:>8} {1:>8} | {2:>8.0f}ms {3:>8} | {4:>8.0f}ms {5:>8}".format(
+            folder_count, new_files, old_time * 1000, old_calls, new_time * 1000, new_calls))
+
+    google_drive_feat.set_service(None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Benchmark searches on the local library index against the old per query Drive listing.
+
+The Drive listing is simulated with a fixed latency per round trip (1 + number of folders round trips per search,
+like google_drive_feat.get_files_search).
+
+Usage: python3 benchmarks/bench_library_index.py [files] [folders]
+"""
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "bool_bot"))
+
+import library_index
+
+# Typical latency of one files().list round trip
+DRIVE_ROUND_TRIP = 0.15
+
+QUERIES = ["justin", "kurt", "jey", "beach", "sus", "x"]
+
+
+def random_word():
+    return "".join(random.choice(string.ascii_lowercase) for _ in range(random.randint(4, 10)))
+
+
+def main():
+    file_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    folder_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    random.seed(1)
+    folders = [{"id": "folder{0}".format(i), "name": random_word(), "parents": ["root"]} for i in range(folder_count)]
+    files = []
+    for i in range(file_count):
+        words = [random_word(), random.choice(QUERIES)]
+        files.append({
+            "id": "file{0}".format(i),
+            "name": "{0}.jpg".format("".join(words)),
+            "description": " ".join(random_word() for _ in range(3)),
+            "mimeType": "image/jpeg",
+            "parents": [random.choice(folders)["id"]],
+            "webViewLink": "",
+        })
+
+    library = library_index.LibraryIndex(os.path.join(tempfile.mkdtemp(), "library.db"))
+
+    start = time.perf_counter()
+    library.replace(folders, files)
+    print("build + save {0} files: {1:8.1f} ms".format(file_count, (time.perf_counter() - start) * 1000))
+
+    start = time.perf_counter()
+    library.load()
+    print("load {0} files:         {1:8.1f} ms".format(file_count, (time.perf_counter() - start) * 1000))
+
+    print("Drive listing per search (simulated): {0:8.1f} ms".format((1 + folder_count) * DRIVE_ROUND_TRIP * 1000))
+    for query in QUERIES:
+        start = time.perf_counter()
+        found = library.search(query)
+        elapsed = time.perf_counter() - start
+        print("index search {0!r:10} {1:6} results {2:8.3f} ms".format(query, len(found), elapsed * 1000))
+
+
+if __name__ == "__main__":
+    main()
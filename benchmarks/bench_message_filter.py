@@ -0,0 +1,138 @@
+"""
+Benchmark on_message with message_filter against the old checks on a high volume message stream.
+
+Replays a stream of guild messages, most of them chatter, through both versions of on_message and reports how many
+messages per second each handles (best of 3 runs). Commands go through a real discord.py Bot (offline, nothing is sent), so the cost of
+bot.process_commands is included. The old checks raise IndexError on empty messages (attachments only), which are
+counted as crashes.
+
+Usage: python3 benchmarks/bench_message_filter.py [messages]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from discord.ext import commands
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "bool_bot"))
+
+import channel
+import message_filter
+
+GUILDS = 50
+CHANNELS_PER_GUILD = 5
+
+CONTENTS = [
+    "lol", "did anyone see the game last night", "", "https://example.com/some/long/link?with=query",
+    "!photo r kurt", "!ls", "1", "c",
+]
+
+# Offline bot with no-op commands. bot.user is set so process_commands can tell the bot's own messages apart
+bot = commands.Bot(command_prefix="!")
+bot._connection.user = SimpleNamespace(id=0, name="bot")
+
+@bot.command(name="photo")
+async def photo_command(ctx, search_option, query):
+    pass
+
+@bot.command(name="ls")
+async def ls(ctx):
+    pass
+
+# Names of the bot channels, like channel.bot_channels before the channel registry
+old_bot_channels = {}
+
+# Users with a pending photo search request, by user id before the selection manager and by (user id, channel id) now
+old_photo_requests = {user_id: {} for user_id in range(0, 10000, 500)}
+photo_requests = {(user_id, 0): {} for user_id in range(0, 10000, 500)}
+
+
+async def process_search_request(message):
+    # Same early return as photo.process_search_request
+    if (message.author.id, message.channel.id) not in photo_requests:
+        return
+
+
+async def old_on_message(message):
+    # on_message before message_filter
+    if len(old_bot_channels) == 0 and message.content[0] == "!" and message.content.find("!channel") == -1:
+        return
+
+    if message.content.find("!channel") != -1:
+        return await bot.process_commands(message)
+
+    if message.channel.name in old_bot_channels:
+        await bot.process_commands(message)
+
+        if message.author.name != bot.user.name and message.content[0] != "!":
+            if message.author.id not in old_photo_requests:
+                return
+
+
+async def new_on_message(message):
+    action = message_filter.route(message, photo_requests)
+
+    if action == message_filter.COMMAND:
+        return await bot.process_commands(message)
+
+    if action == message_filter.SELECTION:
+        await process_search_request(message)
+
+
+def make_stream(count):
+    random.seed(1)
+    stream = []
+    for _ in range(count):
+        guild_id = random.randrange(GUILDS)
+        channel_id = guild_id * CHANNELS_PER_GUILD + random.randrange(CHANNELS_PER_GUILD)
+        stream.append(SimpleNamespace(
+            content=random.choice(CONTENTS),
+            author=SimpleNamespace(id=random.randrange(1, 10000), name="user", bot=False),
+            guild=SimpleNamespace(id=guild_id),
+            channel=SimpleNamespace(id=channel_id, name="channel{0}".format(channel_id)),
+            _state=None,
+        ))
+    return stream
+
+
+async def replay(on_message, stream):
+    crashes = 0
+    for message in stream:
+        try:
+            await on_message(message)
+        except IndexError:
+            crashes += 1
+    return crashes
+
+
+def run(name, on_message, stream, repeat=3):
+    # Best of a few runs
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        crashes = bot.loop.run_until_complete(replay(on_message, stream))
+        elapsed = min(elapsed, time.perf_counter() - start)
+
+    print("{0:15} {1:12,.0f} messages/s  crashes {2}".format(name, len(stream) / elapsed, crashes))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    # One bot channel per guild
+    channel.registry = channel.ChannelRegistry(os.path.join(tempfile.mkdtemp(), "channels.db"))
+    for guild_id in range(GUILDS):
+        channel_id = guild_id * CHANNELS_PER_GUILD
+        old_bot_channels["channel{0}".format(channel_id)] = "no"
+        channel.registry.add(guild_id, channel_id)
+
+    stream = make_stream(count)
+    run("old checks", old_on_message, stream)
+    run("message_filter", new_on_message, stream)
+
+
+if __name__ == "__main__":
+    main()
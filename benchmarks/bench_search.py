@@ -0,0 +1,97 @@
+"""
+Benchmark the ranked search engine on a synthetic 100k file corpus.
+
+Names look like "kurt12_beach_IMG00042.jpg" and descriptions mix names, places and words of a 5000 word vocabulary.
+Reports the time to build the index, to apply one incremental change, and the latency of a few kinds of queries
+(whole word, prefix, part of a word, typo, two words), for the top 200 results and for every match. The old search,
+a case sensitive substring scan of every name and description, is timed on the same queries for comparison.
+
+Usage: python3 benchmarks/bench_search.py [files]
+"""
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "bool_bot"))
+
+import search_engine
+
+PEOPLE = ["justin", "kurt", "jey", "alex", "david", "kevin", "maria", "sofia", "aravind", "ryan"]
+PLACES = ["beach", "party", "office", "lake", "camping", "graduation", "dinner", "concert"]
+
+QUERIES = [
+    ("word", "kurt"),
+    ("prefix", "ju"),
+    ("part of word", "avin"),
+    ("typo", "gradaution"),
+    ("two words", "justin beach"),
+    ("rare word", "kurt12"),
+    ("rare two words", "kurt12 beach"),
+    ("no match", "zzzz"),
+]
+
+LIMIT = 200
+
+
+def random_word():
+    return "".join(random.choice(string.ascii_lowercase) for _ in range(random.randint(4, 10)))
+
+
+# Descriptions draw from a vocabulary, most used words first (Zipf like), like real text
+VOCABULARY = []
+
+
+def make_files(count):
+    random.seed(1)
+    VOCABULARY[:] = [random_word() for _ in range(5000)]
+    weights = [1.0 / (rank + 1) for rank in range(len(VOCABULARY))]
+
+    files = []
+    for i in range(count):
+        name = "{0}{1}_{2}_IMG{3:05d}.jpg".format(random.choice(PEOPLE), random.randint(1, 300), random.choice(PLACES), i)
+        description = " ".join([random.choice(PEOPLE), random.choice(PLACES)] + random.choices(VOCABULARY, weights, k=4))
+        files.append({"id": "file{0}".format(i), "name": name, "description": description})
+    return files
+
+
+def timed(func, repeat=20):
+    # Median of a few runs, in ms
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2] * 1000, result
+
+
+def substring_scan(files, query):
+    # Old semantics: query is a substring of the name or the description
+    return [file for file in files if query in file["name"] or query in file.get("description", "")]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    files = make_files(count)
+
+    start = time.perf_counter()
+    index = search_engine.SearchIndex(files)
+    print("build {0} files: {1:8.1f} ms, {2} words".format(count, (time.perf_counter() - start) * 1000, len(index.postings)))
+
+    elapsed, _ = timed(lambda: index.put({"id": "file0", "name": "kurt_beach_new.jpg", "description": "justin"}))
+    print("one incremental change: {0:8.3f} ms".format(elapsed))
+
+    print("{0:14} {1:14} {2:>8} {3:>12} {4:>12} {5:>8} {6:>12}".format(
+        "query", "", "matches", "top 200 ms", "all ms", "scan", "scan ms"))
+    for kind, query in QUERIES:
+        top_ms, top = timed(lambda: index.search(query, limit=LIMIT))
+        all_ms, found = timed(lambda: index.search(query))
+        scan_ms, scanned = timed(lambda: substring_scan(files, query), repeat=5)
+        print("{0:14} {1!r:14} {2:8} {3:12.2f} {4:12.2f} {5:8} {6:12.2f}".format(
+            kind, query, len(found), top_ms, all_ms, len(scanned), scan_ms))
+
+
+if __name__ == "__main__":
+    main()
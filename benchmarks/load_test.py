@@ -0,0 +1,211 @@
+"""
+Load test the bot commands against a fake Drive.
+
+Sends commands to index.bot the way Discord would (through on_message, from many users in many channels) with a
+fixed number of commands in flight, and reports the p50/p99 latency and the throughput of every command. Drive is
+fake_drive.FakeDrive with a generated library, so it runs offline with no .env or credentials. Nothing is sent to
+Discord: the replies are recorded by fake channels.
+
+Every command is run on its own, one after the other. The library index is built first unless --no-index is given,
+then the commands fall back to Drive searches.
+
+Usage: python3 benchmarks/load_test.py [--requests 200] [--concurrency 20] [--latency 50] [--commands "photo r {word}" "ls"]
+"""
+import argparse
+import functools
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "bool_bot"))
+
+import fake_drive
+
+# {word}, {folder}, {name} and {id} are replaced with a random word, folder name, photo name and photo id of the
+# library
+COMMANDS = [
+    "photo r {word}",
+    "photo rf {folder}",
+    "photo s {word}",
+    "photo e {name}",
+    "photo i {id}",
+    "video r {word}",
+    "ls",
+]
+
+GUILD_ID = 1
+
+
+class FakeChannel(object):
+    """
+    Stand in for discord.TextChannel. Records what the bot sends
+    """
+    def __init__(self, id):
+        self.id = id
+        self.name = "channel{0}".format(id)
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+        return FakeMessage(self)
+
+
+class FakeMessage(object):
+    """
+    Stand in for the discord.Message the bot sent
+    """
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def edit(self, **kwargs):
+        pass
+
+    async def delete(self):
+        pass
+
+
+def load_bot(drive, root, args):
+    """
+    Point the bot at the fake Drive and temporary files, then import it
+    """
+    directory = tempfile.mkdtemp()
+    os.environ["ROOT_PHOTO_FILE_ID"] = root
+    os.environ["LIBRARY_INDEX_PATH"] = os.path.join(directory, "library.db")
+    os.environ["MEDIA_CACHE_DIR"] = os.path.join(directory, "cache")
+    os.environ["CHANNEL_REGISTRY_PATH"] = os.path.join(directory, "channels.db")
+    os.environ.pop("METRICS_FILE", None)
+    os.environ.pop("METRICS_PORT", None)
+
+    import google_drive_feat
+    import drive_limits
+    import channel
+    import library_index
+    import index
+    from discord.ext import commands
+
+    google_drive_feat.set_service(drive)
+    index.load_extensions()
+    if args.drive_rate is not None:
+        drive_limits.set_rate_limit(args.drive_rate)
+
+    for channel_id in range(args.channels):
+        channel.registry.add(GUILD_ID, channel_id)
+
+    if not args.no_index:
+        library_index.library.rebuild(root)
+
+    class LoadContext(commands.Context):
+        # Sends to the fake channel instead of the Discord API
+        async def send(self, content=None, **kwargs):
+            return await self.channel.send(content, **kwargs)
+
+    index.bot._connection.user = SimpleNamespace(id=0, name="bool-bot", bot=True)
+    index.bot.get_context = functools.partial(commands.Bot.get_context, index.bot, cls=LoadContext)
+
+    return index
+
+
+def make_message(content, user_id, channels):
+    return SimpleNamespace(
+        content=content,
+        author=SimpleNamespace(id=user_id, name="user{0}".format(user_id), bot=False,
+                               guild_permissions=SimpleNamespace(administrator=True)),
+        guild=SimpleNamespace(id=GUILD_ID, text_channels=channels),
+        channel=random.choice(channels),
+        mentions=[],
+        channel_mentions=[],
+        _state=None,
+    )
+
+
+async def run_command(index, template, library, channels, requests, concurrency):
+    """
+    Send requests commands, concurrency at a time. Returns the latencies and the elapsed time
+    """
+    import asyncio
+
+    latencies = []
+    errors = []
+    user_ids = iter(range(1, requests + 1))
+
+    def next_message():
+        content = template.format(
+            word=random.choice(fake_drive.LIBRARY_WORDS),
+            folder=random.choice(library["folders"]),
+            name=random.choice(library["photos"])["name"],
+            id=random.choice(library["photos"])["id"],
+        )
+        # Every command from another user, so !photo s searches don't wait on each other
+        return make_message(content, next(user_ids), channels)
+
+    async def worker(count):
+        for _ in range(count):
+            message = next_message()
+            start = time.perf_counter()
+            try:
+                await index.on_message(message)
+            except Exception as exception:
+                errors.append(exception)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    counts = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    await asyncio.gather(*[worker(count) for count in counts if count > 0])
+    return latencies, errors, time.perf_counter() - start
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the bot commands against a fake Drive")
+    parser.add_argument("--requests", type=int, default=200, help="commands sent for every command type")
+    parser.add_argument("--concurrency", type=int, default=20, help="commands in flight at the same time")
+    parser.add_argument("--channels", type=int, default=50, help="bot channels the commands are spread over")
+    parser.add_argument("--latency", type=float, default=50, help="milliseconds every Drive request takes")
+    parser.add_argument("--bandwidth", type=float, default=None, help="megabytes per second of Drive downloads")
+    parser.add_argument("--page-size", type=int, default=1000, help="most files Drive returns per page")
+    parser.add_argument("--folders", type=int, default=20, help="folders in the library")
+    parser.add_argument("--photos", type=int, default=200, help="photos per folder")
+    parser.add_argument("--videos", type=int, default=5, help="videos per folder")
+    parser.add_argument("--file-size", type=int, default=200 * 1024, help="bytes of every photo and video")
+    parser.add_argument("--drive-rate", type=float, default=None, help="Drive requests per second, 0 for no limit. DRIVE_RATE_LIMIT if not set")
+    parser.add_argument("--no-index", action="store_true", help="don't build the library index first")
+    parser.add_argument("--commands", nargs="+", default=COMMANDS, help="the commands to run, without the prefix")
+    args = parser.parse_args()
+
+    random.seed(1)
+    drive = fake_drive.FakeDrive(latency=args.latency / 1000.0, max_page_size=args.page_size, file_size=args.file_size,
+                                 bandwidth=args.bandwidth * 1024 * 1024 if args.bandwidth else None)
+    root = drive.add_library(args.folders, args.photos, args.videos)
+
+    library = {
+        "folders": [item["name"] for item in drive.items.values() if item["parents"] == [root]],
+        "photos": [item for item in drive.items.values() if item["mimeType"] == "image/jpeg"],
+    }
+    print("Library of {0} folders and {1} files, {2}ms per Drive request".format(
+        len(library["folders"]), len(drive.items) - len(library["folders"]) - 1, args.latency))
+
+    index = load_bot(drive, root, args)
+    channels = [FakeChannel(channel_id) for channel_id in range(args.channels)]
+
+    print("{0:20} {1:>8} {2:>7} {3:>10} {4:>10} {5:>12} {6:>14}".format(
+        "command", "requests", "errors", "p50", "p99", "commands/s", "Drive requests"))
+
+    for template in args.commands:
+        drive.calls.clear()
+        latencies, errors, elapsed = index.bot.loop.run_until_complete(
+            run_command(index, "!" + template, library, channels, args.requests, args.concurrency))
+
+        print("{0:20} {1:>8} {2:>7} {3:>8.1f}ms {4:>8.1f}ms {5:>12.1f} {6:>14}".format(
+            template, len(latencies), len(errors), percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+            len(latencies) / elapsed, sum(drive.calls.values())))
+
+
+if __name__ == "__main__":
+    main()
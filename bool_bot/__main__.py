@@ -4,6 +4,13 @@ import sys
 if platform.system() == "Windows":
     sys.path.append("C:\Python38\Lib\site-packages")
 
-import index
+# First, so the startup time includes every import
+import startup
+import sharding
 
-index.main()
+if sharding.should_launch():
+    sharding.launch()
+else:
+    import index
+
+    index.main()
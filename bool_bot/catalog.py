@@ -0,0 +1,242 @@
+import array
+import collections.abc
+import sys
+
+# Compact in memory catalog of the library files. Used by library_index.
+#
+# A file used to be kept as the dict Drive sent (~1 KB with its parents list and 8 separate strings), and every
+# search built a list of them. A FileRecord keeps the same fields in __slots__: mime types and parent ids are
+# interned so every file of a folder shares one string, the md5Checksum is kept as 16 bytes instead of 32 hex
+# digits, and a webViewLink of the usual form is derived from the id instead of stored. Records read like the Drive
+# dicts (file["id"], file.get("description", "")), so the commands don't change.
+#
+# The catalog keeps every record at a fixed position. Search results and pending selections are ResultSets: arrays of
+# 4 byte positions resolved when read, instead of lists of copied files. A removed file keeps its position until the
+# next rebuild, so results taken before still resolve to it.
+
+# Drive fields of a file, in the order FileRecord takes them
+FIELDS = ("id", "name", "description", "mimeType", "parents", "webViewLink", "md5Checksum", "modifiedTime")
+
+# webViewLink forms derived from the file id. Drive sends the first one
+VIEW_LINKS = ("https://drive.google.com/file/d/{0}/view?usp=drivesdk", "https://drive.google.com/file/d/{0}/view")
+
+# ================================================================================
+# Records
+
+class FileRecord(collections.abc.Mapping):
+    """
+    Metadata of one library file. A read only mapping of the Drive fields that are set
+    """
+
+    __slots__ = ("id", "name", "description", "mime_type", "parent_id", "_link", "_md5", "modified_time")
+
+    def __init__(self, id, name, description=None, mime_type=None, parent_id=None, web_view_link=None,
+                 md5_checksum=None, modified_time=None):
+        """
+        Same arguments as a row of the library_index files table
+        """
+        self.id = id
+        self.name = name
+        self.description = description
+        self.mime_type = sys.intern(mime_type) if mime_type is not None else None
+        self.parent_id = sys.intern(parent_id) if parent_id is not None else None
+        self._link = _compact_link(id, web_view_link)
+        self._md5 = _compact_md5(md5_checksum)
+        self.modified_time = modified_time
+
+    @classmethod
+    def from_drive(cls, file):
+        """
+        Returns the record of a file object from Drive, or of another record
+        """
+        parents = file.get("parents")
+        return cls(file["id"], file["name"], file.get("description"), file.get("mimeType"),
+                   parents[0] if parents else None, file.get("webViewLink"), file.get("md5Checksum"),
+                   file.get("modifiedTime"))
+
+    @property
+    def web_view_link(self):
+        if isinstance(self._link, int):
+            return VIEW_LINKS[self._link].format(self.id)
+        return self._link
+
+    @property
+    def md5_checksum(self):
+        if isinstance(self._md5, bytes):
+            return self._md5.hex()
+        return self._md5
+
+    def _value(self, field):
+        if field == "id":
+            return self.id
+        if field == "name":
+            return self.name
+        if field == "description":
+            return self.description
+        if field == "mimeType":
+            return self.mime_type
+        if field == "parents":
+            return [self.parent_id] if self.parent_id is not None else None
+        if field == "webViewLink":
+            return self.web_view_link
+        if field == "md5Checksum":
+            return self.md5_checksum
+        if field == "modifiedTime":
+            return self.modified_time
+        return None
+
+    def __getitem__(self, field):
+        value = self._value(field)
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def __iter__(self):
+        return (field for field in FIELDS if self._value(field) is not None)
+
+    def __len__(self):
+        return sum(1 for field in self)
+
+    def __repr__(self):
+        return "FileRecord({0!r})".format(dict(self))
+
+    def nbytes(self, shared=None):
+        """
+        Returns the bytes used by the record and the values only it holds
+
+        shared : Set<Integer> - ids of the interned values already counted. The record's are added to it
+        """
+        if shared is None:
+            shared = set()
+
+        size = sys.getsizeof(self)
+        for value in (self.id, self.name, self.description, self._link, self._md5, self.modified_time):
+            if value is not None and not isinstance(value, int):
+                size += sys.getsizeof(value)
+
+        for value in (self.mime_type, self.parent_id):
+            if value is not None and id(value) not in shared:
+                shared.add(id(value))
+                size += sys.getsizeof(value)
+
+        return size
+
+def _compact_link(id, link):
+    for i, form in enumerate(VIEW_LINKS):
+        if link == form.format(id):
+            return i
+    return link
+
+def _compact_md5(md5):
+    if md5 is not None and len(md5) == 32:
+        try:
+            packed = bytes.fromhex(md5)
+        except ValueError:
+            return md5
+        # Upper case digits would not come back the same
+        if packed.hex() == md5:
+            return packed
+    return md5
+
+# ================================================================================
+# Catalog
+
+class Catalog(object):
+    """
+    Records by id, each at a fixed position. Written by one thread at a time, read from any without locking
+    """
+
+    def __init__(self, records=()):
+        records = {record.id: record for record in records}
+
+        # Removed records stay in _records for the result sets holding them, until the catalog is built again
+        self._records = list(records.values())
+        self._positions = {id: position for position, id in enumerate(records)}
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, id):
+        return id in self._positions
+
+    def get(self, id):
+        """
+        Returns the record with this id, or None
+        """
+        position = self._positions.get(id)
+        return self._records[position] if position is not None else None
+
+    def values(self):
+        """
+        Returns every record
+        """
+        records = self._records
+        return [records[position] for position in list(self._positions.values())]
+
+    def put(self, record):
+        """
+        Add or replace a record. A replaced record keeps its position, so result sets see the new one
+        """
+        position = self._positions.get(record.id)
+        if position is None:
+            self._records.append(record)
+            self._positions[record.id] = len(self._records) - 1
+        else:
+            self._records[position] = record
+
+    def remove(self, id):
+        """
+        Remove a record. Returns True if it was in the catalog
+        """
+        return self._positions.pop(id, None) is not None
+
+    def results(self, ids):
+        """
+        Returns the ResultSet of the records with these ids, in the same order. Ids not in the catalog are skipped
+        """
+        positions = [position for position in map(self._positions.get, ids) if position is not None]
+        return ResultSet(self._records, array.array("i", positions))
+
+    def select(self, predicate):
+        """
+        Returns the ResultSet of the records the predicate is true for
+        """
+        records = self._records
+        return ResultSet(records, array.array("i", [position for position in list(self._positions.values())
+                                                    if predicate(records[position])]))
+
+    def nbytes(self):
+        """
+        Returns the bytes used by the catalog: the records, their values and the containers. O(n)
+        """
+        shared = set()
+        records = self._records
+        return (sys.getsizeof(records) + sys.getsizeof(self._positions) +
+                sum(records[position].nbytes(shared) for position in list(self._positions.values())))
+
+class ResultSet(collections.abc.Sequence):
+    """
+    Read only sequence of catalog records, stored as their positions
+    """
+
+    __slots__ = ("_records", "_positions")
+
+    def __init__(self, records, positions):
+        self._records = records
+        self._positions = positions
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ResultSet(self._records, self._positions[index])
+        return self._records[self._positions[index]]
+
+    def __eq__(self, other):
+        if isinstance(other, collections.abc.Sequence) and not isinstance(other, str):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return "ResultSet({0!r})".format(list(self))
@@ -1,43 +1,227 @@
-import discord
 import asyncio
+import os
+import sqlite3
+import threading
+
+# Features
+import send_queue
+from settings import CHANNEL_REGISTRY_PATH, CHANNEL_FLUSH_DELAY
+
+# The channels of every guild the bot was added to, by channel id. A renamed channel stays a bot channel, and the
+# same channel name in two guilds are two different channels.
+#
+# The registry is loaded from SQLite once at startup and every lookup after that is a set lookup in memory. Changes
+# are written behind, CHANNEL_FLUSH_DELAY seconds later on a worker thread, so the !channel command never waits on
+# the disk. A write that fails is tried again later, and what is left is written when the bot stops.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bot_channels (
+    guild_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, channel_id)
+);
+"""
+
+# ================================================================================
+# Registry
+
+class ChannelRegistry(object):
+    """
+    Bot channel ids by guild id, saved in SQLite
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        # guild id -> set of channel ids
+        self.guilds = {}
+
+        # Changes not written yet, in order. (guild id, channel id, True if added)
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        # Flushes write one at a time, so changes are written in order
+        self._flush_lock = threading.Lock()
+        self._flush_handle = None
+
+    def channels(self, guild_id):
+        """
+        Returns the ids of the bot channels of a guild. Do not modify it
+        """
+        return self.guilds.get(guild_id, frozenset())
+
+    def contains(self, guild_id, channel_id):
+        return channel_id in self.guilds.get(guild_id, ())
+
+    def add(self, guild_id, channel_id):
+        """
+        Make a channel a bot channel. Returns False if it already was
+        """
+        channels = self.guilds.setdefault(guild_id, set())
+        if channel_id in channels:
+            return False
+
+        channels.add(channel_id)
+        self._changed(guild_id, channel_id, True)
+        return True
+
+    def remove(self, guild_id, channel_id):
+        """
+        Make a channel a regular channel. Returns False if it was not a bot channel
+        """
+        channels = self.guilds.get(guild_id)
+        if channels is None or channel_id not in channels:
+            return False
+
+        channels.discard(channel_id)
+        if len(channels) == 0:
+            del self.guilds[guild_id]
+        self._changed(guild_id, channel_id, False)
+        return True
+
+    def _changed(self, guild_id, channel_id, added):
+        with self._pending_lock:
+            self._pending.append((guild_id, channel_id, added))
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not called from the event loop, ex. in a script. Write now
+            return self.flush()
+
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(CHANNEL_FLUSH_DELAY, self._flush_in_background, loop)
+
+    def _flush_in_background(self, loop):
+        self._flush_handle = None
+        loop.run_in_executor(None, self.flush).add_done_callback(self._flushed)
+
+    def _flushed(self, future):
+        if future.cancelled() or future.exception() is None:
+            return
+
+        # The changes are pending again. Try later
+        print("Could not save the bot channels, retrying in {0} seconds. {1}".format(CHANNEL_FLUSH_DELAY, future.exception()))
+        self._schedule_flush()
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        connection = sqlite3.connect(self.path)
+        # Shared by the shard processes, each writing the channels of its own guilds
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.executescript(SCHEMA)
+        return connection
+
+    def load(self):
+        """
+        Load the registry from SQLite. Returns the number of bot channels loaded
+        """
+        connection = self._connect()
+        try:
+            rows = connection.execute("SELECT guild_id, channel_id FROM bot_channels").fetchall()
+        finally:
+            connection.close()
+
+        guilds = {}
+        for guild_id, channel_id in rows:
+            guilds.setdefault(guild_id, set()).add(channel_id)
+        self.guilds = guilds
+
+        return len(rows)
+
+    def flush(self):
+        """
+        Write the pending changes to SQLite. If it fails they stay pending
+        """
+        with self._flush_lock:
+            with self._pending_lock:
+                pending = self._pending
+                self._pending = []
+
+            if len(pending) == 0:
+                return
+
+            try:
+                connection = self._connect()
+                try:
+                    with connection:
+                        for guild_id, channel_id, added in pending:
+                            if added:
+                                connection.execute("INSERT OR IGNORE INTO bot_channels (guild_id, channel_id) VALUES (?, ?)", (guild_id, channel_id))
+                            else:
+                                connection.execute("DELETE FROM bot_channels WHERE guild_id = ? AND channel_id = ?", (guild_id, channel_id))
+                finally:
+                    connection.close()
+            except BaseException:
+                # Before the changes made since, so they are written in order
+                with self._pending_lock:
+                    self._pending = pending + self._pending
+                raise
 
 # Global Vars
-bot_channels = {}
+registry = ChannelRegistry(CHANNEL_REGISTRY_PATH)
+_started = False
+
+def start():
+    """
+    Load the saved bot channels. Called when the bot starts up, only does anything the first time
+    """
+    global _started
+
+    if _started:
+        return
+    _started = True
+
+    count = registry.load()
+    print("Loaded {0} bot channels".format(count))
 
 # ================================================================================
 # Channel functions
 
+def find_channels(ctx, name):
+    """
+    Returns the text channels of the guild mentioned in the command, or named name
+    """
+    if len(ctx.message.channel_mentions) > 0:
+        return ctx.message.channel_mentions
+
+    name = name.lstrip("#")
+    return [channel for channel in ctx.guild.text_channels if channel.name == name]
+
 async def channel_add(ctx, name):
     """
     Add a bot to a channel via name
     """
 
-    if name in bot_channels:
-        return await ctx.send("Channel already added")
+    found_channels = find_channels(ctx, name)
 
-    channels = ctx.guild.text_channels
+    if len(found_channels) == 0:
+        return await send_queue.send(ctx, "Cannot find channel {0}".format(name))
 
-    found_channels = filter(lambda channel: channel.name == name, channels)
+    added = [registry.add(ctx.guild.id, found.id) for found in found_channels]
 
-    if len(list(found_channels)) > 0:
-        bot_channels[name] = "no"
-        return await ctx.send("Sucessfully added to {0} text channel".format(name))
+    if not any(added):
+        return await send_queue.send(ctx, "Channel already added")
 
-    return await ctx.send("Cannot find channel {0}".format(name))
+    return await send_queue.send(ctx, "Sucessfully added to {0} text channel".format(name))
 
 async def channel_remove(ctx, name):
     """
     Delete a bot from a channel via name
     """
-    
-    channels = ctx.guild.text_channels
-    found_channels = filter(lambda channel: channel.name == name, channels)
 
-    if not (name in bot_channels) and len(list(found_channels)) > 0:
-        return await ctx.send("Cannot delete channel. Channel is not in this channel already")
+    found_channels = find_channels(ctx, name)
+
+    if len(found_channels) == 0:
+        return await send_queue.send(ctx, "Cannot find channel {0}".format(name))
+
+    removed = [registry.remove(ctx.guild.id, found.id) for found in found_channels]
 
-    if len(list(found_channels)) > 0:
-        del bot_channels[name]
-        return await ctx.send("Sucessfully remove bot from {0} text channel".format(name))
+    if not any(removed):
+        return await send_queue.send(ctx, "Cannot delete channel. Channel is not in this channel already")
 
-    return await ctx.send("Cannot find channel {0}".format(name))
\ No newline at end of file
+    return await send_queue.send(ctx, "Sucessfully remove bot from {0} text channel".format(name))
@@ -0,0 +1,32 @@
+import discord
+from discord.ext import commands
+
+# Features
+import metrics
+import send_queue
+
+# Commands for the admins of the bot. Loaded as an extension by index.load_extensions
+
+class Admin(commands.Cog):
+    """
+    Admin commands
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.command(name="stats")
+    async def stats(self, ctx):
+        """
+        Shows the latency of the commands and Drive calls, the error counts and the cache counters.
+        WARNING: Need to be an admin of the guild to issue this command
+        """
+        if not ctx.author.guild_permissions.administrator:
+            return
+
+        # Embed descriptions are limited to 2048 characters
+        embed = discord.Embed(title="Bot Stats", description=metrics.summary()[:2048])
+        return await send_queue.send(ctx, embed=embed)
+
+def setup(bot):
+    bot.add_cog(Admin(bot))
@@ -0,0 +1,66 @@
+import discord
+from discord.ext import commands
+
+# Features
+import channel
+import send_queue
+
+# The commands choosing the channels the bot answers in. Loaded as an extension by index.load_extensions
+
+class Channels(commands.Cog):
+    """
+    Bot channel commands
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.command(name="channel-list")
+    async def channel_list(self, ctx):
+        """
+        Command to list which channels is the bot allowed be issued commands
+        """
+        channels = ctx.guild.text_channels
+        bot_channel_ids = channel.registry.channels(ctx.guild.id)
+
+        bot_active_channels = []
+        bot_nonactive_channels = []
+
+        for curr_channel in channels:
+            if curr_channel.id in bot_channel_ids:
+                bot_active_channels.append(curr_channel.name)
+            else:
+                bot_nonactive_channels.append(curr_channel.name)        
+
+        active_bot_message = "\n".join(bot_active_channels)
+        nonactive_bot_message = "\n".join(bot_nonactive_channels)
+
+        message = "Bot Access Channels\n\n{0}\n\nBot Non Access Channels\n\n{1}".format(active_bot_message, nonactive_bot_message)
+        embed = discord.Embed(title="Bot Permissions channel", description=message)
+        return await send_queue.send(ctx, "", embed=embed)
+
+    @commands.command(name="channel")
+    async def channel_command(self, ctx, flag, query):
+        """
+        Add or remove bot from a specific channel. If added to a specific channel, regular users can issue bot commands. 
+        WARNING: Need to be an admin of the guild to issue this command
+
+        Flags
+        a or add - Add a bot to a channel. Ex. !channel a bool-bol-test
+        d or delete - Remove a bot from a channel. Ex. !channel d bool-bot-test
+        """
+
+        # Make sure user is an admin
+
+        if not ctx.author.guild_permissions.administrator:
+            return
+
+        if flag == "a" or flag == "add":
+            await channel.channel_add(ctx, query)
+        elif flag == "r" or flag == "remove":
+            await channel.channel_remove(ctx, query)
+        else:
+            return await send_queue.send(ctx, "Issues with your request. Are you sure you are entering the right flags")
+
+def setup(bot):
+    bot.add_cog(Channels(bot))
@@ -0,0 +1,133 @@
+import discord
+from discord.ext import commands
+
+# Features
+import drive_async
+import library_index
+import photo
+import selection
+import send_queue
+import video
+from settings import ROOT_PHOTO_FOLDER_ID
+
+# The photo, video and folder commands. Loaded as an extension by index.load_extensions
+
+class Media(commands.Cog):
+    """
+    Photo and video commands
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.command(name="files")
+    async def files(self, ctx):
+        """
+        Command for returning the recent files on google drive.
+        """
+        files = await drive_async.get_recent_files()
+
+        # print(files)
+
+        output = "\n"
+        for file in files:
+            print(file)
+            output += (file["name"] + "\n")
+
+        await send_queue.send(ctx, output)
+
+    @commands.command(name="phototest")
+    async def phototest(self, ctx):
+        """
+        Testing if local photo can be uploaded to discord. Type !phototest
+        """
+        file_buffered_io_stream = open("./bool_bot/files/red.jpeg", "rb")
+        file_photo = discord.File(file_buffered_io_stream, filename="red.jpeg")
+
+        embed = discord.Embed(title="The Gang", description="Wow an uploaded image")
+        embed.set_image(url="attachment://red.jpeg")
+
+        await send_queue.send(ctx, "Sending Photo", file=file_photo, embed=embed)
+
+    @commands.command(name="photo")
+    async def photo_command(self, ctx, search_option, query):
+        """
+        Photo commands. Refer below for commands.
+
+        Flags
+
+        s or search - Search for a photo via name. Ex. !photo s kurt
+        e or exact - Return a photo with exact name. Ex. !photo e davidmald.jpg
+        i or id - Return a photo by google drive id. Ex. !photo i 1CeUaHMY5-Fm5XD36u3QWUZLaG6qAZUPq
+        r or random - Return a photo randomly from a query. Ex. !photo r justin
+        rf or randomfile - Return a photo randomly from a specified folder. Ex. !photo rf test
+
+        """
+
+        if search_option == "s" or search_option == "search":
+            # Searches for photos with name
+            await photo.photo_search(ctx, query)
+        elif search_option == "e" or search_option == "exact":
+            # Find and return photo with exact name
+            await photo.photo_name(ctx, query)
+        elif search_option == "i" or search_option == "id":
+            # Find and return photo with google id
+            await photo.photo_id(ctx, query)
+        elif search_option == "r" or search_option == "random":
+            # Return random photo from recent files list
+            await photo.photo_random(ctx, query)
+        elif search_option == "rf" or search_option == "randomfile":
+            # Return random photo from a specified folder
+            await photo.folder_random(ctx, query)
+        else:
+            await send_queue.send(ctx, "Something is wrong with your query, most likely that the option you provided is not valid")
+
+    @commands.command(name="video")
+    async def video_command(self, ctx, search_option, query):
+        """
+        Video commands. 
+
+        Flags
+
+        r or random - Searches for a video with query and return a random one. Ex. !video r jey
+        """
+        if search_option == "r" or search_option == "random":
+            await video.video_random(ctx, query)
+
+    @commands.command(name="listrequests")
+    async def list_requests(self, ctx):
+        """
+        A development command to inspect the photo requests
+        """
+        await photo.print_photo_requests()
+
+    @commands.command(name="ls")
+    async def ls(self, ctx):
+        """
+        Lists the subdirectories in root photo folder, including nested ones. Useful for finding a random photo in a folder
+        """
+        if library_index.library.ready:
+            # Folder tree from the library index, no Drive call
+            lines = ["{0}{1}. {2}".format("    " * depth, i, folder["name"])
+                     for i, (depth, folder) in enumerate(library_index.library.folder_listing())]
+        else:
+            folder_ids, folder_names = await drive_async.get_folder_ids(ROOT_PHOTO_FOLDER_ID)
+            lines = ["{0}. {1}".format(i, name) for i, name in enumerate(folder_names)]
+
+        # Paged with n and p if it doesn't fit in one embed
+        await photo.send_folder_listing(ctx, lines)
+
+    @commands.Cog.listener()
+    async def on_selection(self, message):
+        """
+        Dispatched by on_message for a message answering a !photo s search or paging a !ls listing
+        """
+        if (message.author.id, message.channel.id) in photo.photo_requests:
+            await photo.process_search_request(message)
+        else:
+            await photo.process_listing_request(message)
+
+def setup(bot):
+    # Messages answering a !photo s search or paging a !ls listing are routed to on_selection
+    bot.selections = selection.PendingKeys(photo.photo_requests, photo.folder_listings)
+    bot.add_cog(Media(bot))
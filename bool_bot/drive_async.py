@@ -0,0 +1,80 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# Features
+import google_drive_feat
+import drive_limits
+from settings import DRIVE_THREAD_POOL_SIZE
+
+# The google_drive_feat functions are blocking (googleapiclient uses httplib2). Calling them from a coroutine
+# freezes the whole event loop, heartbeats included. This module runs them on a bounded thread pool instead so
+# concurrent commands overlap their Drive I/O.
+
+# Global Vars
+_executor = None
+_pool_size = DRIVE_THREAD_POOL_SIZE
+
+# ================================================================================
+# Thread pool
+
+def get_executor():
+    """
+    Returns the thread pool used for Drive calls, creating it the first time it is needed
+    """
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=_pool_size, thread_name_prefix="drive")
+
+    return _executor
+
+def set_pool_size(size):
+    """
+    Change the number of threads used for Drive calls. Calls already running finish on the old pool.
+
+    size : Integer - The maximum number of Drive calls running at the same time
+    """
+    global _executor, _pool_size
+
+    if size < 1:
+        raise ValueError("Drive thread pool size must be at least 1")
+
+    old_executor = _executor
+    _pool_size = size
+    _executor = None
+
+    if old_executor is not None:
+        old_executor.shutdown(wait=False)
+
+async def run(func, *args, **kwargs):
+    """
+    Run a blocking function on the Drive thread pool and wait for its result
+
+    func : Function - The blocking function
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+# ================================================================================
+# Drive functions. Same arguments and return values as in google_drive_feat
+
+async def get_recent_files():
+    return await run(google_drive_feat.get_recent_files)
+
+async def get_file_id(filename):
+    return await run(google_drive_feat.get_file_id, filename)
+
+async def download_file(fileId, fileName):
+    return await run(google_drive_feat.download_file, fileId, fileName)
+
+async def get_folder_ids(root_folder_id):
+    return await run(google_drive_feat.get_folder_ids, root_folder_id)
+
+async def get_folder_contents(query):
+    return await run(google_drive_feat.get_folder_contents, query)
+
+async def get_files_search(query, video=False):
+    # Many users searching the same thing at once cost one search
+    found_files = await drive_limits.async_coalescer.call(("get_files_search", query, video), run, google_drive_feat.get_files_search, query, video=video)
+    return list(found_files)
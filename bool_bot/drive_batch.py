@@ -0,0 +1,203 @@
+import asyncio
+import time
+
+# Features
+import google_drive_feat
+import drive_async
+import drive_limits
+import metrics
+import query_cache
+from settings import ROOT_PHOTO_FOLDER_ID, DRIVE_BATCH_WINDOW
+
+# Coalesces Drive metadata requests (files().get and files().list) into batch HTTP requests.
+#
+# Requests submitted within DRIVE_BATCH_WINDOW seconds of each other, from one command or many concurrent ones, are
+# sent to Drive as a single batch request. Under bursty load many users cost one round trip instead of one each.
+# Media downloads can't be batched and still go through google_drive_feat.
+
+# Most requests Drive accepts in one batch
+MAX_BATCH_SIZE = 100
+
+# ================================================================================
+# Batcher
+
+class DriveBatcher(object):
+    """
+    Collects requests on the event loop and sends them in batches on the Drive thread pool
+    """
+
+    def __init__(self, window=DRIVE_BATCH_WINDOW, max_size=MAX_BATCH_SIZE):
+        self.window = window
+        self.max_size = max_size
+
+        # Counters
+        self.requests = 0
+        self.batches = 0
+
+        self._pending = []
+        self._flush_handle = None
+
+    async def submit(self, build_request):
+        """
+        Send a request in the next batch and wait for its response
+
+        build_request : Function - Takes the Drive service and returns the request. Ex. lambda service: service.files().get(fileId=id)
+
+        return : Object - The response of the request
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        self._pending.append((build_request, future))
+        self.requests += 1
+
+        if len(self._pending) >= self.max_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self.flush)
+
+        return await future
+
+    def flush(self):
+        """
+        Send the pending requests now
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if len(self._pending) == 0:
+            return
+
+        batch = self._pending
+        self._pending = []
+        self.batches += 1
+
+        asyncio.ensure_future(self._send(batch))
+
+    async def _send(self, batch):
+        try:
+            results = await drive_async.run(execute_batch, [build_request for build_request, future in batch])
+        except Exception as exception:
+            results = [(None, exception)] * len(batch)
+
+        for (build_request, future), (response, exception) in zip(batch, results):
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(response)
+
+@metrics.timed("drive", "batch")
+def execute_batch(build_requests):
+    """
+    Send requests in one batch request. Blocking, run it on the Drive thread pool.
+
+    build_requests : Array<Function> - Functions taking the Drive service and returning a request
+
+    return : Array<(Object, Exception)> - The response or the exception of every request, in order
+    """
+    service = google_drive_feat.get_service()
+
+    if len(build_requests) == 1:
+        # Not worth the batch overhead
+        try:
+            return [(drive_limits.execute(build_requests[0](service)), None)]
+        except Exception as exception:
+            return [(None, exception)]
+
+    results = [(None, None)] * len(build_requests)
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    # Drive throttles the requests of a batch one by one. Only the throttled ones are sent again
+    pending = list(range(len(build_requests)))
+    attempt = 0
+    while True:
+        batch = service.new_batch_http_request()
+        for i in pending:
+            batch.add(build_requests[i](service), callback=callback, request_id=str(i))
+        drive_limits.call(batch.execute, cost=len(pending))
+
+        retry = [i for i in pending if results[i][1] is not None and drive_limits.is_retryable(results[i][1])]
+        if len(retry) == 0 or attempt >= drive_limits.DRIVE_MAX_RETRIES:
+            return results
+
+        metrics.increment("drive_retries", "batch", len(retry))
+        time.sleep(drive_limits.retry_delay(attempt, results[retry[0]][1]))
+        pending = retry
+        attempt += 1
+
+# Global Vars
+batcher = DriveBatcher()
+
+metrics.register_collector("drive_batch", lambda: {"requests": batcher.requests, "batches": batcher.batches})
+
+# ================================================================================
+# Drive functions. Same results as in google_drive_feat, but the requests are batched
+
+async def list_files(q, fields):
+    """
+    Get every file matching a query, following nextPageToken. Same as google_drive_feat.list_files
+    """
+    cached = query_cache.cache.get(q, fields)
+    if cached is not None:
+        return list(cached)
+
+    # The same listing asked by concurrent commands is only sent once
+    generation = query_cache.cache.generation
+    files = await drive_limits.async_coalescer.call(("list_files", q, fields), _list_files, q, fields)
+    query_cache.cache.put(q, fields, files, generation)
+
+    return list(files)
+
+async def _list_files(q, fields):
+    files = []
+    page_token = None
+    while True:
+        response = await batcher.submit(lambda service: service.files().list(
+            q=q,
+            pageSize=google_drive_feat.PAGE_SIZE,
+            spaces="drive",
+            fields='nextPageToken, files({0})'.format(fields),
+            pageToken=page_token,
+        ))
+        files.extend(response["files"])
+
+        page_token = response.get("nextPageToken")
+        if page_token is None:
+            return files
+
+async def get_file_id(filename):
+    response = await batcher.submit(lambda service: service.files().list(
+        q="name = '{0}'".format(google_drive_feat.escape_query(filename)),
+        pageSize=1,
+        spaces="drive",
+        fields='nextPageToken, files(id, name, webViewLink)',
+    ))
+
+    return response["files"]
+
+async def get_file_metadata(fileId):
+    return await batcher.submit(lambda service: service.files().get(
+        fileId=fileId,
+        fields=google_drive_feat.METADATA_FIELDS,
+    ))
+
+async def get_folder_contents(query):
+    folders = await list_files(
+        "'{0}' in parents and name = '{1}' and mimeType = '{2}' and trashed = false".format(
+            google_drive_feat.escape_query(ROOT_PHOTO_FOLDER_ID), google_drive_feat.escape_query(query), google_drive_feat.FOLDER_MIME_TYPE),
+        "id")
+
+    if len(folders) > 1:
+        return "Multiple Folders"
+
+    if len(folders) == 0:
+        return "No Folder"
+
+    return await list_files(
+        "'{0}' in parents and trashed = false and {1}".format(google_drive_feat.escape_query(folders[0]["id"]), google_drive_feat.PHOTO_CONDITION),
+        "id, name, webViewLink")
@@ -0,0 +1,278 @@
+import concurrent.futures
+import hashlib
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from googleapiclient.errors import HttpError
+
+# Features
+import google_drive_feat
+import drive_limits
+import metrics
+from settings import DOWNLOAD_CHUNK_SIZE, DOWNLOAD_PARALLELISM, DOWNLOAD_RESUMES
+
+# Downloads Drive files in byte ranges fetched at the same time.
+#
+# The first range tells the size of the file, unless the caller knows it, then the rest are fetched
+# DOWNLOAD_PARALLELISM at a time over the pooled Drive connections of drive_http. A range that fails (throttled,
+# dropped connection) is fetched again from the last byte received, and a download that fails anyway is resumed
+# DOWNLOAD_RESUMES times, without starting the whole download over. Files of more than one range are checked against
+# their md5Checksum once downloaded, looked up in Drive if the caller doesn't know it. The bytes and time of every
+# download are counted, so the throughput shows in !stats.
+
+CONTENT_RANGE = re.compile(r"bytes (?:(\d+)-\d+|\*)/(\d+)")
+
+class ChecksumError(Exception):
+    """
+    A downloaded file doesn't match the md5Checksum Drive has for it
+    """
+
+class DownloadStats(object):
+    """
+    Thread safe download counters
+    """
+
+    def __init__(self):
+        self.downloads = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.ranges = 0
+        self.resumed = 0
+        self.checksum_failures = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, amount in counts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "downloads": self.downloads,
+                "bytes": self.bytes,
+                "ranges": self.ranges,
+                "resumed": self.resumed,
+                "checksum_failures": self.checksum_failures,
+                "mb_per_second": self.bytes / self.seconds / (1024 * 1024) if self.seconds > 0 else 0.0,
+            }
+
+# Global Vars
+stats = DownloadStats()
+
+metrics.register_collector("downloads", lambda: stats.to_dict())
+
+# Threads fetching the ranges. Separate from the drive_async pool, which starts the downloads
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DOWNLOAD_PARALLELISM, thread_name_prefix="drive-download")
+
+        return _executor
+
+class RangeDownload(object):
+    """
+    Download of one file in ranges. run() only fetches what is not downloaded yet, so a download that failed is
+    resumed by calling it again
+    """
+
+    def __init__(self, file_id, target, md5=None, chunk_size=DOWNLOAD_CHUNK_SIZE, parallelism=DOWNLOAD_PARALLELISM,
+                 size=None):
+        """
+        file_id : String - The Drive file id
+        target : File - Where to write the contents. Seekable, ex. a google_drive_feat.SpooledBuffer
+        md5 : String - The md5Checksum of the file. Looked up in Drive if the file is more than one range
+        chunk_size : Integer - Bytes per range
+        parallelism : Integer - Ranges fetched at the same time
+        size : Integer - The size of the file, if known. Then the first range is fetched with the others
+        """
+        self.file_id = file_id
+        self.target = target
+        self.md5 = md5
+        self.chunk_size = chunk_size
+        self.parallelism = parallelism
+
+        # Known once the first range is fetched, if not given
+        self.size = int(size) if size is not None else None
+
+        # range start -> bytes of the range written to target
+        self.received = {}
+
+        self._lock = threading.Lock()
+
+    def missing(self):
+        """
+        Returns the starts of the ranges not completely downloaded
+        """
+        if self.size is None:
+            return [0]
+
+        return [start for start in range(0, self.size, self.chunk_size)
+                if self.received.get(start, 0) < min(self.chunk_size, self.size - start)]
+
+    def run(self):
+        """
+        Fetch the missing ranges and check the file. Blocking.
+
+        return : Integer - The size of the file
+        """
+        start_time = time.perf_counter()
+        resumed = len(self.received) > 0
+        before = sum(self.received.values())
+
+        try:
+            if self.size is None:
+                self._fetch(0)
+
+            missing = self.missing()
+            checksum = None
+            if self.md5 is None and self.size > self.chunk_size:
+                checksum = _get_executor().submit(self._lookup_md5)
+
+            if len(missing) <= 1 or self.parallelism <= 1:
+                for start in missing:
+                    self._fetch(start)
+            else:
+                self._fetch_parallel(missing)
+
+            if checksum is not None:
+                self.md5 = checksum.result()
+            self._verify()
+        finally:
+            stats.add(bytes=sum(self.received.values()) - before, seconds=time.perf_counter() - start_time,
+                      resumed=1 if resumed else 0)
+
+        stats.add(downloads=1)
+        return self.size
+
+    def _fetch_parallel(self, starts):
+        # The executor is shared by every download. At most parallelism ranges of this one are submitted at a time
+        slots = threading.BoundedSemaphore(self.parallelism)
+        futures = []
+        for start in starts:
+            slots.acquire()
+            if any(future.done() and future.exception() is not None for future in futures):
+                # No use fetching the rest, run() is called again
+                slots.release()
+                break
+
+            future = _get_executor().submit(self._fetch, start)
+            future.add_done_callback(lambda future: slots.release())
+            futures.append(future)
+
+        concurrent.futures.wait(futures)
+        for future in futures:
+            future.result()
+
+    def _fetch(self, start):
+        """
+        Fetch one range, continuing from the last byte received if it was fetched before
+        """
+        end = start + self.chunk_size if self.size is None else min(start + self.chunk_size, self.size)
+        offset = start + self.received.get(start, 0)
+
+        while offset < end:
+            first, data, size = drive_limits.call(self._request, offset, end - 1)
+            stats.add(ranges=1)
+
+            if self.size is None:
+                self.size = size
+            elif size != self.size:
+                # The size given was out of date. Start over with the one Drive sent
+                expected = self.size
+                with self._lock:
+                    self.size = None
+                    self.received.clear()
+                raise ChecksumError("Download of {0} is {1} bytes, not {2}".format(self.file_id, size, expected))
+            end = min(end, self.size)
+
+            # Drive may send the whole file, or less than asked
+            data = data[offset - first:end - first]
+            if len(data) == 0:
+                if offset >= end:
+                    break
+                raise ConnectionError("Download of {0} stopped at byte {1}".format(self.file_id, offset))
+
+            with self._lock:
+                self.target.seek(offset)
+                self.target.write(data)
+                offset += len(data)
+                self.received[start] = offset - start
+
+    def _request(self, start, end):
+        """
+        Send a Range request. Returns the position of the data in the file, the data and the size of the file
+        """
+        request = google_drive_feat.get_service().files().get_media(fileId=self.file_id)
+        headers = dict(request.headers)
+        headers["range"] = "bytes={0}-{1}".format(start, end)
+
+        request_start = time.perf_counter()
+        response, content = request.http.request(request.uri, "GET", headers=headers)
+        metrics.observe("drive", "download_range", time.perf_counter() - request_start)
+
+        if response.status == 200:
+            return 0, content, len(content)
+
+        match = CONTENT_RANGE.match(response.get("content-range", ""))
+        if response.status in (206, 416) and match is not None:
+            first = int(match.group(1)) if match.group(1) is not None else start
+            return first, content if response.status == 206 else b"", int(match.group(2))
+
+        raise HttpError(response, content, uri=request.uri)
+
+    def _lookup_md5(self):
+        return google_drive_feat.get_file_metadata(self.file_id).get("md5Checksum")
+
+    def _verify(self):
+        if not self.md5:
+            return
+
+        digest = hashlib.md5()
+        with self._lock:
+            self.target.seek(0)
+            remaining = self.size
+            while remaining > 0:
+                data = self.target.read(min(remaining, 1024 * 1024))
+                if len(data) == 0:
+                    break
+                digest.update(data)
+                remaining -= len(data)
+
+        if digest.hexdigest() != self.md5:
+            stats.add(checksum_failures=1)
+            # Nothing downloaded can be trusted, the next run() starts over
+            self.received.clear()
+            raise ChecksumError("Download of {0} doesn't match its md5Checksum".format(self.file_id))
+
+def download(file_id, target, md5=None, size=None, resumes=DOWNLOAD_RESUMES):
+    """
+    Download a file in ranges into target. Blocking, run it on the Drive thread pool.
+
+    file_id : String - The Drive file id
+    target : File - Seekable file the contents are written to
+    md5 : String - The md5Checksum of the file, if known
+    size : Integer - The size of the file, if known
+    resumes : Integer - How many times a failed download is resumed, fetching only the ranges still missing
+
+    return : Integer - The number of bytes downloaded
+    """
+    range_download = RangeDownload(file_id, target, md5, size=size)
+
+    attempt = 0
+    while True:
+        try:
+            return range_download.run()
+        except Exception as exception:
+            if attempt >= resumes or not (drive_limits.is_retryable(exception) or isinstance(exception, ChecksumError)):
+                raise
+
+            time.sleep(drive_limits.retry_delay(attempt, exception))
+            attempt += 1
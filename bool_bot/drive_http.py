@@ -0,0 +1,141 @@
+import threading
+import time
+
+import httplib2
+
+import metrics
+from settings import DRIVE_MAX_CONNECTIONS, DRIVE_HTTP_TIMEOUT, DRIVE_CONNECTION_IDLE_TIMEOUT
+
+# Pooled HTTP transport shared by every Drive call.
+#
+# httplib2.Http keeps its connections open between requests but can't be used by two threads at once, so every
+# thread used to build its own service, and a new thread (or a download_link call) did new TCP and TLS handshakes to
+# googleapis.com. PooledHttp is a thread safe stand in for httplib2.Http: a request borrows an idle httplib2.Http
+# of the host, so its kept alive connection is reused, and gives it back when done. At most DRIVE_MAX_CONNECTIONS
+# requests run at the same time per host, the others wait for a connection. Connections idle for more than
+# DRIVE_CONNECTION_IDLE_TIMEOUT seconds are closed, since the server has likely dropped them. The connections opened
+# and reused are counted.
+
+class PooledHttp(object):
+    """
+    Thread safe httplib2.Http keeping a pool of connections per host. Pass it to googleapiclient's build(http=...) or
+    google_auth_httplib2.AuthorizedHttp(http=...)
+    """
+
+    def __init__(self, max_per_host=DRIVE_MAX_CONNECTIONS, timeout=DRIVE_HTTP_TIMEOUT,
+                 idle_timeout=DRIVE_CONNECTION_IDLE_TIMEOUT):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+
+        # Read by googleapiclient and google_auth_httplib2 like on httplib2.Http
+        self.follow_redirects = True
+        self.redirect_codes = httplib2.REDIRECT_CODES
+
+        # Counters
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+
+        # host -> [(httplib2.Http, last used)], most recently used last
+        self._idle = {}
+        # host -> Semaphore of the connections left
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def stats(self):
+        """
+        Returns the connection counters
+        """
+        with self._lock:
+            return {
+                "opened": self.opened,
+                "reused": self.reused,
+                "closed": self.closed,
+                "idle": sum(len(idle) for idle in self._idle.values()),
+            }
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=httplib2.DEFAULT_MAX_REDIRECTS,
+                connection_type=None):
+        """
+        Same as httplib2.Http.request. Waits for a connection if max_per_host requests to the host are running
+        """
+        scheme, authority, request_uri, defrag_uri = httplib2.urlnorm(uri)
+        host = scheme + ":" + authority
+
+        slots = self._host_slots(host)
+        slots.acquire()
+        try:
+            http = self._checkout(host)
+            connection = http.connections.get(host)
+            reused = connection is not None and connection.sock is not None
+
+            with self._lock:
+                if reused:
+                    self.reused += 1
+                else:
+                    self.opened += 1
+
+            try:
+                return http.request(uri, method, body=body, headers=headers, redirections=redirections,
+                                    connection_type=connection_type)
+            finally:
+                self._checkin(host, http)
+        finally:
+            slots.release()
+
+    def close(self):
+        """
+        Close every idle connection
+        """
+        with self._lock:
+            idle = [http for entries in self._idle.values() for http, used in entries]
+            self._idle = {}
+            self.closed += len(idle)
+
+        for http in idle:
+            http.close()
+
+    def _host_slots(self, host):
+        with self._lock:
+            slots = self._slots.get(host)
+            if slots is None:
+                slots = self._slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return slots
+
+    def _checkout(self, host):
+        now = time.monotonic()
+        http = None
+
+        with self._lock:
+            entries = self._idle.get(host, [])
+
+            # The least recently used are first
+            fresh = 0
+            while fresh < len(entries) and now - entries[fresh][1] > self.idle_timeout:
+                fresh += 1
+            stale = [candidate for candidate, used in entries[:fresh]]
+            del entries[:fresh]
+            self.closed += len(stale)
+
+            if len(entries) > 0:
+                http = entries.pop()[0]
+
+        for candidate in stale:
+            candidate.close()
+
+        if http is None:
+            http = httplib2.Http(timeout=self.timeout)
+            http.follow_redirects = self.follow_redirects
+            http.redirect_codes = self.redirect_codes
+
+        return http
+
+    def _checkin(self, host, http):
+        with self._lock:
+            self._idle.setdefault(host, []).append((http, time.monotonic()))
+
+# Global Vars
+pool = PooledHttp()
+
+metrics.register_collector("drive_connections", lambda: pool.stats())
@@ -0,0 +1,250 @@
+import asyncio
+import concurrent.futures
+import http.client
+import json
+import random
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+import metrics
+from settings import DRIVE_RATE_LIMIT, DRIVE_RATE_BURST, DRIVE_MAX_RETRIES, DRIVE_RETRY_BASE_DELAY, DRIVE_RETRY_MAX_DELAY
+
+# Keeps the bot within its Drive quota when load spikes.
+#
+# Every Drive request takes a token from a bucket refilled at DRIVE_RATE_LIMIT tokens per second, so a burst of
+# commands is spread out instead of being throttled by Drive. Requests Drive throttles anyway (403
+# userRateLimitExceeded, 429) or that fail on its side (5xx, dropped connections) are retried up to DRIVE_MAX_RETRIES
+# times, waiting a random time up to an exponentially growing delay so retries from many threads don't arrive
+# together. Identical requests running at the same time (ex. many users searching before the library index is built)
+# are sent once and share the result.
+
+# 403 reasons that mean the request was throttled, not refused
+RATE_LIMIT_REASONS = frozenset(["userRateLimitExceeded", "rateLimitExceeded", "sharingRateLimitExceeded"])
+
+# Statuses worth retrying
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# ================================================================================
+# Rate limit
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket. acquire() waits until the tokens are available, reserve() says how long to wait
+    """
+
+    def __init__(self, rate=DRIVE_RATE_LIMIT, burst=DRIVE_RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, count=1):
+        """
+        Take tokens, waiting for them if the bucket is empty
+
+        count : Integer - The number of tokens. Ex. the number of requests in a batch
+
+        return : Float - The seconds waited
+        """
+        wait = self.reserve(count)
+
+        if wait > 0:
+            metrics.increment("drive_rate_limited", "waits")
+            time.sleep(wait)
+
+        return wait
+
+    def reserve(self, count=1):
+        """
+        Take tokens without waiting for them. Used from the event loop, which can't block
+
+        return : Float - The seconds to wait before they can be used
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            # Tokens are reserved even if they are not there yet, so waiting callers are served in order
+            self.tokens -= count
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+# Global Vars
+limiter = TokenBucket()
+
+def set_rate_limit(rate, burst=DRIVE_RATE_BURST):
+    """
+    Change the Drive rate limit
+
+    rate : Float - Requests per second. 0 for no limit
+    burst : Integer - Requests sent at once after a quiet period
+    """
+    global limiter
+
+    limiter = TokenBucket(rate, burst)
+
+# ================================================================================
+# Retries
+
+def error_reason(exception):
+    """
+    Returns the reason Drive gave for an error. Ex. "userRateLimitExceeded", or "" if there is none
+    """
+    try:
+        content = exception.content
+        data = json.loads(content.decode("utf-8") if isinstance(content, bytes) else content)
+        return data["error"]["errors"][0]["reason"]
+    except (AttributeError, ValueError, KeyError, IndexError, TypeError):
+        return ""
+
+def is_retryable(exception):
+    """
+    Returns True if a request that failed with the exception may succeed if sent again
+    """
+    if isinstance(exception, HttpError):
+        status = exception.resp.status
+        return status in RETRY_STATUSES or (status == 403 and error_reason(exception) in RATE_LIMIT_REASONS)
+
+    # IncompleteRead: the connection was closed in the middle of a response
+    return isinstance(exception, (ConnectionError, TimeoutError, http.client.IncompleteRead))
+
+def retry_delay(attempt, exception=None):
+    """
+    Returns the seconds to wait before the next try: random up to a delay doubled on every attempt ("full jitter"),
+    and at least the Retry-After Drive asked for
+    """
+    delay = random.uniform(0, min(DRIVE_RETRY_MAX_DELAY, DRIVE_RETRY_BASE_DELAY * 2 ** attempt))
+
+    retry_after = None
+    if isinstance(exception, HttpError):
+        retry_after = exception.resp.get("retry-after")
+    try:
+        delay = max(delay, min(DRIVE_RETRY_MAX_DELAY, float(retry_after)))
+    except (TypeError, ValueError):
+        pass
+
+    return delay
+
+def _count_retry(exception):
+    if isinstance(exception, HttpError):
+        metrics.increment("drive_retries", error_reason(exception) or str(exception.resp.status))
+    else:
+        metrics.increment("drive_retries", type(exception).__name__)
+
+def call(func, *args, cost=1, **kwargs):
+    """
+    Call a function sending a Drive request, within the rate limit, retrying it if it is throttled or fails on the
+    Drive side. Blocking.
+
+    Ex. call(service.files().get(fileId=id).execute)
+
+    func : Function - Sends the request and returns its response
+    cost : Integer - The number of Drive requests func sends
+
+    return : Object - What func returns
+    """
+    attempt = 0
+    while True:
+        limiter.acquire(cost)
+        try:
+            return func(*args, **kwargs)
+        except Exception as exception:
+            if attempt >= DRIVE_MAX_RETRIES or not is_retryable(exception):
+                raise
+
+            _count_retry(exception)
+            time.sleep(retry_delay(attempt, exception))
+            attempt += 1
+
+def execute(request):
+    """
+    Execute a Drive request with call()
+
+    request : HttpRequest - Ex. service.files().list(q=q)
+
+    return : Object - The response
+    """
+    return call(request.execute)
+
+# ================================================================================
+# Coalescing
+
+class Coalescer(object):
+    """
+    Runs identical blocking calls made at the same time from different threads once. Callers share the result, so
+    they must not modify it
+    """
+
+    def __init__(self):
+        # Counter. The number of calls that waited on another one instead of running
+        self.shared = 0
+
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def call(self, key, func, *args, **kwargs):
+        """
+        Returns func(*args, **kwargs), or the result of the call with the same key already running
+
+        key : Object - Identifies the call. Ex. the Drive query and fields
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            waiting = future is not None
+            if waiting:
+                self.shared += 1
+            else:
+                future = self._inflight[key] = concurrent.futures.Future()
+
+        if waiting:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as exception:
+            future.set_exception(exception)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+class AsyncCoalescer(object):
+    """
+    Runs identical coroutines awaited at the same time once. Callers share the result, so they must not modify it.
+    Used from the event loop only
+    """
+
+    def __init__(self):
+        # Counter. The number of calls that waited on another one instead of running
+        self.shared = 0
+
+        self._inflight = {}
+
+    async def call(self, key, func, *args, **kwargs):
+        """
+        Returns await func(*args, **kwargs), or the result of the call with the same key already running
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.shared += 1
+        else:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        # A cancelled caller must not cancel the call the others are waiting on
+        return await asyncio.shield(task)
+
+# Global Vars
+coalescer = Coalescer()
+async_coalescer = AsyncCoalescer()
+
+metrics.register_collector("drive_limits", lambda: {"coalesced": coalescer.shared + async_coalescer.shared})
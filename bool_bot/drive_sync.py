@@ -0,0 +1,112 @@
+import asyncio
+
+# Features
+import google_drive_feat
+import drive_async
+import library_index
+import query_cache
+import sharding
+from settings import DRIVE_SYNC_INTERVAL, DRIVE_SYNC_MAX_BACKOFF
+
+# Keeps the library index fresh without listing the whole photo folder again. Every DRIVE_SYNC_INTERVAL seconds the
+# Drive changes feed is polled from the saved start page token and only the adds, renames, description edits and
+# trashes are applied. A poll costs one round trip when nothing changed, whatever the size of the library. Only the
+# sharding leader polls, the other shard processes load the index again when the leader saved changes.
+
+# Global Vars
+_task = None
+
+# ================================================================================
+# Sync functions
+
+def sync_once(library):
+    """
+    Poll the changes feed once and apply the changes to the library. Blocking, run it on the Drive thread pool.
+
+    library : LibraryIndex - The index to update
+
+    return : Integer - The number of changes applied
+    """
+    if library.page_token is None:
+        # Nothing to compare with yet. Start following the feed from now on
+        library.apply_changes([], google_drive_feat.get_start_page_token())
+        return 0
+
+    changes, page_token = google_drive_feat.get_changes(library.page_token)
+
+    # Listings cached before the changes are stale
+    query_cache.cache.invalidate_changes(changes)
+
+    return library.apply_changes(changes, page_token)
+
+def next_delay(delay, failed, interval=DRIVE_SYNC_INTERVAL, max_backoff=DRIVE_SYNC_MAX_BACKOFF):
+    """
+    Returns how long to wait before the next poll. Doubles after every failure, up to max_backoff.
+
+    delay : Float - The last delay
+    failed : Boolean - If the last poll failed
+    """
+    if not failed:
+        return interval
+
+    return min(max(delay, interval) * 2, max_backoff)
+
+async def sync_loop(library):
+    """
+    Poll the changes feed forever. Runs on the bot event loop
+    """
+    delay = DRIVE_SYNC_INTERVAL
+
+    while True:
+        await asyncio.sleep(delay)
+
+        # Another shard process keeps the index up to date. Takes over if it stopped
+        if not sharding.leader.acquire():
+            await follow(library)
+            continue
+
+        # Wait for the startup build, the index has nothing to apply changes to yet
+        if not library.ready:
+            continue
+
+        try:
+            count = await drive_async.run(sync_once, library)
+            if count > 0:
+                print("Library index synced {0} changes".format(count))
+            delay = next_delay(delay, False)
+        except Exception as exception:
+            delay = next_delay(delay, True)
+            print("Library index sync failed, retrying in {0} seconds. {1}".format(delay, exception))
+
+async def follow(library):
+    """
+    Load the index again if the leader saved changes to it
+    """
+    try:
+        if await drive_async.run(library.reload_if_changed):
+            # Listings cached before the change may be stale
+            query_cache.cache.invalidate()
+            print("Library index reloaded with {0} files".format(len(library)))
+    except Exception as exception:
+        print("Could not reload the library index. {0}".format(exception))
+
+def start():
+    """
+    Start the background sync task. Called when the bot starts up, does nothing if it is already running
+    """
+    global _task
+
+    if _task is not None and not _task.done():
+        return
+
+    _task = asyncio.ensure_future(sync_loop(library_index.library))
+
+def stop():
+    """
+    Stop the background sync task
+    """
+    global _task
+
+    if _task is not None:
+        _task.cancel()
+        _task = None
@@ -0,0 +1,554 @@
+import collections
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+# In-process stand in for the Drive v3 service returned by googleapiclient's build(). Used by the tests and the
+# benchmarks so nothing needs Google Drive credentials or network access.
+#
+# Plug it in with google_drive_feat.set_service(FakeDrive()). Supports files().list with the subset of the query
+# language google_drive_feat uses ('x' in parents, name = 'x', mimeType = 'x', trashed = false, and, or, not,
+# parentheses) with nextPageToken pagination, files().get, changes(), files().get_media (with Range requests, so
+# MediaIoBaseDownload works) and batch requests. Every execute() and downloaded chunk sleeps latency seconds, and
+# downloads bandwidth bytes per second if set, and is counted in calls. throttle() makes the next requests fail like
+# Drive does when the quota is exceeded, and cut_downloads() cuts the next downloads short like a dropped connection.
+# add_library() fills the drive with a generated photo library.
+#
+# File contents are generated from the file id unless given, so a big library costs no memory.
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# Words the names and descriptions of add_library are made of
+LIBRARY_WORDS = ("justin", "kurt", "jey", "alex", "david", "beach", "party", "game", "night", "swim", "dinner",
+                 "birthday", "trip", "school", "dog", "cat", "snow", "summer", "camp", "concert")
+
+RANGE = re.compile(r"bytes=(\d+)-(\d*)")
+
+# ================================================================================
+# Fake service
+
+class FakeDrive(object):
+    """
+    Fake Drive v3 service holding an in-memory file tree
+    """
+
+    def __init__(self, latency=0.0, max_page_size=1000, file_size=1024, bandwidth=None):
+        """
+        latency : Float - Seconds every request takes
+        max_page_size : Integer - The most files returned per files().list page
+        file_size : Integer - Bytes of the files added without contents
+        bandwidth : Integer - Bytes per second of downloads. Unlimited if None
+        """
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.file_size = file_size
+        self.bandwidth = bandwidth
+
+        # id -> file. Files have id, name, mimeType, parents, trashed and optionally description
+        self.items = collections.OrderedDict()
+        self.calls = collections.Counter()
+
+        # parent id -> ids of its children, so listing a folder doesn't look at every file
+        self.children = collections.defaultdict(list)
+
+        self._ids = itertools.count(1)
+        self._clock = itertools.count(1)
+        self._lock = threading.Lock()
+
+        # Errors the next requests fail with, as (status, reason)
+        self._failures = collections.deque()
+
+        # Bytes sent by the next cut downloads
+        self._cuts = collections.deque()
+
+        # id -> contents, for the files added with contents
+        self.contents = {}
+
+        # Ids of the files added or modified, in order. Positions in it are the changes page tokens
+        self.change_log = []
+
+    def add_folder(self, name, parent=None):
+        """
+        Add a folder. Returns its id
+        """
+        return self.add_file(name, parent, mimeType=FOLDER_MIME_TYPE)
+
+    def add_file(self, name, parent=None, mimeType='image/jpeg', description=None, content=None, size=None):
+        """
+        Add a file. Returns its id
+
+        content : Bytes - The contents of the file. Generated if None
+        size : Integer - The size of the generated contents. file_size if None
+        """
+        id = "id{0}".format(next(self._ids))
+        item = {
+            "id": id,
+            "name": name,
+            "mimeType": mimeType,
+            "parents": [parent] if parent else [],
+            "trashed": False,
+            "modifiedTime": self._timestamp(),
+            "webViewLink": "https://drive.google.com/file/d/{0}/view".format(id),
+        }
+        if description is not None:
+            item["description"] = description
+
+        if mimeType != FOLDER_MIME_TYPE:
+            if content is not None:
+                self.contents[id] = content
+                size = len(content)
+            item["size"] = str(size if size is not None else self.file_size)
+            self._set_checksum(item)
+
+        self.items[id] = item
+        self.change_log.append(id)
+        for parent_id in item["parents"]:
+            self.children[parent_id].append(id)
+        return id
+
+    def add_library(self, folders=10, photos_per_folder=100, videos_per_folder=0, seed=0, words=LIBRARY_WORDS):
+        """
+        Add a photo library: a root folder with sub folders of photos and videos named and described with random words
+
+        folders : Integer - The number of sub folders
+        photos_per_folder, videos_per_folder : Integer - The files in every sub folder
+
+        return : String - The id of the root folder
+        """
+        rng = random.Random(seed)
+        root = self.add_folder("Photos")
+
+        for i in range(folders):
+            folder = self.add_folder("{0}{1}".format(rng.choice(words), i), root)
+            for j in range(photos_per_folder + videos_per_folder):
+                video = j >= photos_per_folder
+                self.add_file(
+                    "{0}-{1}-{2}.{3}".format(rng.choice(words), rng.choice(words), j, "mp4" if video else "jpg"),
+                    folder,
+                    mimeType="video/mp4" if video else "image/jpeg",
+                    description=" ".join(rng.choice(words) for _ in range(rng.randint(0, 3))),
+                )
+
+        return root
+
+    def read(self, id, start=0, end=None):
+        """
+        Returns the bytes start to end (excluded) of a file
+        """
+        return self._read(self.items[id], start, end)
+
+    def _read(self, item, start=0, end=None):
+        size = int(item["size"])
+        end = size if end is None else min(end, size)
+        if start >= end:
+            return b""
+
+        if item["id"] in self.contents:
+            return self.contents[item["id"]][start:end]
+
+        # Repeats a pattern made from the file version, so an edited file has other contents
+        pattern = hashlib.sha256((item["id"] + item["modifiedTime"]).encode("utf-8")).digest()
+        offset = start % len(pattern)
+        return (pattern * ((end - start + offset) // len(pattern) + 1))[offset:offset + end - start]
+
+    def touch(self, id):
+        """
+        Mark a file or folder as modified
+        """
+        self.items[id]["modifiedTime"] = self._timestamp()
+        if "size" in self.items[id]:
+            self._set_checksum(self.items[id])
+        self.change_log.append(id)
+
+    def _set_checksum(self, item):
+        # The md5 of the contents, like Drive. Changes when the file is edited
+        digest = hashlib.md5()
+        size = int(item["size"])
+        for start in range(0, size, 1024 * 1024):
+            digest.update(self._read(item, start, start + 1024 * 1024))
+        item["md5Checksum"] = digest.hexdigest()
+
+    def throttle(self, count, status=403, reason="userRateLimitExceeded"):
+        """
+        Make the next count requests fail with an HttpError. The requests of a batch fail one by one
+
+        status : Integer - The HTTP status. Ex. 403, 429 or 503
+        reason : String - The reason in the error. Ex. "userRateLimitExceeded"
+        """
+        with self._lock:
+            self._failures.extend([(status, reason)] * count)
+
+    def cut_downloads(self, count, length):
+        """
+        Send only the first length bytes of the next count downloads, like a connection closed early. The response
+        says which bytes were sent, so the rest can be asked again
+        """
+        with self._lock:
+            self._cuts.extend([length] * count)
+
+    def _cut(self, data):
+        with self._lock:
+            if len(self._cuts) == 0 or len(data) <= self._cuts[0]:
+                return data
+            return data[:self._cuts.popleft()]
+
+    def _fail_if_throttled(self):
+        with self._lock:
+            if len(self._failures) == 0:
+                return
+            status, reason = self._failures.popleft()
+            self.calls["throttled"] += 1
+
+        raise http_error(status, reason)
+
+    def _timestamp(self):
+        return "2021-01-01T00:00:00.{0:06d}Z".format(next(self._clock))
+
+    def files(self):
+        return _FilesResource(self)
+
+    def changes(self):
+        return _ChangesResource(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _BatchRequest(self, callback)
+
+    def _candidates(self, predicate):
+        """
+        Returns the items that can match the predicate, in the order they were added
+        """
+        if predicate.parents is None:
+            return list(self.items.values())
+
+        ids = set()
+        for parent_id in predicate.parents:
+            ids.update(self.children.get(parent_id, []))
+
+        return [self.items[id] for id in sorted(ids, key=lambda id: int(id[2:]))]
+
+    def _execute(self, endpoint, func, throttled=True):
+        with self._lock:
+            self.calls[endpoint] += 1
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if throttled:
+            self._fail_if_throttled()
+
+        return func()
+
+def http_error(status, reason, message=None, domain="usageLimits"):
+    """
+    Returns the HttpError googleapiclient raises for a Drive error response
+    """
+    message = message or reason
+    content = json.dumps({"error": {
+        "code": status,
+        "message": message,
+        "errors": [{"domain": domain, "reason": reason, "message": message}],
+    }}).encode("utf-8")
+
+    return HttpError(httplib2.Response({"status": status}), content)
+
+class _Request(object):
+    def __init__(self, drive, endpoint, func):
+        self._drive = drive
+        self._endpoint = endpoint
+        self._func = func
+
+    def execute(self, num_retries=0):
+        return self._drive._execute(self._endpoint, self._func)
+
+class _BatchRequest(object):
+    """
+    Like googleapiclient.http.BatchHttpRequest. One round trip for every request added
+    """
+
+    def __init__(self, drive, callback=None):
+        self._drive = drive
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        if request_id is None:
+            request_id = str(len(self._requests) + 1)
+        self._requests.append((request_id, request, callback or self._callback))
+
+    def execute(self):
+        def run():
+            results = []
+            for request_id, request, callback in self._requests:
+                try:
+                    self._drive._fail_if_throttled()
+                    results.append((request_id, callback, request._func(), None))
+                except Exception as exception:
+                    results.append((request_id, callback, None, exception))
+            return results
+
+        for request_id, callback, response, exception in self._drive._execute("batch", run, throttled=False):
+            if callback is not None:
+                callback(request_id, response, exception)
+
+class _FilesResource(object):
+    def __init__(self, drive):
+        self._drive = drive
+
+    def list(self, q=None, pageSize=100, pageToken=None, fields=None, spaces=None, orderBy=None, **kwargs):
+        drive = self._drive
+
+        def run():
+            predicate = parse_query(q) if q else Predicate(lambda item: True)
+            matches = [dict(item) for item in drive._candidates(predicate) if predicate(item)]
+
+            start = int(pageToken) if pageToken else 0
+            end = start + min(pageSize, drive.max_page_size)
+
+            response = {"files": matches[start:end]}
+            if end < len(matches):
+                response["nextPageToken"] = str(end)
+            return response
+
+        return _Request(drive, "files.list", run)
+
+    def get(self, fileId=None, fields=None, **kwargs):
+        drive = self._drive
+
+        def run():
+            if fileId not in drive.items:
+                raise http_error(404, "notFound", "File not found: {0}.".format(fileId), "global")
+            return dict(drive.items[fileId])
+
+        return _Request(drive, "files.get", run)
+
+    def get_media(self, fileId=None, **kwargs):
+        return _MediaRequest(self._drive, fileId)
+
+class _ChangesResource(object):
+    def __init__(self, drive):
+        self._drive = drive
+
+    def getStartPageToken(self, **kwargs):
+        drive = self._drive
+        return _Request(drive, "changes.getStartPageToken", lambda: {"startPageToken": str(len(drive.change_log))})
+
+    def list(self, pageToken=None, **kwargs):
+        drive = self._drive
+
+        def run():
+            log = drive.change_log
+            ids = dict.fromkeys(log[int(pageToken):])
+            changes = [{"fileId": id, "removed": False, "file": dict(drive.items[id])} for id in ids]
+            return {"changes": changes, "newStartPageToken": str(len(log))}
+
+        return _Request(drive, "changes.list", run)
+
+class _MediaRequest(object):
+    """
+    Like the HttpRequest of files().get_media. Download it with MediaIoBaseDownload
+    """
+
+    def __init__(self, drive, file_id):
+        self.uri = "https://www.googleapis.com/drive/v3/files/{0}?alt=media".format(file_id)
+        self.headers = {}
+        self.http = _MediaHttp(drive, file_id)
+
+    def execute(self, num_retries=0):
+        response, content = self.http.request(self.uri)
+        if response.status != 200:
+            raise HttpError(response, content, uri=self.uri)
+        return content
+
+class _MediaHttp(object):
+    """
+    Like httplib2.Http, for the downloads of one file. Answers Range requests
+    """
+
+    def __init__(self, drive, file_id):
+        self._drive = drive
+        self._file_id = file_id
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        drive = self._drive
+
+        def run():
+            item = drive.items.get(self._file_id)
+            if item is None or "size" not in item:
+                error = http_error(404, "notFound")
+                return error.resp, error.content
+
+            size = int(item["size"])
+            match = RANGE.match((headers or {}).get("range", ""))
+            if match is None:
+                data = drive.read(self._file_id)
+                return httplib2.Response({"status": 200, "content-length": str(size)}), data
+
+            start = int(match.group(1))
+            end = int(match.group(2)) + 1 if match.group(2) else size
+            if start >= size:
+                return httplib2.Response({"status": 416, "content-range": "bytes */{0}".format(size)}), b""
+
+            data = drive._cut(drive.read(self._file_id, start, end))
+            if drive.bandwidth:
+                time.sleep(len(data) / float(drive.bandwidth))
+
+            response = httplib2.Response({
+                "status": 206,
+                "content-range": "bytes {0}-{1}/{2}".format(start, start + len(data) - 1, size),
+            })
+            return response, data
+
+        return drive._execute("files.get_media", run)
+
+# ================================================================================
+# Query parser
+
+class Predicate(object):
+    """
+    A parsed query. Call it with a file to know if it matches.
+
+    parents is the set of parent ids one of which a matching file must be in, or None if the query doesn't say.
+    """
+
+    def __init__(self, func, parents=None):
+        self.func = func
+        self.parents = parents
+
+    def __call__(self, item):
+        return self.func(item)
+
+def parse_query(query):
+    """
+    Parse a Drive query into a predicate taking a file
+
+    query : String - The query. Ex. "'abc' in parents and trashed = false"
+
+    return predicate : Predicate - Returns True if the file matches the query
+    """
+    parser = _QueryParser(_tokenize(query))
+    predicate = parser.expression()
+
+    if parser.peek() is not None:
+        raise ValueError("Unexpected {0!r} in query {1!r}".format(parser.peek(), query))
+
+    return predicate
+
+def _tokenize(query):
+    tokens = []
+    i = 0
+    while i < len(query):
+        char = query[i]
+
+        if char.isspace():
+            i += 1
+        elif char in "()":
+            tokens.append(char)
+            i += 1
+        elif char == "'":
+            value = []
+            i += 1
+            while query[i] != "'":
+                if query[i] == "\\":
+                    i += 1
+                value.append(query[i])
+                i += 1
+            tokens.append(("string", "".join(value)))
+            i += 1
+        elif query.startswith("!=", i):
+            tokens.append("!=")
+            i += 2
+        elif char == "=":
+            tokens.append("=")
+            i += 1
+        else:
+            start = i
+            while i < len(query) and not query[i].isspace() and query[i] not in "()'=!":
+                i += 1
+            tokens.append(query[start:i])
+
+    return tokens
+
+class _QueryParser(object):
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def expression(self):
+        terms = [self.term()]
+        while self.peek() == "or":
+            self.take()
+            terms.append(self.term())
+
+        if len(terms) == 1:
+            return terms[0]
+
+        parents = None
+        if all(term.parents is not None for term in terms):
+            parents = set().union(*[term.parents for term in terms])
+
+        return Predicate(lambda item: any(term(item) for term in terms), parents)
+
+    def term(self):
+        factors = [self.factor()]
+        while self.peek() == "and":
+            self.take()
+            factors.append(self.factor())
+
+        if len(factors) == 1:
+            return factors[0]
+
+        known = [factor.parents for factor in factors if factor.parents is not None]
+        parents = min(known, key=len) if known else None
+
+        return Predicate(lambda item: all(factor(item) for factor in factors), parents)
+
+    def factor(self):
+        token = self.take()
+
+        if token == "not":
+            inner = self.factor()
+            return Predicate(lambda item: not inner(item))
+
+        if token == "(":
+            inner = self.expression()
+            if self.take() != ")":
+                raise ValueError("Missing ) in query")
+            return inner
+
+        operator = self.take()
+        if isinstance(token, tuple) and operator == "in":
+            # 'value' in parents
+            value, field = token[1], self.take()
+            return Predicate(lambda item: value in item.get(field, []), {value} if field == "parents" else None)
+
+        if operator == "in":
+            # parents in 'value'
+            value = self.take()[1]
+            return Predicate(lambda item: value in item.get(token, []), {value} if token == "parents" else None)
+
+        value = self.take()
+        value = value[1] if isinstance(value, tuple) else value == "true"
+
+        if operator == "=":
+            return Predicate(lambda item: item.get(token) == value)
+        if operator == "!=":
+            return Predicate(lambda item: item.get(token) != value)
+        if operator == "contains":
+            return Predicate(lambda item: value in (item.get(token) or ""))
+
+        raise ValueError("Unsupported operator {0!r} in query".format(operator))
@@ -0,0 +1,124 @@
+# Features
+import google_drive_feat
+
+# Crawls the whole folder tree under the root photo folder, not only its direct sub folders.
+#
+# The crawl is breadth first and lists one whole level per query (google_drive_feat.list_files_in_parents puts many
+# parents in the same query), so a tree costs about one round trip per level instead of one per folder. Given the
+# folders of the previous crawl, folders whose modifiedTime did not change are not listed again and their known
+# sub tree is reused. Changes deeper in the tree are picked up by drive_sync.
+
+FOLDER_FIELDS = "id, name, parents, modifiedTime"
+
+# ================================================================================
+# Crawler
+
+def crawl(root_folder_id, known_folders=None):
+    """
+    Get every folder under the root folder, at any depth.
+
+    root_folder_id : String - The id of the root folder
+    known_folders : Object<String, Object(id, name, parents, modifiedTime)> - The folders of a previous crawl by id
+
+    return folders : Array<Object(id, name, parents, modifiedTime)> - The folders, parents before their children
+    """
+    known_folders = known_folders or {}
+    known_children = children_map(known_folders.values())
+
+    condition = "mimeType = '{0}' and trashed = false".format(google_drive_feat.FOLDER_MIME_TYPE)
+
+    folders = []
+    seen = set()
+    level = [root_folder_id]
+    while len(level) > 0:
+        # The crawl is what tells if the tree changed, it must not see cached listings
+        found = google_drive_feat.list_files_in_parents(level, condition, FOLDER_FIELDS, use_cache=False)
+
+        level = []
+        for folder in found:
+            if folder["id"] in seen:
+                continue
+            seen.add(folder["id"])
+            folders.append(folder)
+
+            known = known_folders.get(folder["id"])
+            if known is not None and known.get("modifiedTime") == folder.get("modifiedTime"):
+                # Unchanged, reuse what is below it
+                for id in descendants(known_children, folder["id"]):
+                    if id not in seen:
+                        seen.add(id)
+                        folders.append(known_folders[id])
+            else:
+                level.append(folder["id"])
+
+    return folders
+
+# ================================================================================
+# Tree helpers
+
+def children_map(folders):
+    """
+    Returns the ids of the sub folders of every folder
+
+    folders : Array<Object(id, parents)> - The folders
+
+    return : Object<String, Array<String>> - parent id -> ids of its sub folders
+    """
+    children = {}
+    for folder in folders:
+        for parent_id in folder.get("parents") or []:
+            children.setdefault(parent_id, []).append(folder["id"])
+
+    return children
+
+def descendants(children, folder_id):
+    """
+    Returns the ids of every folder below a folder, breadth first
+
+    children : Object<String, Array<String>> - The children_map of the tree
+    folder_id : String - The folder
+    """
+    found = []
+    seen = {folder_id}
+    level = [folder_id]
+    while len(level) > 0:
+        next_level = []
+        for parent_id in level:
+            for id in children.get(parent_id, []):
+                if id not in seen:
+                    seen.add(id)
+                    next_level.append(id)
+        found.extend(next_level)
+        level = next_level
+
+    return found
+
+def walk(folders, children, folder_id, depth=0):
+    """
+    Returns the folders below a folder depth first, sorted by name, with their depth. Used to print the tree
+
+    folders : Object<String, Object(id, name)> - The folders by id
+    children : Object<String, Array<String>> - The children_map of the tree
+    folder_id : String - The folder to start from
+
+    return : Array<(Integer, Object(id, name))> - (depth, folder) pairs. Direct sub folders have depth 0
+    """
+    lines = []
+    stack = [(depth, id) for id in _sorted_children(folders, children, folder_id)]
+    stack.reverse()
+    seen = {folder_id}
+
+    while len(stack) > 0:
+        depth, id = stack.pop()
+        if id in seen:
+            continue
+        seen.add(id)
+
+        lines.append((depth, folders[id]))
+        for child_id in reversed(_sorted_children(folders, children, id)):
+            stack.append((depth + 1, child_id))
+
+    return lines
+
+def _sorted_children(folders, children, folder_id):
+    return sorted((id for id in children.get(folder_id, []) if id in folders), key=lambda id: folders[id]["name"])
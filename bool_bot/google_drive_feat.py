@@ -1,13 +1,19 @@
 from __future__ import print_function
-import pickle
 import os.path
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.http import MediaIoBaseDownload
 import io
+import datetime
+import threading
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-from settings import ROOT_PHOTO_FOLDER_ID
+import drive_limits
+import metrics
+import query_cache
+from settings import ROOT_PHOTO_FOLDER_ID, SPOOL_MAX_MEMORY, DRIVE_LIST_PARALLELISM
+
+# googleapiclient, google_auth_oauthlib and httplib2 take a few hundred milliseconds to import, so they are only
+# imported when Drive is first used. drive_async warms them up on a thread once the bot is connected.
 
 # Documentation Links
 # In-depth documentation:
@@ -18,17 +24,162 @@ from settings import ROOT_PHOTO_FOLDER_ID
 # Root File ID For Photo
 
 
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+PHOTO_CONDITION = "(mimeType = 'image/jpeg' or mimeType = 'image/png' or mimeType = 'image/svg+xml')"
+VIDEO_CONDITION = "mimeType = 'video/mp4'"
+
+# Biggest page files().list allows, and the number of parent folders put in one query. Long queries are rejected by
+# Drive, so parents are not all put in the same query.
+PAGE_SIZE = 1000
+PARENTS_PER_QUERY = 40
+
+# Fields of get_file_metadata
+METADATA_FIELDS = 'id, name, mimeType, md5Checksum, modifiedTime, size, webViewLink, thumbnailLink, imageMediaMetadata(width, height)'
+
 # Temp Dir
 temp_dir = "./bool_bot/files/"
 
 # If modifying these scopes, delete the file token.pickle.
 SCOPES = ['https://www.googleapis.com/auth/drive']
 
+# Refresh the access token this many seconds before it expires, so a command never
+# has to wait on a refresh triggered by a 401.
+CREDENTIALS_REFRESH_MARGIN = 300
+
+# Process wide credentials. Loaded once and shared by every call.
+_creds = None
+_client_lock = threading.Lock()
+
+# Drive services, one per thread. A service can't be shared between the threads of the drive_async pool, but
+# they all send their requests over the pooled connections of drive_http.
+_thread_local = threading.local()
+# Bumped by reset_client() so every thread rebuilds its service
+_generation = 0
+
+# Set by set_service()
+_service_override = None
+
+# Threads of list_files_in_parents
+_list_executor = None
+
+# Set by request_class()
+_request_class = None
+
+def request_class():
+    """
+    Returns the HttpRequest class of the Drive services: an HttpRequest that records the latency and errors of every
+    Drive API call by endpoint. Ex. drive.files.list
+    """
+    global _request_class
+
+    if _request_class is None:
+        from googleapiclient.http import HttpRequest
+
+        class InstrumentedHttpRequest(HttpRequest):
+            def execute(self, http=None, num_retries=0):
+                start = time.perf_counter()
+                try:
+                    return super(InstrumentedHttpRequest, self).execute(http=http, num_retries=num_retries)
+                except Exception:
+                    metrics.increment("errors", "endpoint." + self.methodId)
+                    raise
+                finally:
+                    metrics.observe("endpoint", self.methodId, time.perf_counter() - start)
+
+        _request_class = InstrumentedHttpRequest
+
+    return _request_class
+
+def build(*args, **kwargs):
+    """
+    googleapiclient.discovery.build
+    """
+    from googleapiclient import discovery
+
+    return discovery.build(*args, **kwargs)
+
+@metrics.timed("drive", "authenticate")
 def authenticate():
     """
-    Shows basic usage of the Drive v3 API.
-    Prints the names and ids of the first 10 files the user has access to.
+    Returns the Drive credentials for this process.
+
+    token.pickle is only read the first time this is called. Afterwards the cached credentials are returned,
+    refreshing them shortly before they expire. token.pickle is only rewritten when the token actually changed.
+    """
+    global _creds
+
+    with _client_lock:
+        if _creds is None:
+            _creds = _load_credentials()
+
+        if _needs_refresh(_creds):
+            from google.auth.transport.requests import Request
+
+            old_token = _creds.token
+            _creds.refresh(Request())
+            if _creds.token != old_token:
+                _save_credentials(_creds)
+
+        return _creds
+
+def authorized_http(creds):
+    """
+    Returns an http sending requests with the credentials over the pooled Drive connections
+    """
+    import google_auth_httplib2
+    import drive_http
+
+    return google_auth_httplib2.AuthorizedHttp(creds, http=drive_http.pool)
+
+@metrics.timed("drive", "get_service")
+def get_service():
+    """
+    Returns the Drive v3 service of the current thread, building it the first time it is needed.
+
+    Building the service parses the discovery document, so the same object is reused by every call on that thread.
+    The services of every thread share the connections of drive_http.pool.
+    """
+    if _service_override is not None:
+        return _service_override
+
+    creds = authenticate()
+
+    service = getattr(_thread_local, "service", None)
+    if service is None or _thread_local.generation != _generation:
+        service = build('drive', 'v3', http=authorized_http(creds), cache_discovery=False,
+                        requestBuilder=request_class())
+        _thread_local.service = service
+        _thread_local.generation = _generation
+
+    return service
+
+def set_service(service):
+    """
+    Use this service instead of Drive, from every thread. Used by the tests and benchmarks with fake_drive.FakeDrive.
+
+    service : Object - The service, or None to go back to Drive
+    """
+    global _service_override
+
+    _service_override = service
+
+def reset_client():
+    """
+    Drops the cached credentials and service. The next call will load them again from token.pickle.
+    """
+    global _creds, _generation
+
+    with _client_lock:
+        _creds = None
+        _generation += 1
+
+def _load_credentials():
+    """
+    Load the credentials from token.pickle, or run the authorization flow if there are none.
     """
+    import pickle
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     creds = None
     # The file token.pickle stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
@@ -37,36 +188,57 @@ def authenticate():
         with open('token.pickle', 'rb') as token:
             creds = pickle.load(token)
     # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'google-drive-credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
+    if not creds or not (creds.valid or creds.refresh_token):
+        flow = InstalledAppFlow.from_client_secrets_file(
+            'google-drive-credentials.json', SCOPES)
+        creds = flow.run_local_server(port=0)
         # Save the credentials for the next run
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
+        _save_credentials(creds)
 
     return creds
 
+def _save_credentials(creds):
+    """
+    Write the credentials to token.pickle
+    """
+    import pickle
+
+    with open('token.pickle', 'wb') as token:
+        pickle.dump(creds, token)
+
+def _needs_refresh(creds):
+    """
+    Returns True if the credentials are invalid or will expire within CREDENTIALS_REFRESH_MARGIN seconds
+    """
+    if not creds.refresh_token:
+        return False
+
+    if not creds.valid:
+        return True
+
+    if creds.expiry is None:
+        return False
+
+    remaining = creds.expiry - datetime.datetime.utcnow()
+    return remaining < datetime.timedelta(seconds=CREDENTIALS_REFRESH_MARGIN)
+
+@metrics.timed("drive", "get_recent_files")
 def get_recent_files():
     """
     Returns the 10 most recent files
 
     return items : Array<Object(id, name)> - An array of objects/dicts with id and name attributes
     """
-    creds = authenticate()
-
-    service = build('drive', 'v3', credentials=creds)
+    service = get_service()
 
     # Call the Drive v3 API
-    results = service.files().list(
-        pageSize=10, fields="nextPageToken, files(id, name)").execute()
+    results = drive_limits.execute(service.files().list(
+        pageSize=10, fields="nextPageToken, files(id, name)"))
     items = results.get('files', [])
 
     return items
 
+@metrics.timed("drive", "get_file_id")
 def get_file_id(filename):
     """
     Get file id from the name
@@ -76,18 +248,18 @@ def get_file_id(filename):
     return found_files : Array<Object(id, name, webViewLink)> - The file id from google drive
     """
 
-    creds = authenticate()
-    service = build('drive', 'v3', credentials=creds)
+    service = get_service()
 
     page_token = None
-    response = service.files().list(q="name = '{0}'".format(filename),
-                                    pageSize=1,
-                                    spaces="drive",
-                                    fields='nextPageToken, files(id, name, webViewLink)',
-                                    pageToken=page_token).execute()
+    response = drive_limits.execute(service.files().list(q="name = '{0}'".format(escape_query(filename)),
+                                                         pageSize=1,
+                                                         spaces="drive",
+                                                         fields='nextPageToken, files(id, name, webViewLink)',
+                                                         pageToken=page_token))
 
     return response["files"]
 
+@metrics.timed("drive", "download_file")
 def download_file(fileId, fileName):
     """
     Download the photo to local directory.
@@ -97,54 +269,229 @@ def download_file(fileId, fileName):
 
     return : String - The file name
     """
-    creds = authenticate()
-    service = build('drive', 'v3', credentials=creds)
+    download_file_to(fileId, temp_dir + fileName)
 
-    request = service.files().get_media(fileId=fileId)
+    return fileName
 
-    # print(request)
+@metrics.timed("drive", "download_file_to")
+def download_file_to(fileId, path, md5=None):
+    """
+    Download a file to a path.
 
-    # Downloads the photo to local storage.
-    fh = io.FileIO(temp_dir + fileName, mode='wb')
-    downloader = MediaIoBaseDownload(fd=fh, request=request)
+    fileId : String - The file id
+    path : String - Where to write the file
+    md5 : String - The md5Checksum of the file, if known
 
+    return : Integer - The number of bytes downloaded
+    """
+    import drive_download
 
-    done = False
-    while done is False:
-        status,done = downloader.next_chunk()
-        # print("Download %d%%." % int(status.progress() * 100))
+    # Downloads the file to local storage, in ranges fetched at the same time.
+    with open(path, mode='w+b') as fh:
+        size = drive_download.download(fileId, fh, md5)
 
-    fh.close()
+    metrics.increment("drive_bytes_downloaded", "media", size)
+    return size
 
-    return fileName
+class SpooledBuffer(object):
+    """
+    Buffer for downloads. Kept in memory until it is bigger than max_memory bytes, then moved to an anonymous
+    temporary file that is deleted when closed.
+    """
 
-def get_folder_ids(root_folder_id):
+    def __init__(self, max_memory):
+        self.max_memory = max_memory
+        self.file = io.BytesIO()
+
+    def write(self, data):
+        if isinstance(self.file, io.BytesIO) and self.file.tell() + len(data) > self.max_memory:
+            position = self.file.tell()
+            rolled = tempfile.TemporaryFile()
+            rolled.write(self.file.getvalue())
+            rolled.seek(position)
+            self.file = rolled
+
+        return self.file.write(data)
+
+    def seek(self, offset):
+        return self.file.seek(offset)
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+@metrics.timed("drive", "download_file_to_buffer")
+def download_file_to_buffer(fileId, max_memory=SPOOL_MAX_MEMORY, md5=None, size=None):
     """
-    Returns all the sub folder IDs starting at root_folder(includes the root_folder ID). Goes one level deep.
+    Download a file without writing it to temp_dir.
 
-    Ex: If the root folder has folder1, folder2 and folder3 in it, this will return a list of length 4 with the IDs associated
-    with those 3 folders, and the ID of the root folder. However if the 3 folders have subfolders in them as well, this function will not return those subfolder IDs.
+    fileId : String - The file id
+    max_memory : Integer - Files bigger than this are spooled to an anonymous temporary file instead of memory
+    md5 : String - The md5Checksum of the file, if known
+    size : Integer - The size of the file, if known
 
-    Note: If more than one level deep is needed, a recursive version can be implemented. However this might get very slow if the folder tree structure gets very
-    complex. Refer to this if needed: https://stackoverflow.com/questions/41741520/how-do-i-search-sub-folders-and-sub-sub-folders-in-google-drive
+    return : BytesIO | File - The file contents, at position 0
     """
-    creds = authenticate()
-    service = build('drive', 'v3', credentials=creds)
+    import drive_download
 
+    buffer = SpooledBuffer(max_memory)
+    try:
+        size = drive_download.download(fileId, buffer, md5, size)
+    except BaseException:
+        buffer.file.close()
+        raise
+
+    metrics.increment("drive_bytes_downloaded", "media", size)
+    buffer.file.seek(0)
+    return buffer.file
+
+@metrics.timed("drive", "get_file_metadata")
+def get_file_metadata(fileId):
+    """
+    Get the metadata used to tell if a downloaded copy of a file is still up to date, and how to prepare it for upload
+
+    fileId : String - The file id
+
+    return : Object(id, name, mimeType, md5Checksum, modifiedTime, size, webViewLink, thumbnailLink, imageMediaMetadata) - The file metadata
+    """
+    service = get_service()
+
+    return drive_limits.execute(service.files().get(fileId=fileId, fields=METADATA_FIELDS))
+
+@metrics.timed("drive", "download_link")
+def download_link(url):
+    """
+    Download a short lived link given by Drive, ex. a thumbnailLink, with the bot credentials
+
+    url : String - The link
+
+    return : BytesIO - The contents, at position 0
+    """
+    from googleapiclient.errors import HttpError
+
+    http = authorized_http(authenticate())
+
+    def request():
+        response, content = http.request(url)
+        if response.status != 200:
+            raise HttpError(response, content, uri=url)
+        return content
+
+    content = drive_limits.call(request)
+
+    metrics.increment("drive_bytes_downloaded", "link", len(content))
+    return io.BytesIO(content)
+
+@metrics.timed("drive", "list_files")
+def list_files(q, fields, use_cache=True):
+    """
+    Get every file matching a query, following nextPageToken.
+
+    q : String - The Drive query
+    fields : String - The file fields to return. Ex. "id, name"
+    use_cache : Boolean - Return the result of the same query sent recently, from query_cache. Always sent to Drive if False
+
+    return files : Array<Object> - The files
+    """
+    if use_cache:
+        cached = query_cache.cache.get(q, fields)
+        if cached is not None:
+            return list(cached)
+
+    # The same listing asked from several threads at once (ex. concurrent searches) is only sent once
+    generation = query_cache.cache.generation
+    files = drive_limits.coalescer.call(("list_files", q, fields), _list_files, q, fields)
+    query_cache.cache.put(q, fields, files, generation)
+
+    return list(files)
+
+def _list_files(q, fields):
+    service = get_service()
+
+    files = []
     page_token = None
-    response = service.files().list(q="mimeType = 'application/vnd.google-apps.folder' and '{}' in parents and trashed = false".format(root_folder_id),
-                                    pageSize=10,
-                                    spaces="drive",
-                                    fields='nextPageToken, files(id, name, webViewLink)',
-                                    pageToken=page_token,
-
-                                    ).execute()
-    found_ids = [response["files"][i]["id"] for i in range(0, len(response["files"]))] # extract all the IDs
-    found_names = [response["files"][i]["name"] for i in range(0, len(response["files"]))]
+    while True:
+        response = drive_limits.execute(service.files().list(q=q,
+                                                             pageSize=PAGE_SIZE,
+                                                             spaces="drive",
+                                                             fields='nextPageToken, files({0})'.format(fields),
+                                                             pageToken=page_token,
+                                                             ))
+        files.extend(response["files"])
+
+        page_token = response.get("nextPageToken")
+        if page_token is None:
+            return files
+
+@metrics.timed("drive", "list_files_in_parents")
+def list_files_in_parents(parent_ids, condition, fields, use_cache=True):
+    """
+    Get every file in any of the parent folders that matches a condition.
+
+    Parents are grouped PARENTS_PER_QUERY at a time into one "'a' in parents or 'b' in parents ..." query, and the
+    queries run at the same time on at most DRIVE_LIST_PARALLELISM threads.
+
+    parent_ids : Array<String> - The folder ids
+    condition : String - The rest of the Drive query. Ex. "trashed = false"
+    fields : String - The file fields to return
+    use_cache : Boolean - Same as in list_files
+
+    return files : Array<Object> - The files, in the order of parent_ids groups
+    """
+    queries = []
+    for i in range(0, len(parent_ids), PARENTS_PER_QUERY):
+        parents = " or ".join("'{0}' in parents".format(escape_query(id)) for id in parent_ids[i:i + PARENTS_PER_QUERY])
+        queries.append("({0}) and {1}".format(parents, condition))
+
+    if len(queries) <= 1:
+        results = [list_files(q, fields, use_cache) for q in queries]
+    else:
+        results = _get_list_executor().map(lambda q: list_files(q, fields, use_cache), queries)
+
+    files = []
+    for result in results:
+        files.extend(result)
+
+    return files
+
+def _get_list_executor():
+    """
+    Returns the thread pool used by list_files_in_parents. Separate from the drive_async pool, which calls it.
+    """
+    global _list_executor
+
+    with _client_lock:
+        if _list_executor is None:
+            _list_executor = ThreadPoolExecutor(max_workers=DRIVE_LIST_PARALLELISM, thread_name_prefix="drive-list")
+
+        return _list_executor
+
+def escape_query(value):
+    """
+    Escape a value to be put in quotes in a Drive query
+    """
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+@metrics.timed("drive", "get_folder_ids")
+def get_folder_ids(root_folder_id):
+    """
+    Get the folders directly in a folder, not the ones nested below them. The whole tree is crawled by
+    folder_tree.crawl and kept in the library index. !ls and the searches only call this until the index is built.
+
+    root_folder_id : String - The id of the folder
+
+    return found_ids : Array<String> - The ids of the sub folders, then the id of the root folder
+    return found_names : Array<String> - The names of the sub folders, in the same order. Without the root folder
+    """
+    folders = list_files("mimeType = '{0}' and '{1}' in parents and trashed = false".format(FOLDER_MIME_TYPE, escape_query(root_folder_id)),
+                         "id, name")
+
+    found_ids = [folder["id"] for folder in folders] # extract all the IDs
+    found_names = [folder["name"] for folder in folders]
     found_ids.append(root_folder_id) # if the Photos folder(as named on Google Drive) just contains folders, this is not needed
 
     return found_ids, found_names
 
+@metrics.timed("drive", "get_folder_contents")
 def get_folder_contents(query):
     """
     Get the file contents of a specific folder.
@@ -153,40 +500,25 @@ def get_folder_contents(query):
 
     return : Array<Object(id, name, webViewLink)> - An array of files. Each file has id, name, and webViewLink attributes
     """
-    creds = authenticate()
-    service = build('drive', 'v3', credentials=creds)
+    #Fetch folder id of query. Should return one folder id. Structure [{'id': 'aase8f828efe82'}]
+    folders = list_files(
+        "'{0}' in parents and name = '{1}' and mimeType = '{2}' and trashed = false".format(escape_query(ROOT_PHOTO_FOLDER_ID), escape_query(query), FOLDER_MIME_TYPE),
+        "id")
 
-    #Fetch folder id of query. Should return one folder id. Structure {'files': [{'id': 'aase8f828efe82'}]}
-    page_token = None
-    response = service.files().list(
-        q="parents in '{0}' and name = '{1}' and mimeType = 'application/vnd.google-apps.folder' and trashed = false".format(ROOT_PHOTO_FOLDER_ID, query),
-        pageSize=10,
-        spaces="drive",
-        fields='nextPageToken, files(id)',
-        pageToken=page_token,
-    ).execute()
-
-    if(len(response["files"]) > 1):
+    if(len(folders) > 1):
         return "Multiple Folders"
 
-    if(len(response["files"]) == 0):
+    if(len(folders) == 0):
         return "No Folder"
 
-    folder_id = response["files"][0]["id"]
-
-    #Return the first 100 files in the folder
-    page_token = None
-    response = service.files().list(
-        q="parents in '{0}' and trashed = false and (mimeType = 'image/jpeg' or mimeType = 'image/png' or mimeType = 'image/svg+xml')".format(folder_id),
-        pageSize=100,
-        spaces="drive",
-        fields='nextPageToken, files(id, name, webViewLink)',
-        pageToken=page_token,
-    ).execute()
+    folder_id = folders[0]["id"]
 
-    return response["files"]
+    #Return every photo in the folder
+    return list_files("'{0}' in parents and trashed = false and {1}".format(escape_query(folder_id), PHOTO_CONDITION),
+                      "id, name, webViewLink")
 
 
+@metrics.timed("drive", "get_files_search")
 def get_files_search(query, video=False):
     """
     Get the files that contains the query. Matches it with file name. 
@@ -195,28 +527,11 @@ def get_files_search(query, video=False):
 
     return found_files : Array<Object(id, name, webViewLink)> - The number of found files
     """
-
-    creds = authenticate()
-    service = build('drive', 'v3', credentials=creds)
-
     folder_ids, folder_names = get_folder_ids(ROOT_PHOTO_FOLDER_ID)
-    files = []
     found_files = []
-    gd_query = "'{}' in parents and trashed = false and (mimeType = 'image/jpeg' or mimeType = 'image/png' or mimeType = 'image/svg+xml')"
 
-    if video:
-        gd_query = "'{}' in parents and trashed = false and mimeType = 'video/mp4'"
-
-    for id in folder_ids:
-        page_token = None
-        response = service.files().list(q=gd_query.format(id),
-                                        pageSize=10,
-                                        spaces="drive",
-                                        fields='nextPageToken, files(id, name, webViewLink, description)',
-                                        pageToken=page_token,
-
-                                        ).execute()
-        files.extend(response["files"]) # simply add to the current list of files found in other folders
+    condition = "trashed = false and " + (VIDEO_CONDITION if video else PHOTO_CONDITION)
+    files = list_files_in_parents(folder_ids, condition, "id, name, webViewLink, description")
 
     for file in files:
         if (
@@ -225,4 +540,58 @@ def get_files_search(query, video=False):
         ):
             found_files.append(file)
 
-    return found_files
\ No newline at end of file
+    return found_files
+
+@metrics.timed("drive", "get_library_files")
+def get_library_files(folder_ids):
+    """
+    Get every photo and video in the folders. Used to build the library index.
+
+    folder_ids : Array<String> - The folder ids
+
+    return files : Array<Object(id, name, description, mimeType, parents, webViewLink, md5Checksum, modifiedTime)> - The files found in the folders
+    """
+    condition = "trashed = false and ({0} or {1})".format(PHOTO_CONDITION, VIDEO_CONDITION)
+
+    # The index is rebuilt from what is on Drive now
+    return list_files_in_parents(folder_ids, condition, "id, name, description, mimeType, parents, webViewLink, md5Checksum, modifiedTime",
+                                 use_cache=False)
+
+@metrics.timed("drive", "get_start_page_token")
+def get_start_page_token():
+    """
+    Get the token of the current position in the Drive changes feed
+
+    return : String - The start page token
+    """
+    service = get_service()
+
+    response = drive_limits.execute(service.changes().getStartPageToken())
+
+    return response["startPageToken"]
+
+@metrics.timed("drive", "get_changes")
+def get_changes(page_token):
+    """
+    Get every change since the page token
+
+    page_token : String - The token returned by get_start_page_token or a previous call
+
+    return changes, new_page_token : Array<Object(fileId, removed, file)>, String - The changes and the token to use for the next call
+    """
+    service = get_service()
+
+    changes = []
+    while True:
+        response = drive_limits.execute(service.changes().list(pageToken=page_token,
+                                                               pageSize=1000,
+                                                               spaces="drive",
+                                                               includeRemoved=True,
+                                                               fields='nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, description, mimeType, parents, trashed, webViewLink, md5Checksum, modifiedTime))',
+                                                               ))
+        changes.extend(response.get("changes", []))
+
+        if "newStartPageToken" in response:
+            return changes, response["newStartPageToken"]
+
+        page_token = response["nextPageToken"]
@@ -1,15 +1,15 @@
-import discord
-from discord.ext import commands
 from settings import DISCORD_API_KEY
-from settings import ROOT_PHOTO_FOLDER_ID
 import asyncio
+import importlib
+import time
 
-# Features
-import example_feat
-import google_drive_feat
-import photo
+# Features. Only what on_message needs, the commands and the features they use are loaded by load_extensions
+import startup
+import metrics
+import message_filter
 import channel
-import video
+import send_queue
+import sharding
 
 # Use bot commands extension.
 # Tutorial: https://discordpy.readthedocs.io/en/latest/ext/commands/index.html
@@ -27,7 +27,11 @@ import video
 temp_dir = "./bool_bot/files/"
 
 # Bot is subclass of client. Any coroutines that defines an event should be usable under bot.
-bot = commands.Bot(command_prefix='!')
+# An AutoShardedBot when BOT_SHARDS is set
+bot = sharding.make_bot(command_prefix='!')
+
+# Pending !photo s searches, by (user id, channel id). Set by the media extension
+bot.selections = {}
 
 # ================================================================================
 # Bot Configuration
@@ -43,186 +47,134 @@ async def on_ready():
     """
     print('Logged on as {0}!'.format(bot.user.name))
 
-@bot.event
-async def on_message(message):
-    """
-    Coroutine event. Invoked when user sends a message
-    """
-    if len(channel.bot_channels) == 0 and message.content[0] == "!" and message.content.find("!channel") == -1:
-        return await message.channel.send("There are no bot channels. Use !channel add channel_name")
+    if "connect" not in startup.phases:
+        startup.mark("connect")
 
-    if (message.content.find("!channel") != -1):
-        return await bot.process_commands(message)
+    await extensions_loaded.wait()
 
-    if message.channel.name in channel.bot_channels:
+    # The features are imported by now
+    import drive_async
+    import drive_sync
+    import google_drive_feat
+    import library_index
 
-        result = await bot.process_commands(message)
+    # Warm up the caches at the same time. The Drive client is built (and googleapiclient imported) on a thread
+    await startup.warm({
+        "library index": library_index.start,
+        "drive client": lambda: drive_async.run(google_drive_feat.get_service),
+        "metrics": metrics.start,
+    })
+    drive_sync.start()
 
-        # Ensure no feedback loop.
-        if message.author.name != bot.user.name and message.content[0] != "!":
-            #Uncomment next line to test on_message
-            await photo.process_search_request(message)
-            # await example_feat.send_mess(message)
+    print(startup.report())
 
 @bot.event
-async def on_command_error(context, exception):
+async def on_message(message):
     """
-    Coroutine event. Invoked when error has occurred with processing a command.
+    Coroutine event. Invoked when user sends a message
     """
-    await context.send("An error has occurred with your request. {0}".format(exception))
+    action = message_filter.route(message, bot.selections)
 
+    if action == message_filter.IGNORE:
+        return
 
-# ================================================================================
-# Commands
-
-@bot.command(name="files")
-async def files(ctx):
-    """
-    Command for returning the recent files on google drive.
-    """
-    files = google_drive_feat.get_recent_files()
-
-    # print(files)
+    if action == message_filter.NO_CHANNELS:
+        return await send_queue.send(message.channel, "There are no bot channels. Use !channel add channel_name")
 
-    output = "\n"
-    for file in files:
-        print(file)
-        output += (file["name"] + "\n")
+    if action == message_filter.COMMAND:
+        if not extensions_loaded.is_set():
+            # Right after startup, the commands are still being imported
+            await extensions_loaded.wait()
+        return await bot.process_commands(message)
 
-    await ctx.send(output)
+    if action == message_filter.SELECTION:
+        # Handled by the media extension
+        bot.dispatch("selection", message)
 
-@bot.command(name="phototest")
-async def phototest(ctx):
+@bot.event
+async def on_command_error(context, exception):
     """
-    Testing if local photo can be uploaded to discord. Type !phototest
+    Coroutine event. Invoked when error has occurred with processing a command.
     """
-    file_buffered_io_stream = open("./bool_bot/files/red.jpeg", "rb")
-    file_photo = discord.File(file_buffered_io_stream, filename="red.jpeg")
-
-    embed = discord.Embed(title="The Gang", description="Wow an uploaded image")
-    embed.set_image(url="attachment://red.jpeg")
+    metrics.increment("errors", context.command.qualified_name if context.command else "unknown")
 
-    await ctx.send("Sending Photo", file=file_photo, embed=embed)
+    await send_queue.send(context, "An error has occurred with your request. {0}".format(exception))
 
-@bot.command(name="photo")
-async def photo_command(ctx, search_option, query):
+@bot.before_invoke
+async def before_command(ctx):
     """
-    Photo commands. Refer below for commands.
-
-    Flags
-
-    s or search - Search for a photo via name. Ex. !photo s kurt
-    e or exact - Return a photo with exact name. Ex. !photo e davidmald.jpg
-    i or id - Return a photo by google drive id. Ex. !photo i 1CeUaHMY5-Fm5XD36u3QWUZLaG6qAZUPq
-    r or random - Return a photo randomly from a query. Ex. !photo r justin
-    rf or randomfile - Return a photo randomly from a specified folder. Ex. !photo rf test
-
+    Coroutine hook. Invoked before every command. Starts the command timer
     """
+    ctx.started_at = time.perf_counter()
 
-    if search_option == "s" or search_option == "search":
-        # Searches for photos with name
-        await photo.photo_search(ctx, query)
-    elif search_option == "e" or search_option == "exact":
-        # Find and return photo with exact name
-        await photo.photo_name(ctx, query)
-    elif search_option == "i" or search_option == "id":
-        # Find and return photo with google id
-        await photo.photo_id(ctx, query)
-    elif search_option == "r" or search_option == "random":
-        # Return random photo from recent files list
-        await photo.photo_random(ctx, query)
-    elif search_option == "rf" or search_option == "randomfile":
-        # Return random photo from a specified folder
-        await photo.folder_random(ctx, query)
-    else:
-        await ctx.send("Something is wrong with your query, most likely that the option you provided is not valid")
-
-@bot.command(name="video")
-async def video_command(ctx, search_option, query):
+@bot.after_invoke
+async def after_command(ctx):
     """
-    Video commands. 
-
-    Flags
-
-    r or random - Searches for a video with query and return a random one. Ex. !video r jey
+    Coroutine hook. Invoked after every command, even if it failed. Records the command latency
     """
-    if search_option == "r" or search_option == "random":
-        await video.video_random(ctx, query)
+    metrics.observe("command", ctx.command.qualified_name, time.perf_counter() - ctx.started_at)
 
 
-@bot.command(name="listrequests")
-async def list_requests(ctx):
-    """
-    A development command to inspect the photo requests
-    """
-    await photo.print_photo_requests()
+# ================================================================================
+# Commands
 
-@bot.command(name="ls")
-async def ls(ctx):
-    """
-    Lists the subdirectories in root photo folder. Useful for finding a random photo in a folder
-    """
-    folder_ids, folder_names = google_drive_feat.get_folder_ids(ROOT_PHOTO_FOLDER_ID)
-    description = ''
+# Extensions holding the commands, in cogs/. Imported in the background while the bot connects
+EXTENSIONS = ("cogs.media", "cogs.channels", "cogs.admin")
 
-    for i in range(len(folder_names)-1):
-        description += "{0}. {1}\n".format(i, folder_names[i])
-        # Send decision embed
-    embed = discord.Embed(title='Sub-directories found:')
-    embed.description = description
+# Set once the commands are registered
+extensions_loaded = asyncio.Event()
 
-    # Takes discord message type
-    message = await ctx.send(embed=embed)
-    
-@bot.command(name="channel-list")
-async def channel_list(ctx):
+def load_extensions():
     """
-    Command to list which channels is the bot allowed be issued commands
+    Register the commands of every extension. Imports the feature modules they use if they are not imported yet.
+    An extension that fails to load is skipped, the commands of the others still work
     """
-    channels = ctx.guild.text_channels
-    
-    bot_active_channels = []
-    bot_nonactive_channels = []
-
-    for curr_channel in channels:
-        if curr_channel.name in channel.bot_channels:
-            bot_active_channels.append(curr_channel.name)
-        else:
-            bot_nonactive_channels.append(curr_channel.name)        
+    try:
+        for name in EXTENSIONS:
+            if name in bot.extensions:
+                continue
+            try:
+                bot.load_extension(name)
+            except Exception as exception:
+                print("Could not load extension {0}. {1}".format(name, exception))
+    finally:
+        # Commands and on_ready wait for this, it must be set whatever happened
+        extensions_loaded.set()
 
-    active_bot_message = "\n".join(bot_active_channels)
-    nonactive_bot_message = "\n".join(bot_nonactive_channels)
-
-    message = "Bot Access Channels\n\n{0}\n\nBot Non Access Channels\n\n{1}".format(active_bot_message, nonactive_bot_message)
-    embed = discord.Embed(title="Bot Permissions channel", description=message)
-    return await ctx.send("", embed=embed)
-
-@bot.command(name="channel")
-async def channel_command(ctx, flag, query):
+async def import_extensions():
     """
-    Add or remove bot from a specific channel. If added to a specific channel, regular users can issue bot commands. 
-    WARNING: Need to be an admin of the guild to issue this command
-
-    Flags
-    a or add - Add a bot to a channel. Ex. !channel a bool-bol-test
-    d or delete - Remove a bot from a channel. Ex. !channel d bool-bot-test
+    Import the extensions and the feature modules on a thread, while the bot connects to Discord, then register the
+    commands
     """
+    loop = asyncio.get_event_loop()
+    start = time.perf_counter()
 
-    # Make sure user is an admin
-
-    if not ctx.author.guild_permissions.administrator:
-        return
+    try:
+        for name in EXTENSIONS:
+            try:
+                await loop.run_in_executor(None, importlib.import_module, name)
+            except Exception as exception:
+                # load_extensions tries again and skips it
+                print("Could not import extension {0}. {1}".format(name, exception))
+    finally:
+        load_extensions()
 
-    if flag == "a" or flag == "add":
-        await channel.channel_add(ctx, query)
-    elif flag == "r" or flag == "remove":
-        await channel.channel_remove(ctx, query)
-    else:
-        return await ctx.send("Issues with your request. Are you sure you are entering the right flags")
+    startup.steps["commands"] = time.perf_counter() - start
 
 
 def main():
     """
     The entry point for the bot. Called in __main__.py
     """
-    bot.run(DISCORD_API_KEY)
+    startup.mark("imports")
+    # Routing messages needs the bot channels, before the first message comes in
+    channel.start()
+    bot.loop.create_task(import_extensions())
+    try:
+        bot.run(DISCORD_API_KEY)
+    finally:
+        # Channel changes are written behind. Don't lose the last ones
+        try:
+            channel.registry.flush()
+        except Exception as exception:
+            print("Could not save the bot channels. {0}".format(exception))
@@ -0,0 +1,507 @@
+import asyncio
+import os
+import sqlite3
+import threading
+
+# Features
+import catalog
+import google_drive_feat
+import drive_async
+import drive_batch
+import folder_tree
+import metrics
+import search_engine
+import sharding
+from settings import ROOT_PHOTO_FOLDER_ID, LIBRARY_INDEX_PATH
+
+# A local copy of the metadata of every photo and video under ROOT_PHOTO_FOLDER_ID, in any sub folder. It is loaded
+# from SQLite and rebuilt from Drive at startup, so searches and random picks don't need any Drive round trip. The
+# folder tree is crawled by folder_tree and kept with the files.
+#
+# Files are kept as compact catalog records, and searches return positions in the catalog instead of lists of files.
+#
+# Searches are ranked by search_engine: case insensitive, matching whole words, parts of words and near misses, best
+# matches first.
+#
+# The index remembers a start page token of the Drive changes feed, so drive_sync can keep it fresh by applying only
+# what changed. When the bot runs in several shard processes they share the database, and only the leader (see
+# sharding) writes to it.
+
+PHOTO_MIME_TYPES = ('image/jpeg', 'image/png', 'image/svg+xml')
+VIDEO_MIME_TYPES = ('video/mp4',)
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# Bump when SCHEMA changes. Older databases are dropped and rebuilt from Drive
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    parent_id TEXT,
+    modified_time TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT,
+    mime_type TEXT NOT NULL,
+    parent_id TEXT,
+    web_view_link TEXT,
+    md5_checksum TEXT,
+    modified_time TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Drive fields of a file and the files table columns they are stored in
+FILE_FIELDS = ("id", "name", "description", "mimeType", "parents", "webViewLink", "md5Checksum", "modifiedTime")
+FILE_COLUMNS = ("id", "name", "description", "mime_type", "parent_id", "web_view_link", "md5_checksum", "modified_time")
+INSERT_FOLDER = "INSERT OR REPLACE INTO folders (id, name, parent_id, modified_time) VALUES (?, ?, ?, ?)"
+INSERT_FILE = "INSERT OR REPLACE INTO files ({0}) VALUES ({1})".format(", ".join(FILE_COLUMNS), ", ".join("?" * len(FILE_COLUMNS)))
+
+# ================================================================================
+# Index
+
+class LibraryIndex(object):
+    """
+    Searchable index of the photo library.
+
+    Reads never lock. A rebuild builds a new catalog and search indexes and swaps them in, and incremental changes
+    replace posting sets instead of mutating them, so a search running on the event loop always sees a consistent
+    index while writers run on the Drive thread pool.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.ready = False
+        self.page_token = None
+
+        # Bumped on every save, so the other shard processes know when to load it again
+        self.version = 0
+
+        self._files = catalog.Catalog()
+        self._folders = {}
+        self._children = {}
+        self._photo_search = search_engine.SearchIndex()
+        self._video_search = search_engine.SearchIndex()
+        self._write_lock = threading.Lock()
+
+        # Measured when the index is built, not kept up to date by incremental changes
+        self.catalog_bytes = 0
+
+    def __len__(self):
+        return len(self._files)
+
+    def get_file(self, id):
+        """
+        Returns the file with this id, or None if it is not in the index
+        """
+        return self._files.get(id)
+
+    def stats(self):
+        """
+        Returns the size of the index
+        """
+        files = len(self._files)
+        return {
+            "files": files,
+            "folders": len(self._folders),
+            "catalog_bytes": self.catalog_bytes,
+            "bytes_per_file": self.catalog_bytes / float(files) if files > 0 else 0.0,
+        }
+
+    # ----------------------------------------------------------------
+    # Loading and saving
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        connection = sqlite3.connect(self.path)
+        # Shard processes read the index while the leader writes it
+        connection.execute("PRAGMA journal_mode = WAL")
+        if connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            connection.executescript("DROP TABLE IF EXISTS folders; DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS meta;")
+            connection.execute("PRAGMA user_version = {0}".format(SCHEMA_VERSION))
+        connection.executescript(SCHEMA)
+        return connection
+
+    def load(self):
+        """
+        Load the index from SQLite. Returns the number of files loaded
+        """
+        connection = self._connect()
+        try:
+            folders = [
+                {"id": id, "name": name, "parents": [parent_id], "modifiedTime": modified_time}
+                for id, name, parent_id, modified_time in connection.execute("SELECT id, name, parent_id, modified_time FROM folders")
+            ]
+            files = [
+                _file_record(row)
+                for row in connection.execute("SELECT {0} FROM files".format(", ".join(FILE_COLUMNS)))
+            ]
+            row = connection.execute("SELECT value FROM meta WHERE key = 'page_token'").fetchone()
+            version = _saved_version(connection)
+        finally:
+            connection.close()
+
+        with self._write_lock:
+            self._swap(folders, files)
+            self.page_token = row[0] if row else None
+            self.version = version
+
+        if len(files) > 0:
+            self.ready = True
+
+        return len(files)
+
+    def reload_if_changed(self):
+        """
+        Load the index again if another process saved changes to it. Returns True if it was loaded
+        """
+        connection = self._connect()
+        try:
+            version = _saved_version(connection)
+        finally:
+            connection.close()
+
+        if version == self.version:
+            return False
+
+        self.load()
+        return True
+
+    def save(self):
+        """
+        Write the whole index to SQLite
+        """
+        folders = list(self._folders.values())
+        files = self._files.values()
+
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM folders")
+                connection.execute("DELETE FROM files")
+                connection.executemany(INSERT_FOLDER, [_folder_row(folder) for folder in folders])
+                connection.executemany(INSERT_FILE, [_file_row(file) for file in files])
+                _save_page_token(connection, self.page_token)
+                self.version = _bump_version(connection)
+        finally:
+            connection.close()
+
+    def rebuild(self, root_folder_id):
+        """
+        Rebuild the index from Drive and save it. Blocking, run it on the Drive thread pool.
+
+        root_folder_id : String - The id of the root photo folder
+        """
+        # Take the token first, changes made while listing are applied by the next sync
+        page_token = google_drive_feat.get_start_page_token()
+
+        # Only folders that changed since the last crawl are listed again
+        folders = folder_tree.crawl(root_folder_id, self._folders)
+        folder_ids = [folder["id"] for folder in folders] + [root_folder_id]
+        files = google_drive_feat.get_library_files(folder_ids)
+
+        self.replace(folders, files, page_token)
+
+        return len(files)
+
+    def replace(self, folders, files, page_token=None):
+        """
+        Replace the contents of the index and save it
+
+        folders : Array<Object(id, name, parents, modifiedTime)> - The folders
+        files : Array<Object(id, name, description, mimeType, parents, webViewLink)> - The files
+        page_token : String - The changes feed token taken before listing the files
+        """
+        with self._write_lock:
+            self._swap(folders, [catalog.FileRecord.from_drive(file) for file in files])
+            self.page_token = page_token
+            self.save()
+
+        self.ready = True
+
+    def _swap(self, folders, files):
+        file_catalog = catalog.Catalog(files)
+        photo_search = search_engine.SearchIndex([file for file in files if file.mime_type in PHOTO_MIME_TYPES])
+        video_search = search_engine.SearchIndex([file for file in files if file.mime_type in VIDEO_MIME_TYPES])
+        catalog_bytes = file_catalog.nbytes()
+
+        self._folders = {folder["id"]: folder for folder in folders}
+        self._children = folder_tree.children_map(folders)
+        self._files = file_catalog
+        self._photo_search = photo_search
+        self._video_search = video_search
+        self.catalog_bytes = catalog_bytes
+
+    # ----------------------------------------------------------------
+    # Incremental changes
+
+    def apply_changes(self, changes, page_token, root_folder_id=ROOT_PHOTO_FOLDER_ID):
+        """
+        Apply changes from the Drive changes feed and save them. Blocking, run it on the Drive thread pool.
+
+        changes : Array<Object(fileId, removed, file)> - The changes from google_drive_feat.get_changes
+        page_token : String - The token to use for the next poll
+
+        return : Integer - The number of files and folders added, updated or removed
+        """
+        with self._write_lock:
+            saved_folders = []
+            saved_files = []
+            removed_ids = []
+
+            for change in changes:
+                file = change.get("file")
+
+                if change.get("removed") or file is None or file.get("trashed"):
+                    removed_ids.extend(self._remove(change["fileId"]))
+                    continue
+
+                parent = _parent(file)
+
+                if file["mimeType"] == FOLDER_MIME_TYPE:
+                    if parent == root_folder_id or parent in self._folders:
+                        moved_in = file["id"] not in self._folders
+                        folder = {"id": file["id"], "name": file["name"], "parents": [parent], "modifiedTime": file.get("modifiedTime")}
+                        self._folders[folder["id"]] = folder
+                        saved_folders.append(folder)
+
+                        if moved_in:
+                            # Its sub folders and files are not in the feed, they did not change
+                            folders, files = self._list_subtree(folder["id"])
+                            saved_folders.extend(folders)
+                            saved_files.extend(files)
+                    else:
+                        removed_ids.extend(self._remove(file["id"]))
+                elif file["mimeType"] in PHOTO_MIME_TYPES + VIDEO_MIME_TYPES:
+                    if parent == root_folder_id or parent in self._folders:
+                        record = catalog.FileRecord.from_drive(file)
+                        self._put_file(record)
+                        saved_files.append(record)
+                    else:
+                        removed_ids.extend(self._remove(file["id"]))
+
+            count = len(saved_folders) + len(saved_files) + len(removed_ids)
+
+            # Only what is still in the index is saved. A file added and then trashed, or added to a folder removed
+            # later in the batch, is not
+            saved_folders = [folder for folder in saved_folders if self._folders.get(folder["id"]) is folder]
+            saved_files = [file for file in saved_files if self._files.get(file.id) is file]
+
+            self.page_token = page_token
+            if len(saved_folders) + len(removed_ids) > 0:
+                self._children = folder_tree.children_map(list(self._folders.values()))
+
+            connection = self._connect()
+            try:
+                with connection:
+                    connection.executemany("DELETE FROM folders WHERE id = ?", [(id,) for id in removed_ids])
+                    connection.executemany("DELETE FROM files WHERE id = ?", [(id,) for id in removed_ids])
+                    connection.executemany(INSERT_FOLDER, [_folder_row(folder) for folder in saved_folders])
+                    connection.executemany(INSERT_FILE, [_file_row(file) for file in saved_files])
+                    _save_page_token(connection, page_token)
+                    self.version = _bump_version(connection)
+            finally:
+                connection.close()
+
+        return count
+
+    def _put_file(self, file):
+        """
+        Add or replace a file. The search index replaces its posting sets, never changes them, so running searches are
+        not affected
+        """
+        if file.mime_type in VIDEO_MIME_TYPES:
+            self._photo_search.remove(file.id)
+            self._video_search.put(file)
+        else:
+            self._video_search.remove(file.id)
+            self._photo_search.put(file)
+
+        self._files.put(file)
+
+    def _list_subtree(self, folder_id):
+        """
+        Add the sub folders and files of a folder that moved into the tree. Returns them
+        """
+        folders = folder_tree.crawl(folder_id)
+        for folder in folders:
+            self._folders[folder["id"]] = folder
+
+        folder_ids = [folder["id"] for folder in folders] + [folder_id]
+        files = [catalog.FileRecord.from_drive(file) for file in google_drive_feat.get_library_files(folder_ids)]
+        for file in files:
+            self._put_file(file)
+
+        return folders, files
+
+    def _remove(self, id):
+        """
+        Remove a file, or a folder with its sub folders and their files. Returns the ids removed from the index
+        """
+        if id not in self._folders:
+            if not self._files.remove(id):
+                return []
+
+            self._photo_search.remove(id)
+            self._video_search.remove(id)
+            return [id]
+
+        # The folder may have been added by this batch of changes, after _children was built
+        folder_ids = [id] + folder_tree.descendants(folder_tree.children_map(list(self._folders.values())), id)
+        for folder_id in folder_ids:
+            del self._folders[folder_id]
+
+        folder_ids = set(folder_ids)
+        file_ids = [file.id for file in self._files.values() if file.parent_id in folder_ids]
+        for file_id in file_ids:
+            self._files.remove(file_id)
+            self._photo_search.remove(file_id)
+            self._video_search.remove(file_id)
+
+        return list(folder_ids) + file_ids
+
+    # ----------------------------------------------------------------
+    # Queries
+
+    def search(self, query, video=False, limit=None):
+        """
+        Get the files matching the query, best matches first
+
+        query : String - The query. Every word must match a word of the name or description, ignoring case
+        video : Boolean - Search videos instead of photos
+        limit : Integer - The most files returned. Every match if None
+
+        return found_files : catalog.ResultSet<Object(id, name, description, webViewLink)> - The found files
+        """
+        search_index = self._video_search if video else self._photo_search
+
+        return self._files.results(search_index.search(query, limit=limit))
+
+    def folder_contents(self, name):
+        """
+        Get the photos in a folder anywhere under the root folder, including the ones in its sub folders.
+        Same results as google_drive_feat.get_folder_contents for direct sub folders of the root folder.
+
+        name : String - The folder name
+
+        return : catalog.ResultSet<Object(id, name, webViewLink)> | String - The files, or "No Folder" / "Multiple Folders"
+        """
+        folder_ids = [folder["id"] for folder in list(self._folders.values()) if folder["name"] == name]
+
+        if len(folder_ids) > 1:
+            return "Multiple Folders"
+
+        if len(folder_ids) == 0:
+            return "No Folder"
+
+        folder_ids = set([folder_ids[0]] + folder_tree.descendants(self._children, folder_ids[0]))
+
+        return self._files.select(lambda file: file.parent_id in folder_ids and file.mime_type in PHOTO_MIME_TYPES)
+
+    def folder_listing(self, root_folder_id=ROOT_PHOTO_FOLDER_ID):
+        """
+        Returns every folder under the root folder depth first, sorted by name. Used by !ls
+
+        return : Array<(Integer, Object(id, name))> - (depth, folder) pairs
+        """
+        return folder_tree.walk(self._folders, self._children, root_folder_id)
+
+def _file_record(row):
+    """
+    Turn a row of the files table into a catalog record, read like the Drive response
+    """
+    return catalog.FileRecord(*row)
+
+def _folder_row(folder):
+    return (folder["id"], folder["name"], _parent(folder), folder.get("modifiedTime"))
+
+def _file_row(file):
+    """
+    Turn a file object from Drive into a row of the files table
+    """
+    return tuple(_parent(file) if field == "parents" else file.get(field) for field in FILE_FIELDS)
+
+def _save_page_token(connection, page_token):
+    connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('page_token', ?)", (page_token,))
+
+def _saved_version(connection):
+    row = connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    return int(row[0]) if row else 0
+
+def _bump_version(connection):
+    version = _saved_version(connection) + 1
+    connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (str(version),))
+    return version
+
+def _parent(item):
+    parents = item.get("parents")
+    return parents[0] if parents else None
+
+# Global Vars
+library = LibraryIndex(LIBRARY_INDEX_PATH)
+_started = False
+
+metrics.register_collector("library_index", lambda: library.stats())
+
+# ================================================================================
+# Bot functions
+
+async def start():
+    """
+    Load the saved index, then rebuild it from Drive in the background if this process is the sharding leader. Called
+    when the bot starts up. on_ready is called again after reconnecting, so this only does anything the first time.
+    """
+    global _started
+
+    if _started:
+        return
+    _started = True
+
+    try:
+        await drive_async.run(library.load)
+    except Exception as exception:
+        # Ex. a corrupt database. Searches go to Drive until the index is rebuilt
+        print("Could not load library index. {0}".format(exception))
+
+    # The other shard processes get the rebuilt index through drive_sync
+    if sharding.leader.acquire():
+        asyncio.ensure_future(refresh())
+
+async def refresh():
+    """
+    Rebuild the index from Drive
+    """
+    try:
+        count = await drive_async.run(library.rebuild, ROOT_PHOTO_FOLDER_ID)
+        print("Library index built with {0} files".format(count))
+    except Exception as exception:
+        print("Could not build library index. {0}".format(exception))
+
+async def search_files(query, video=False, limit=None):
+    """
+    Search the index, best matches first. Falls back to Drive if the index is not built yet, the results are then
+    those of google_drive_feat.get_files_search, unranked
+    """
+    if library.ready:
+        return library.search(query, video=video, limit=limit)
+
+    found_files = await drive_async.get_files_search(query, video=video)
+    return found_files[:limit] if limit is not None else found_files
+
+async def folder_contents(query):
+    """
+    Get the photos of a folder from the index, or Drive if the index is not built yet
+    """
+    if library.ready:
+        return library.folder_contents(query)
+
+    return await drive_batch.get_folder_contents(query)
@@ -0,0 +1,376 @@
+import asyncio
+import collections
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows. Downloads are not shared with other processes there
+    fcntl = None
+
+# Features
+import google_drive_feat
+import drive_async
+import drive_batch
+import library_index
+import metrics
+from settings import MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES
+
+# On disk cache of the photos and videos downloaded from Drive, so a popular file is only downloaded once.
+#
+# Entries are keyed by Drive file id, and rendition for the prepared copies made by media_prep, and named after the
+# md5Checksum (or modifiedTime) of the file, so an edited file is downloaded again. The least recently used entries
+# are evicted once the cache is over MEDIA_CACHE_MAX_BYTES. Downloads are written to a temporary file that is renamed
+# into place, and concurrent requests for the same file share one download. Set MEDIA_CACHE_MAX_BYTES to 0 to never
+# write downloads to disk.
+#
+# The shard processes of a sharded bot share the directory. A file another process downloaded is used from disk, and
+# a process about to download a file another one is downloading waits for it (a lock in LOCK_FILE), so a file is only
+# downloaded once whatever the number of processes. Each process keeps its own view of the cache size.
+
+# Prefix of the files being downloaded. Left over ones are removed when the cache starts, if they are older than
+# TEMP_MAX_AGE seconds. Newer ones may be downloads of another shard process
+TEMP_PREFIX = ".tmp-"
+TEMP_MAX_AGE = 3600
+
+# Locked by the process downloading a file, one byte per file
+LOCK_FILE = ".locks"
+LOCK_SLOTS = 1 << 20
+
+def file_version(file):
+    """
+    Returns what identifies the contents of a file: its md5Checksum, or its modifiedTime for Google Docs files
+
+    file : Object(md5Checksum, modifiedTime) - The file metadata
+    """
+    return file.get("md5Checksum") or file.get("modifiedTime") or ""
+
+def cache_key(file_id, rendition=None):
+    """
+    Returns the key of a file, or of one of its renditions, in the cache. Ex. "abc" or "abc.thumb1600px1024k"
+    """
+    return file_id if rendition is None else "{0}.{1}".format(file_id, rendition.name)
+
+class MediaCache(object):
+    """
+    Size bounded LRU cache of downloaded files. Used from the event loop only, downloads run on the Drive thread pool.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+
+        # Counters. shared is the number of requests that waited on a download started by another request
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+        # cache key -> (path, size), least recently used first
+        self._entries = collections.OrderedDict()
+        # (cache key, version) -> futures of the requests waiting on the download of another request
+        self._inflight = {}
+        self._scanned = False
+        self._locks = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Returns the cache counters
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared,
+            "entries": len(self._entries),
+            "bytes": self.size,
+        }
+
+    async def open(self, file_id, version=None, rendition=None, metadata=None):
+        """
+        Returns the contents of an up to date copy of the file, downloading it if needed. Close it when done.
+
+        On a miss the download is handed over in memory (or in an anonymous temporary file if it is big) while it is
+        written to the cache, so the sender never reads it back from disk.
+
+        file_id : String - The Drive file id
+        version : String - The file_version of the file. Looked up in the library index or Drive if missing
+        rendition : media_prep.Rendition - Get a prepared copy of the file instead of the original
+        metadata : Object - The google_drive_feat.get_file_metadata of the file, if the caller has it. Gives the
+                   version, and the download doesn't look it up again
+
+        return : File - The file contents, at position 0
+        """
+        self._scan()
+
+        if metadata is None and version is None:
+            metadata = await self._metadata(file_id)
+        if version is None:
+            version = file_version(metadata)
+
+        key = cache_key(file_id, rendition)
+        path = self._path(key, version)
+
+        waiters = self._inflight.get((key, version))
+        if waiters is not None:
+            # Another request is downloading the file. It hands over a copy once it is done, even if nothing is cached
+            self.shared += 1
+            waiter = asyncio.get_event_loop().create_future()
+            waiters.append(waiter)
+            try:
+                return await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                    waiter.result().close()
+                raise
+
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != path:
+            # Maybe downloaded by another shard process
+            entry = self._adopt(key, path)
+
+        if entry is not None:
+            try:
+                buffer = open(path, "rb")
+            except FileNotFoundError:
+                # Evicted by another shard process
+                self._entries.pop(key, None)
+                self.size -= entry[1]
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return buffer
+
+        self.misses += 1
+        waiters = self._inflight[(key, version)] = []
+        task = asyncio.ensure_future(self._fetch(key, version, file_id, path, rendition, metadata, waiters))
+
+        # A cancelled request must not cancel the download other requests are waiting on
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Nobody reads the buffer then
+            task.add_done_callback(_close_result)
+            raise
+
+    def _adopt(self, key, path):
+        """
+        Add a file found on disk to the entries. Returns the entry, or None if the file is not there
+        """
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            return None
+
+        self.invalidate(key)
+        entry = self._entries[key] = (path, size)
+        self.size += size
+        self._evict()
+        return entry if key in self._entries else None
+
+    def invalidate(self, key):
+        """
+        Remove a file from the cache
+
+        key : String - The cache_key of the file
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._delete(entry)
+
+    async def _metadata(self, file_id):
+        """
+        Returns what is known of a file: its library index record, or its metadata from Drive if it is not indexed
+        """
+        file = library_index.library.get_file(file_id)
+        if file is not None and file_version(file):
+            return file
+
+        return await drive_batch.get_file_metadata(file_id)
+
+    async def _fetch(self, key, version, file_id, path, rendition, metadata, waiters):
+        try:
+            buffer, size = await drive_async.run(self._locked_download, key, file_id, path, rendition, metadata)
+        except BaseException as exception:
+            for waiter in waiters:
+                if waiter.done():
+                    continue
+                if isinstance(exception, asyncio.CancelledError):
+                    waiter.cancel()
+                else:
+                    waiter.set_exception(exception)
+            raise
+        finally:
+            del self._inflight[(key, version)]
+
+        if size > 0:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] == path:
+                # The same file, adopted from another shard process while downloading. Already replaced on disk
+                self.size -= entry[1]
+            elif entry is not None:
+                # An older version of the file
+                self._delete(entry)
+            self._entries[key] = (path, size)
+            self.size += size
+            self._evict()
+
+        self._share(buffer, path, size, waiters)
+        return buffer
+
+    def _share(self, buffer, path, size, waiters):
+        """
+        Give every waiting request its own readable copy of a download: the cached file, or the contents in memory if
+        it was not cached
+        """
+        data = None
+        for waiter in waiters:
+            if waiter.done():
+                # Cancelled
+                continue
+
+            copy = None
+            if size > 0:
+                try:
+                    copy = open(path, "rb")
+                except FileNotFoundError:
+                    # Evicted by another shard process
+                    pass
+
+            if copy is None:
+                if data is None:
+                    buffer.seek(0)
+                    data = buffer.read()
+                    buffer.seek(0)
+                copy = io.BytesIO(data)
+
+            waiter.set_result(copy)
+
+    def _locked_download(self, key, file_id, path, rendition=None, metadata=None):
+        """
+        _download, unless another shard process downloads the file at the same time. Then wait for it and read its
+        copy
+        """
+        if fcntl is None or self.max_bytes <= 0:
+            return self._download(file_id, path, rendition, metadata)
+
+        lock_file = self._lock_file()
+        slot = int(hashlib.md5(key.encode("utf-8")).hexdigest(), 16) % LOCK_SLOTS
+        fcntl.lockf(lock_file, fcntl.LOCK_EX, 1, slot)
+        try:
+            try:
+                buffer = open(path, "rb")
+            except FileNotFoundError:
+                return self._download(file_id, path, rendition, metadata)
+
+            # Downloaded by another process while waiting
+            return buffer, os.fstat(buffer.fileno()).st_size
+        finally:
+            fcntl.lockf(lock_file, fcntl.LOCK_UN, 1, slot)
+
+    def _lock_file(self):
+        # Opened once. Closing any descriptor of the file would release the locks of the process
+        if self._locks is None:
+            self._locks = open(os.path.join(self.directory, LOCK_FILE), "a")
+        return self._locks
+
+    def _download(self, file_id, path, rendition=None, metadata=None):
+        """
+        Download a file, or make a rendition of it, into a buffer and save a copy in the cache. Returns the buffer and
+        the number of bytes cached
+        """
+        metadata = metadata or {}
+        if rendition is None:
+            buffer = google_drive_feat.download_file_to_buffer(
+                file_id, md5=metadata.get("md5Checksum"), size=metadata.get("size"))
+        elif "size" in metadata:
+            buffer = rendition.produce(file_id, metadata)
+        else:
+            # A library index record doesn't have the size and thumbnail the rendition needs
+            buffer = rendition.produce(file_id)
+
+        if self.max_bytes <= 0:
+            return buffer, 0
+
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                shutil.copyfileobj(buffer, temp_file)
+            # Renamed into place, so a partial file is never seen in the cache
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            buffer.close()
+            raise
+
+        size = buffer.tell()
+        buffer.seek(0)
+
+        return buffer, size
+
+    def _evict(self):
+        # Always keep the newest entry, even if it is bigger than the whole budget, since it is about to be sent
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            key, entry = self._entries.popitem(last=False)
+            self._delete(entry)
+
+    def _delete(self, entry):
+        path, size = entry
+        self.size -= size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _path(self, key, version):
+        version_hash = hashlib.md5(version.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, "{0}-{1}".format(key, version_hash))
+
+    def _scan(self):
+        """
+        Load the entries already on disk, least recently modified first. Only runs once
+        """
+        if self._scanned:
+            return
+        self._scanned = True
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+            return
+
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name == LOCK_FILE:
+                continue
+            stat = os.stat(path)
+            if name.startswith(TEMP_PREFIX):
+                if time.time() - stat.st_mtime > TEMP_MAX_AGE:
+                    os.remove(path)
+                continue
+
+            found.append((stat.st_mtime, name.rsplit("-", 1)[0], path, stat.st_size))
+
+        for mtime, key, path, size in sorted(found):
+            # Older versions of the same file are stale
+            self.invalidate(key)
+            self._entries[key] = (path, size)
+            self.size += size
+
+        self._evict()
+
+def _close_result(task):
+    if not task.cancelled() and task.exception() is None:
+        task.result().close()
+
+# Global Vars
+cache = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES)
+
+metrics.register_collector("media_cache", lambda: cache.stats())
@@ -0,0 +1,168 @@
+import io
+import os
+import re
+
+# Features
+import google_drive_feat
+from settings import PHOTO_MAX_DIMENSION, PHOTO_TARGET_BYTES, DISCORD_UPLOAD_LIMIT
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    # Pillow is optional. Without it photos are sent as they are, or as their Drive thumbnail
+    Image = None
+
+# Prepares photos before they are uploaded to Discord, so a multi megabyte camera photo isn't uploaded as is.
+#
+# A rendition is a prepared copy of a file: at most max_dimension pixels wide and high, recompressed to about
+# target_bytes. Small enough originals are used as they are. Otherwise the Drive thumbnailLink of the right size is
+# downloaded instead of the whole file when Drive has one, and what is still too big is downscaled and recompressed
+# with Pillow. media_cache caches renditions by (file id, rendition).
+#
+# Videos are not transcoded. Ones bigger than DISCORD_UPLOAD_LIMIT are sent as a link (see too_big).
+
+# JPEG qualities tried in order until the photo fits in the target size
+JPEG_QUALITIES = (85, 75, 65)
+
+# When even the lowest quality is too big, the photo is scaled down by this much and tried again, at most this many times
+DOWNSCALE_FACTOR = 0.75
+MAX_DOWNSCALES = 4
+
+THUMBNAIL_SIZE = re.compile(r"=s\d+$")
+
+# ================================================================================
+# Renditions
+
+class Rendition(object):
+    """
+    How a photo is prepared. Used as media_cache.MediaCache.open(file_id, rendition=...)
+
+    name : String - Names the rendition in the cache. Includes the parameters, so changing them doesn't reuse old copies
+    max_dimension : Integer - Biggest width and height, in pixels
+    target_bytes : Integer - Size to recompress to
+    use_thumbnail : Boolean - Download the Drive thumbnail instead of the file when there is one
+    """
+
+    def __init__(self, max_dimension, target_bytes, use_thumbnail=True):
+        self.max_dimension = max_dimension
+        self.target_bytes = target_bytes
+        self.use_thumbnail = use_thumbnail
+        self.name = "{0}{1}px{2}k".format("thumb" if use_thumbnail else "full", max_dimension, target_bytes // 1024)
+
+    def produce(self, file_id, metadata=None):
+        """
+        Make the rendition of a file. Blocking, run it on the Drive thread pool.
+
+        metadata : Object - The google_drive_feat.get_file_metadata of the file. Looked up if missing
+
+        return : BytesIO | File - The prepared photo, at position 0
+        """
+        if metadata is None:
+            metadata = google_drive_feat.get_file_metadata(file_id)
+
+        size = int(metadata.get("size", 0))
+        md5 = metadata.get("md5Checksum")
+        image = metadata.get("imageMediaMetadata") or {}
+        dimension = max(image.get("width", 0), image.get("height", 0))
+
+        if 0 < size <= self.target_bytes and dimension <= self.max_dimension:
+            # Small enough already
+            return google_drive_feat.download_file_to_buffer(file_id, md5=md5, size=size)
+
+        if self.use_thumbnail and metadata.get("thumbnailLink"):
+            try:
+                buffer = google_drive_feat.download_link(thumbnail_url(metadata["thumbnailLink"], self.max_dimension))
+                return shrink_image(buffer, self.max_dimension, self.target_bytes)
+            except Exception as exception:
+                print("Could not download the thumbnail of {0}, downloading the file. {1}".format(file_id, exception))
+
+        buffer = google_drive_feat.download_file_to_buffer(file_id, md5=md5, size=size or None)
+        return shrink_image(buffer, self.max_dimension, self.target_bytes)
+
+# Used by send_photo
+PHOTO = Rendition(PHOTO_MAX_DIMENSION, PHOTO_TARGET_BYTES)
+
+def thumbnail_url(thumbnail_link, max_dimension):
+    """
+    Returns the link of the Drive thumbnail at the given size. Ex. "https://lh3.googleusercontent.com/abc=s220" -> "...=s1600"
+    """
+    return THUMBNAIL_SIZE.sub("=s{0}".format(max_dimension), thumbnail_link)
+
+# ================================================================================
+# Images
+
+def shrink_image(buffer, max_dimension, target_bytes):
+    """
+    Downscale and recompress a photo to JPEG if it is too big. Returns the buffer itself if it is small enough, if it
+    isn't a photo Pillow can read (ex. svg), or if Pillow is not installed.
+
+    buffer : BytesIO | File - The photo, at position 0. Closed if a new buffer is returned
+    max_dimension : Integer - Biggest width and height, in pixels
+    target_bytes : Integer - Size to recompress to. Best effort
+
+    return : BytesIO | File - The photo, at position 0
+    """
+    if Image is None:
+        return buffer
+
+    size = buffer.seek(0, os.SEEK_END)
+    buffer.seek(0)
+
+    try:
+        image = Image.open(buffer)
+        image.load()
+    except Exception:
+        buffer.seek(0)
+        return buffer
+
+    if size <= target_bytes and max(image.size) <= max_dimension:
+        buffer.seek(0)
+        return buffer
+
+    # Camera photos are often stored sideways with an EXIF orientation
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode in ("RGBA", "LA", "P"):
+        # JPEG has no transparency. Put it on white
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    for attempt in range(MAX_DOWNSCALES + 1):
+        output = _encode(image, target_bytes)
+        if output.tell() <= target_bytes or attempt == MAX_DOWNSCALES:
+            break
+        image = image.resize((max(1, int(image.width * DOWNSCALE_FACTOR)), max(1, int(image.height * DOWNSCALE_FACTOR))), Image.LANCZOS)
+
+    buffer.close()
+    output.seek(0)
+    return output
+
+def _encode(image, target_bytes):
+    # Highest JPEG quality that fits, or the lowest one
+    for quality in JPEG_QUALITIES:
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=quality, optimize=True)
+        if output.tell() <= target_bytes:
+            break
+
+    return output
+
+def view_link(file_id):
+    """
+    Returns the Drive link of a file. Sent instead of files too big for Discord
+    """
+    return "https://drive.google.com/file/d/{0}/view".format(file_id)
+
+def too_big(buffer, limit=DISCORD_UPLOAD_LIMIT):
+    """
+    Returns True if a file is too big to be uploaded to Discord. Leaves the buffer at position 0
+    """
+    size = buffer.seek(0, os.SEEK_END)
+    buffer.seek(0)
+    return size > limit
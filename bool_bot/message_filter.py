@@ -0,0 +1,68 @@
+# Features
+import channel
+
+# Decides what on_message does with a message, before anything is awaited.
+#
+# on_message runs for every message in every guild the bot is in, and almost all of them are not for the bot. Every
+# check here is a set lookup or a prefix check on the message content, and the command name is parsed once, so
+# unrelated messages are dropped without scanning them or calling bot.process_commands.
+
+PREFIX = "!"
+
+# Commands allowed in any channel, so a guild without bot channels can add one
+CHANNEL_COMMANDS = frozenset(["channel", "channel-list"])
+
+# Routes
+IGNORE = "ignore"
+COMMAND = "command"
+NO_CHANNELS = "no channels"
+SELECTION = "selection"
+
+# ================================================================================
+# Routing
+
+def route(message, pending):
+    """
+    Returns what to do with a message
+
+    message : Message - The discord message
+    pending : Set or Object - (user id, channel id) of the pending photo search requests. Only used with in
+
+    return : String - IGNORE, COMMAND (run bot.process_commands), NO_CHANNELS (tell the guild to add a bot channel) or
+             SELECTION (answer to a pending search request)
+    """
+    content = message.content
+    is_command = content.startswith(PREFIX)
+
+    # Most messages are chatter: not a command and no pending request. Drop them first
+    if not is_command and (message.author.id, message.channel.id) not in pending:
+        return IGNORE
+
+    # Ensure no feedback loop. Also ignores other bots, like bot.process_commands does
+    if message.author.bot:
+        return IGNORE
+
+    guild = message.guild
+    if guild is None:
+        # Direct message
+        return IGNORE
+
+    guild_channel_ids = channel.registry.channels(guild.id)
+
+    if is_command:
+        if command_name(content) in CHANNEL_COMMANDS:
+            return COMMAND
+
+        if len(guild_channel_ids) == 0:
+            return NO_CHANNELS
+
+        return COMMAND if message.channel.id in guild_channel_ids else IGNORE
+
+    return SELECTION if message.channel.id in guild_channel_ids else IGNORE
+
+def command_name(content):
+    """
+    Returns the command name of a message starting with the prefix. Ex. "photo" for "!photo s kurt"
+    """
+    words = content[len(PREFIX):].split(None, 1)
+    return words[0] if len(words) > 0 else ""
@@ -0,0 +1,281 @@
+import asyncio
+import bisect
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+from settings import METRICS_FILE, METRICS_PORT, METRICS_DUMP_INTERVAL
+
+# Latency histograms and counters for bot commands and Drive calls. Used to tell where a slow command spends its
+# time (credentials, listing, download or the Discord upload).
+#
+# Latencies are recorded per (kind, name), ex. ("command", "photo") or ("drive", "files.list"), and counters per
+# (metric, label), ex. ("errors", "photo"). Other modules register collectors (ex. the media cache counters) that are
+# added to every snapshot. The !stats command shows a summary, and the metrics can be written as JSON to
+# METRICS_FILE and served as Prometheus text on METRICS_PORT.
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+
+# ================================================================================
+# Histogram
+
+class Histogram(object):
+    """
+    Latency histogram with fixed buckets
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        """
+        Returns the upper bound of the bucket the q quantile falls in. Ex. quantile(0.5) for the median
+        """
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+
+        return self.buckets[-1]
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": {_bound_label(bound): count for bound, count in zip(self.buckets, self.counts)},
+        }
+
+# Global Vars
+_histograms = {}
+_counters = {}
+_collectors = {}
+_lock = threading.Lock()
+_tasks = []
+
+# ================================================================================
+# Recording
+
+def observe(kind, name, seconds):
+    """
+    Record a latency
+
+    kind : String - What is timed. Ex. "command", "drive"
+    name : String - Which one. Ex. "photo", "files.list"
+    seconds : Float - The latency
+    """
+    with _lock:
+        histogram = _histograms.get((kind, name))
+        if histogram is None:
+            histogram = _histograms[(kind, name)] = Histogram()
+        histogram.observe(seconds)
+
+def increment(metric, label, amount=1):
+    """
+    Add to a counter
+
+    metric : String - The counter. Ex. "errors", "drive_bytes_downloaded"
+    label : String - What it is counted for. Ex. the command name
+    """
+    with _lock:
+        _counters[(metric, label)] = _counters.get((metric, label), 0) + amount
+
+def timed(kind, name):
+    """
+    Decorator recording the latency of a blocking function, and counting its errors.
+
+    Ex.
+    @metrics.timed("drive", "get_folder_ids")
+    def get_folder_ids(root_folder_id):
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                increment("errors", "{0}.{1}".format(kind, name))
+                raise
+            finally:
+                observe(kind, name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+def register_collector(name, func):
+    """
+    Add the values returned by func to every snapshot
+
+    name : String - The section name in the snapshot. Ex. "media_cache"
+    func : Function - Returns a dict of numbers
+    """
+    _collectors[name] = func
+
+def reset():
+    """
+    Forget everything recorded. Collectors are kept
+    """
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+# ================================================================================
+# Reporting
+
+def snapshot():
+    """
+    Returns every metric as a JSON serializable dict
+    """
+    with _lock:
+        latencies = {}
+        for (kind, name), histogram in sorted(_histograms.items()):
+            latencies.setdefault(kind, {})[name] = histogram.to_dict()
+
+        counters = {}
+        for (metric, label), value in sorted(_counters.items()):
+            counters.setdefault(metric, {})[label] = value
+
+    collected = {}
+    for name, func in sorted(_collectors.items()):
+        try:
+            collected[name] = func()
+        except Exception as exception:
+            collected[name] = {"error": str(exception)}
+
+    return {
+        "time": time.time(),
+        "latency": latencies,
+        "counters": counters,
+        "collectors": collected,
+    }
+
+def to_prometheus():
+    """
+    Returns every metric in the Prometheus text format
+    """
+    lines = []
+
+    with _lock:
+        histograms = sorted(_histograms.items())
+        counters = sorted(_counters.items())
+
+    for (kind, name), histogram in histograms:
+        metric = "bool_bot_{0}_latency_seconds".format(_metric_name(kind))
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append('{0}_bucket{{name="{1}",le="{2}"}} {3}'.format(metric, name, _bound_label(bound), cumulative))
+        lines.append('{0}_sum{{name="{1}"}} {2}'.format(metric, name, histogram.sum))
+        lines.append('{0}_count{{name="{1}"}} {2}'.format(metric, name, histogram.count))
+
+    for (metric, label), value in counters:
+        lines.append('bool_bot_{0}_total{{name="{1}"}} {2}'.format(_metric_name(metric), label, value))
+
+    for name, values in sorted(snapshot()["collectors"].items()):
+        for key, value in sorted(values.items()):
+            if isinstance(value, (int, float)):
+                lines.append('bool_bot_{0}_{1} {2}'.format(_metric_name(name), _metric_name(key), value))
+
+    return "\n".join(lines) + "\n"
+
+def summary():
+    """
+    Returns a short text summary of the metrics. Used by !stats
+    """
+    data = snapshot()
+    lines = []
+
+    for kind, histograms in data["latency"].items():
+        lines.append("**{0}**".format(kind))
+        for name, histogram in histograms.items():
+            lines.append("{0}: {1} calls, p50 {2}s, p95 {3}s".format(
+                name, histogram["count"], _bound_label(histogram["p50"]), _bound_label(histogram["p95"])))
+
+    for metric, values in data["counters"].items():
+        lines.append("**{0}**".format(metric))
+        for label, value in values.items():
+            lines.append("{0}: {1}".format(label, value))
+
+    for name, values in data["collectors"].items():
+        lines.append("**{0}**".format(name))
+        lines.append(", ".join("{0} {1}".format(key, value) for key, value in values.items()))
+
+    return "\n".join(lines) if lines else "No metrics recorded yet"
+
+def _metric_name(name):
+    # Prometheus metric names only take letters, digits and underscores. Ex. "step library index" -> "step_library_index"
+    return re.sub("[^a-zA-Z0-9_]", "_", name)
+
+def _bound_label(bound):
+    return "+Inf" if bound == float("inf") else "{0:g}".format(bound)
+
+# ================================================================================
+# Exporting
+
+def write_file(path):
+    """
+    Write a JSON snapshot to a file. The file is replaced atomically
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as fh:
+        json.dump(snapshot(), fh, indent=2)
+    os.replace(temp_path, path)
+
+async def _write_file_loop(path, interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            write_file(path)
+        except OSError as exception:
+            print("Could not write metrics to {0}. {1}".format(path, exception))
+
+async def _serve_prometheus(reader, writer):
+    try:
+        # Read and ignore the request line and headers
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+
+        body = to_prometheus().encode("utf-8")
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n")
+        writer.write("Content-Length: {0}\r\n\r\n".format(len(body)).encode("utf-8"))
+        writer.write(body)
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def start():
+    """
+    Start writing METRICS_FILE and serving METRICS_PORT, if they are set. Called when the bot starts up
+    """
+    if len(_tasks) > 0:
+        return
+
+    if METRICS_FILE:
+        _tasks.append(asyncio.ensure_future(_write_file_loop(METRICS_FILE, METRICS_DUMP_INTERVAL)))
+
+    if METRICS_PORT:
+        server = await asyncio.start_server(_serve_prometheus, "127.0.0.1", METRICS_PORT)
+        _tasks.append(server)
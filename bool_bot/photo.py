@@ -1,15 +1,39 @@
 import discord
+import io
 import random
-import os
-import random
-import asyncio
 
 # Features
-import google_drive_feat
-import index
+import drive_batch
+import library_index
+import media_cache
+import media_prep
+import prefetch
+import selection
+import send_queue
+
+# ================================================================================
+# Pending search requests
+
+async def expire_search_request(request):
+    """
+    Called when nobody picked a photo from a search in time
+    """
+    await request.message.delete()
+    await send_queue.send(request.message.channel, 'Request {} timed out'.format(request.query))
+
+# Search results shown per page of the selection embed, and the most results a search keeps
+RESULTS_PER_PAGE = 20
+MAX_SEARCH_RESULTS = 200
 
 # Global vars
-photo_requests = {}
+# (user id, channel id) -> the search results the user has to pick from
+photo_requests = selection.SelectionManager(on_expire=expire_search_request)
+
+# Embed descriptions are limited to 2048 characters
+EMBED_DESCRIPTION_LIMIT = 2048
+
+# (user id, channel id) -> the pages of the !ls listing the user is paging through. Nothing to do when it expires
+folder_listings = selection.SelectionManager()
 
 # ================================================================================
 # Photo functions
@@ -19,20 +43,25 @@ async def folder_random(ctx, query):
     Send a photo randomly by querying a folder. Type !photo rf test
     """
 
-    files = google_drive_feat.get_folder_contents(query)
+    async def produce():
+        files = await library_index.folder_contents(query)
+        if isinstance(files, str) or len(files) == 0:
+            return files
+        return await prefetch_photo(random.choice(files))
 
+    # Served from the prefetched photos of the folder when it is asked often
+    picked = await prefetch.prefetcher.get(("folder", query), produce)
 
-    if files == "No Folder":
-        return await ctx.send("Folder {0} cannot be found".format(query))
-    elif files == "Multiple Folders":
-        return await ctx.send("Multiple folders with name {0}. Stopping request".format(query))
-    elif len(files) == 0:
-        return await ctx.send("No files in folder {0}". format(query))
+    if picked == "No Folder":
+        return await send_queue.send(ctx, "Folder {0} cannot be found".format(query))
+    elif picked == "Multiple Folders":
+        return await send_queue.send(ctx, "Multiple folders with name {0}. Stopping request".format(query))
+    elif not isinstance(picked, prefetch.PrefetchedFile):
+        return await send_queue.send(ctx, "No files in folder {0}". format(query))
 
-    random_index = random.randint(0, len(files) - 1)
-    random_file_id = files[random_index]["id"]
+    random_file_id = picked.file["id"]
 
-    await send_photo(ctx, random_file_id, "{0}.jpeg".format(random_file_id), "Random photo from {0}".format(query))
+    await upload_photo(ctx, io.BytesIO(picked.data), random_file_id, "{0}.jpeg".format(random_file_id), "Random photo from {0}".format(query))
 
 
 async def photo_random(ctx, query):
@@ -43,23 +72,37 @@ async def photo_random(ctx, query):
     This command will return a random photo, where the file name contains "justin" or the description contains "justin"
 
     """
-    found_files = google_drive_feat.get_files_search(query)
+    async def produce():
+        found_files = await library_index.search_files(query)
+        if len(found_files) == 0:
+            return None
+        return await prefetch_photo(random.choice(found_files))
 
-    if len(found_files) == 0:
-        await ctx.send("No random photo found, probably because there are no photo/file names with the query you requested")
+    # Served from the prefetched photos of the query when it is asked often
+    picked = await prefetch.prefetcher.get(("photo", query.casefold()), produce)
+
+    if picked is None:
+        await send_queue.send(ctx, "No random photo found, probably because there are no photo/file names with the query you requested")
         return
 
-    
-    random_index = random.randint(0, len(found_files) - 1)
-    random_file_id = found_files[random_index]["id"]
+    random_file_id = picked.file["id"]
     random_file_description = "when the imposter is sus af"
 
-    if "description" in found_files[random_index]:
-        random_file_description = found_files[random_index]['description']
+    if "description" in picked.file:
+        random_file_description = picked.file['description']
 
-    await send_photo(ctx, random_file_id, "{0}.jpeg".format(random_file_id), random_file_description)
+    await upload_photo(ctx, io.BytesIO(picked.data), random_file_id, "{0}.jpeg".format(random_file_id), random_file_description)
 
+async def prefetch_photo(file):
+    """
+    Download the photo of a random pick, downscaled and recompressed like send_photo does
 
+    file : Object(id, name, description) - The picked file
+
+    return : prefetch.PrefetchedFile - The file and its photo
+    """
+    with await media_cache.cache.open(file["id"], rendition=media_prep.PHOTO) as buffered:
+        return prefetch.PrefetchedFile(file, buffered.read())
 
 async def photo_id(ctx, file_id):
     """
@@ -75,10 +118,10 @@ async def photo_name(ctx, photo_name):
 
     Ex. !photo jeyalex111.jpg
     """
-    obj = google_drive_feat.get_file_id(photo_name)
+    obj = await drive_batch.get_file_id(photo_name)
 
     if len(obj) == 0:
-        await ctx.send("No photo found by that name")
+        await send_queue.send(ctx, "No photo found by that name")
         return
 
     file_id = obj[0]['id']
@@ -92,47 +135,44 @@ async def photo_search(ctx, query):
     Helper function for command photo s query. Process request of a query. Returns an embed with options.
     """
 
+    key = (ctx.author.id, ctx.channel.id)
+
     #Check if current user has a pending request
-    if (ctx.author.id in photo_requests):
+    if key in photo_requests:
         # Found pending request. Deny
-        return await ctx.send("Pending request, please chose or enter c to cancel")
+        return await send_queue.send(ctx, "Pending request, please chose or enter c to cancel")
 
-    # Continue with query
-    found_files = google_drive_feat.get_files_search(query)
+    # Continue with query. Best matches first
+    found_files = await library_index.search_files(query, limit=MAX_SEARCH_RESULTS)
 
     if len(found_files) == 0:
-        await ctx.send("There are no photos that start with {}".format(query)) # await neeeded???
+        await send_queue.send(ctx, "There are no photos that start with {}".format(query)) # await neeeded???
         return
 
-    description = ""
+    # Send decision embed. Takes discord message type
+    message = await send_queue.send(ctx, embed=search_embed(found_files, 0))
 
-    for i in range(0 , len(found_files)):
-        file = found_files[i]
+    # Push request to photo requests. The answer is handled by process_search_request, or it expires
+    photo_requests.add(key, found_files, message, query)
+
+def search_embed(found_files, page):
+    """
+    Returns the decision embed showing one page of search results. Results are numbered across pages
+    """
+    pages = (len(found_files) + RESULTS_PER_PAGE - 1) // RESULTS_PER_PAGE
+    start = page * RESULTS_PER_PAGE
 
+    description = ""
+    for i, file in enumerate(found_files[start:start + RESULTS_PER_PAGE], start):
         description += "{0}. {1}\n".format(i, file['name'])
 
-    # Send decision embed
     embed = discord.Embed(title="Select an option. Enter a number from list. Enter c to cancel")
-    embed.description = description
-
-    # Takes discord message type
-    message = await ctx.send(embed=embed)
-
-    # Store found_files and message in a dictionary.
-    request = {
-        "files": found_files,
-        "message": message
-    }
+    embed.description = description[:EMBED_DESCRIPTION_LIMIT]
 
+    if pages > 1:
+        embed.set_footer(text="Page {0}/{1}. Enter n for the next page, p for the previous page".format(page + 1, pages))
 
-    # Push request to photo requests
-    photo_requests[ctx.author.id] = request
-    try:
-        await index.bot.wait_for('message',timeout=10.0)
-    except asyncio.TimeoutError:
-        del photo_requests[ctx.author.id]
-        await message.delete()
-        await ctx.send('Request {} timed out'.format(query))
+    return embed
 
 async def send_photo(ctx, file_id, file_name, description):
     """
@@ -144,72 +184,138 @@ async def send_photo(ctx, file_id, file_name, description):
     description : String - The description of the photo in discord embed
     """
 
-    photo_name = google_drive_feat.download_file(file_id, file_name)
-
-    # Reads file from local storage
-    buffered = open(google_drive_feat.temp_dir + photo_name, "rb")
-    file_photo = discord.File(buffered, filename=photo_name)
+    # Downloads the photo straight into memory, downscaled and recompressed, unless it is already cached
+    with await media_cache.cache.open(file_id, rendition=media_prep.PHOTO) as buffered:
+        await upload_photo(ctx, buffered, file_id, file_name, description)
 
-    embed = discord.Embed(title=photo_name, description=description)
-    embed.set_image(url="attachment://" + photo_name)
+async def upload_photo(ctx, buffered, file_id, file_name, description):
+    """
+    Uploads a downloaded photo to where the command is issued. Same arguments as send_photo, and the photo contents
+    """
+    if media_prep.too_big(buffered):
+        return await send_queue.send(ctx, "The photo is too big to upload. {0}".format(media_prep.view_link(file_id)))
 
-    await ctx.send("Sending Photo", file=file_photo, embed=embed)
+    file_photo = discord.File(buffered, filename=file_name)
 
-    buffered.close()
+    embed = discord.Embed(title=file_name, description=description)
+    embed.set_image(url="attachment://" + file_name)
 
-    # Deletes file from local storage
-    os.remove(google_drive_feat.temp_dir + photo_name)
-    return
+    await send_queue.send(ctx, "Sending Photo", file=file_photo, embed=embed)
 
 async def process_search_request(message):
     """
     Process search request of requesting user
     """
-    user_id = message.author.id
+    key = (message.author.id, message.channel.id)
     res = message.content
 
-
-    if not (user_id in photo_requests):
-        # Found nothing. No request for this user.
+    request = photo_requests.get(key)
+    if request is None:
+        # Found nothing. No request for this user in this channel.
         return
 
-    if bool(photo_requests) and photo_requests[user_id] != None and message.content == 'c':
+    if res == 'c':
+        photo_requests.pop(key)
 
-        message = photo_requests[user_id]["message"]
         # Delete query embed
-        await message.delete()
+        await request.message.delete()
 
-        del photo_requests[user_id]
+        return await send_queue.send(message.channel, "Cancelling Request")
 
-        return await message.channel.send("Cancelling Request")
+    if res == 'n' or res == 'p':
+        page = request.page + (1 if res == 'n' else -1)
 
-    if bool(photo_requests) and photo_requests[user_id] != None:
+        if 0 <= page * RESULTS_PER_PAGE < len(request.files):
+            request.page = page
+            await request.message.edit(embed=search_embed(request.files, page))
 
-        index = None
-        try:
-            index = int(res)
-        except ValueError:
-            return await message.channel.send("Please enter a number")
+        return
 
-        try:
-            file_id = photo_requests[user_id]["files"][index]["id"]
-            file_name = photo_requests[user_id]["files"][index]["name"]
-            description = photo_requests[user_id]["files"][index]["webViewLink"]
+    index = None
+    try:
+        index = int(res)
+    except ValueError:
+        return await send_queue.send(message.channel, "Please enter a number")
 
-            message = photo_requests[user_id]["message"]
+    if index < 0 or index >= len(request.files):
+        return await send_queue.send(message.channel, "Please enter a number in range of request")
 
-            # Delete query embed
-            await message.delete()
+    # Remove the request first, so a second answer doesn't send the photo again
+    photo_requests.pop(key)
 
-            # Third argument takes file id as the file name. Due to privacy reasons, we won't upload the photo name to discord
-            await send_photo(message.channel, file_id, "{0}.jpeg".format(file_id), description)
-        except IndexError:
-            return await message.channel.send("Please enter a number in range of request")
+    file_id = request.files[index]["id"]
+    description = request.files[index]["webViewLink"]
 
-        # Remove user key from photo requests
-        del photo_requests[user_id]
+    # Delete query embed
+    await request.message.delete()
+
+    # Third argument takes file id as the file name. Due to privacy reasons, we won't upload the photo name to discord
+    await send_photo(message.channel, file_id, "{0}.jpeg".format(file_id), description)
+
+# ================================================================================
+# Folder listing
 
+def listing_pages(lines, limit=EMBED_DESCRIPTION_LIMIT):
+    """
+    Split the lines of a listing into embed descriptions of at most limit characters. Lines are never split, a line
+    too long for a page is cut
+
+    lines : Array<String> - The lines, without line ends
+
+    return : Array<String> - The pages. One empty page if there are no lines
+    """
+    pages = []
+    page = ""
+    for line in lines:
+        line = line[:limit - 1] + "\n"
+        if len(page) + len(line) > limit:
+            pages.append(page)
+            page = ""
+        page += line
+
+    pages.append(page)
+    return pages
+
+def listing_embed(pages, page):
+    """
+    Returns the !ls embed showing one page of the listing
+    """
+    embed = discord.Embed(title='Sub-directories found:')
+    embed.description = pages[page]
+
+    if len(pages) > 1:
+        embed.set_footer(text="Page {0}/{1}. Enter n for the next page, p for the previous page".format(page + 1, len(pages)))
+
+    return embed
+
+async def send_folder_listing(ctx, lines):
+    """
+    Send the !ls listing. A listing too long for one embed is paged like the !photo s results
+    """
+    pages = listing_pages(lines)
+    message = await send_queue.send(ctx, embed=listing_embed(pages, 0))
+
+    if len(pages) > 1:
+        folder_listings.add((ctx.author.id, ctx.channel.id), pages, message, "ls")
+
+async def process_listing_request(message):
+    """
+    Show the next or previous page of a !ls listing. Any other answer ends the paging
+    """
+    key = (message.author.id, message.channel.id)
+    request = folder_listings.get(key)
+    if request is None:
         return
 
+    if message.content not in ('n', 'p'):
+        folder_listings.pop(key)
+        return
+
+    page = request.page + (1 if message.content == 'n' else -1)
+    if 0 <= page < len(request.files):
+        request.page = page
+        await request.message.edit(embed=listing_embed(request.files, page))
+
 async def print_photo_requests():
-    print(photo_requests)
\ No newline at end of file
+    for request in photo_requests.values():
+        print(request.key, request.query, len(request.files))
@@ -0,0 +1,142 @@
+import asyncio
+import collections
+import time
+
+import metrics
+from settings import PREFETCH_DEPTH, PREFETCH_MAX_BYTES, PREFETCH_MAX_QUERIES, PREFETCH_MIN_REQUESTS, PREFETCH_TTL
+
+# Keeps random photos and videos downloaded ahead of time for the queries people keep asking, so a burst of
+# !photo r justin is answered without a search or a download.
+#
+# Every query (or folder) asked at least PREFETCH_MIN_REQUESTS times gets a queue of up to PREFETCH_DEPTH random
+# picks, downloaded in the background after each request. Only the PREFETCH_MAX_QUERIES most recently asked queries
+# are kept, the queued files use at most PREFETCH_MAX_BYTES in memory, and picks older than PREFETCH_TTL seconds are
+# dropped so edits and deletions in Drive are seen.
+
+class PrefetchedFile(object):
+    """
+    A random pick, downloaded
+
+    file : Object(id, name, description, webViewLink) - The file
+    data : Bytes - Its contents, ready to send
+    """
+
+    def __init__(self, file, data):
+        self.file = file
+        self.data = data
+        self.size = len(data)
+        self.created = time.monotonic()
+
+class Prefetcher(object):
+    """
+    Queues of random picks by query. Used from the event loop only
+    """
+
+    def __init__(self, depth=PREFETCH_DEPTH, max_bytes=PREFETCH_MAX_BYTES, max_queries=PREFETCH_MAX_QUERIES,
+                 min_requests=PREFETCH_MIN_REQUESTS, ttl=PREFETCH_TTL):
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.max_queries = max_queries
+        self.min_requests = min_requests
+        self.ttl = ttl
+        self.bytes = 0
+
+        # Counters. hits are requests answered from a queue
+        self.hits = 0
+        self.misses = 0
+
+        # key -> [number of requests, queue of PrefetchedFile], least recently asked first
+        self._queries = collections.OrderedDict()
+        self._refills = {}
+
+    def stats(self):
+        """
+        Returns the prefetch counters
+        """
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests > 0 else 0.0,
+            "queries": len(self._queries),
+            "queued": sum(len(queue) for count, queue in self._queries.values()),
+            "bytes": self.bytes,
+        }
+
+    async def get(self, key, produce):
+        """
+        Returns a queued pick for the key, or one produced now. Then refills the queue of the key in the background.
+
+        key : Tuple - What is asked. Ex. ("photo", "justin")
+        produce : Coroutine function - Makes a new random pick. Returns a PrefetchedFile, or anything else (ex. None or
+                  an error message) when there is nothing to pick, which is returned but never queued
+
+        return : PrefetchedFile | Object - The pick, or what produce returned
+        """
+        entry = self._queries.get(key)
+        if entry is None:
+            entry = self._queries[key] = [0, collections.deque()]
+            self._evict_queries()
+        self._queries.move_to_end(key)
+        entry[0] += 1
+
+        item = self._take(entry[1])
+        if item is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            item = await produce()
+
+        if isinstance(item, PrefetchedFile) and entry[0] >= self.min_requests and key not in self._refills:
+            task = asyncio.ensure_future(self._refill(key, produce))
+            self._refills[key] = task
+            task.add_done_callback(lambda _: self._refills.pop(key, None))
+
+        return item
+
+    def clear(self):
+        """
+        Drop every queued pick
+        """
+        self._queries.clear()
+        self.bytes = 0
+
+    def _take(self, queue):
+        while len(queue) > 0:
+            item = queue.popleft()
+            self.bytes -= item.size
+            if time.monotonic() - item.created <= self.ttl:
+                return item
+
+        return None
+
+    async def _refill(self, key, produce):
+        try:
+            while True:
+                entry = self._queries.get(key)
+                if entry is None or len(entry[1]) >= self.depth or self.bytes >= self.max_bytes:
+                    return
+
+                item = await produce()
+                if not isinstance(item, PrefetchedFile):
+                    return
+
+                # The query may have been evicted while downloading
+                entry = self._queries.get(key)
+                if entry is None or self.bytes + item.size > self.max_bytes:
+                    return
+
+                entry[1].append(item)
+                self.bytes += item.size
+        except Exception as exception:
+            print("Could not prefetch {0}. {1}".format(key, exception))
+
+    def _evict_queries(self):
+        while len(self._queries) > self.max_queries:
+            key, (count, queue) = self._queries.popitem(last=False)
+            self.bytes -= sum(item.size for item in queue)
+
+# Global Vars
+prefetcher = Prefetcher()
+
+metrics.register_collector("prefetch", lambda: prefetcher.stats())
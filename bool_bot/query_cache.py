@@ -0,0 +1,193 @@
+import collections
+import re
+import threading
+import time
+
+import metrics
+from settings import (QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_FOLDER_TTL, QUERY_CACHE_FILE_TTL,
+                      QUERY_CACHE_NEGATIVE_TTL)
+
+# Remembers the results of Drive list queries, so repeated commands (!ls, !photo rf test, searches before the
+# library index is built) don't send the same listing to Drive again.
+#
+# Results are keyed by the query and fields, with the whitespace and the order of the fields normalized. Listings of
+# folders are kept QUERY_CACHE_FOLDER_TTL seconds and listings of files QUERY_CACHE_FILE_TTL seconds, since the
+# folder tree changes much less often. Empty results (ex. "No Folder" for a mistyped folder name) are kept
+# QUERY_CACHE_NEGATIVE_TTL seconds, so the folder shows up soon after it is created. At most QUERY_CACHE_MAX_ENTRIES
+# results are kept, the least recently used are dropped first. drive_sync invalidates the results the changes feed
+# makes stale.
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# Query classes, they have their own TTL
+FOLDERS = "folders"
+FILES = "files"
+NEGATIVE = "negative"
+
+# A quoted value, or anything else up to the next whitespace
+QUERY_TOKEN = re.compile(r"'(?:[^'\\]|\\.)*'|[^\s']+")
+PARENT = re.compile(r"'((?:[^'\\]|\\.)*)' in parents")
+
+def normalize(q, fields):
+    """
+    Returns the cache key of a query. Ex. ("'a' in parents and trashed = false", "id,name")
+
+    q : String - The Drive query
+    fields : String - The file fields returned. Ex. "id, name"
+    """
+    query = " ".join(QUERY_TOKEN.findall(q))
+    fields = ",".join(sorted(field.strip() for field in fields.split(",")))
+
+    return query, fields
+
+def query_class(q, files):
+    """
+    Returns the class of a query and its result: NEGATIVE if nothing was found, FOLDERS for listings of folders,
+    FILES otherwise
+    """
+    if len(files) == 0:
+        return NEGATIVE
+
+    if "mimeType = '{0}'".format(FOLDER_MIME_TYPE) in q and "mimeType != '{0}'".format(FOLDER_MIME_TYPE) not in q:
+        return FOLDERS
+
+    return FILES
+
+def query_parents(q):
+    """
+    Returns the ids of the folders a query lists. Ex. {"abc"} for "'abc' in parents and trashed = false"
+    """
+    return frozenset(parent.replace("\\'", "'").replace("\\\\", "\\") for parent in PARENT.findall(q))
+
+class QueryCache(object):
+    """
+    Thread safe, size bounded LRU cache of list query results with a TTL per query class
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_MAX_ENTRIES, ttls=None):
+        self.max_entries = max_entries
+        self.ttls = ttls if ttls is not None else {
+            FOLDERS: QUERY_CACHE_FOLDER_TTL,
+            FILES: QUERY_CACHE_FILE_TTL,
+            NEGATIVE: QUERY_CACHE_NEGATIVE_TTL,
+        }
+
+        # Counters
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+        # Bumped by every invalidation, so a listing started before it is not stored
+        self.generation = 0
+
+        # key -> (files, query class, expiry, parents), least recently used first
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Returns the cache counters
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "invalidated": self.invalidated,
+                "entries": len(self._entries),
+            }
+
+    def get(self, q, fields):
+        """
+        Returns the files a query found, or None if they are not cached. Shared with the other callers, don't modify them
+        """
+        key = normalize(q, fields)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            if entry[1] == NEGATIVE:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[0]
+
+    def put(self, q, fields, files, generation=None):
+        """
+        Store the files a query found
+
+        generation : Integer - The generation when the query was sent. Nothing is stored if the cache was invalidated since
+        """
+        key = normalize(q, fields)
+        kind = query_class(key[0], files)
+        ttl = self.ttls[kind]
+
+        with self._lock:
+            if ttl <= 0 or self.max_entries <= 0 or (generation is not None and generation != self.generation):
+                return
+
+            self._entries[key] = (files, kind, time.monotonic() + ttl, query_parents(key[0]))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, parent_ids=None, file_ids=()):
+        """
+        Drop the results of the queries listing any of the folders or holding any of the files, or every result
+
+        parent_ids : Iterable<String> - The folder ids whose contents changed. None to drop everything
+        file_ids : Iterable<String> - The files that changed. Ex. a file moved out of a folder
+        """
+        with self._lock:
+            self.generation += 1
+
+            if parent_ids is None:
+                self.invalidated += len(self._entries)
+                self._entries.clear()
+                return
+
+            parent_ids = frozenset(parent_ids)
+            file_ids = frozenset(file_ids)
+            stale = [key for key, entry in self._entries.items()
+                     if entry[3] & parent_ids or any(file.get("id") in file_ids for file in entry[0])]
+            for key in stale:
+                del self._entries[key]
+            self.invalidated += len(stale)
+
+    def invalidate_changes(self, changes):
+        """
+        Drop the results the changes from the Drive changes feed may have made stale
+
+        changes : Array<Object(fileId, removed, file)> - The changes from google_drive_feat.get_changes
+        """
+        if len(changes) == 0:
+            return
+
+        parent_ids = set()
+        file_ids = set()
+        for change in changes:
+            file = change.get("file")
+            if file is not None:
+                parent_ids.update(file.get("parents", []))
+
+            # Where it was before the change is not known, but the results holding it are stale. A folder that
+            # changed is in the queries listing its contents too
+            file_ids.add(change["fileId"])
+            parent_ids.add(change["fileId"])
+
+        self.invalidate(parent_ids, file_ids)
+
+# Global Vars
+cache = QueryCache()
+
+metrics.register_collector("query_cache", lambda: cache.stats())
@@ -0,0 +1,309 @@
+import heapq
+import math
+import operator
+import os
+import re
+import sys
+
+# Ranked search over the names and descriptions of the library files. Used by library_index.
+#
+# Text is case folded and split into words. A query word matches a file word that is the same word, starts with it or
+# contains it, and, if it matches nothing that way, words that look alike (shared trigrams), so small typos still
+# find something. Every query word must match. Files are ranked with BM25, name words counting more than description
+# words, and the best k are taken with a heap.
+#
+# Like the library index, reads never lock: incremental changes replace the postings instead of mutating them.
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Name words count as this many description words, and the extension of the name (ex. "jpg") this many. It only
+# matters when it is searched, ex. "kurt.jpg"
+NAME_WEIGHT = 2
+EXTENSION_WEIGHT = 0.25
+
+# How much a file word counts depending on how it matches the query word
+EXACT_WEIGHT = 1.0
+PREFIX_WEIGHT = 0.8
+SUBSTRING_WEIGHT = 0.6
+FUZZY_WEIGHT = 0.5
+
+# Least trigram similarity (Dice coefficient) of a fuzzy match, and the most fuzzy matches used per query word
+FUZZY_THRESHOLD = 0.5
+MAX_FUZZY_MATCHES = 10
+
+WORD = re.compile(r"[^\W_]+")
+
+def tokenize(text):
+    """
+    Returns the case folded words of the text
+
+    text : String - The text. Ex. "Kurt_at-the Beach"
+
+    return : Array<String> - The words. Ex. ["kurt", "at", "the", "beach"]
+    """
+    return WORD.findall(text.casefold())
+
+def trigrams(word):
+    """
+    Returns the set of trigrams of a word
+    """
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+def file_terms(file):
+    """
+    Returns the weighted term frequencies of a file
+
+    file : Object(name, description) - The file
+
+    return : Object<String, Float> - word -> weighted number of occurrences. The words are interned, so every file
+    shares the string of the postings
+    """
+    terms = {}
+    name, extension = os.path.splitext(file["name"])
+    for word in tokenize(name):
+        word = sys.intern(word)
+        terms[word] = terms.get(word, 0) + NAME_WEIGHT
+    for word in tokenize(extension):
+        word = sys.intern(word)
+        terms[word] = terms.get(word, 0) + EXTENSION_WEIGHT
+    for word in tokenize(file.get("description", "")):
+        word = sys.intern(word)
+        terms[word] = terms.get(word, 0) + 1
+
+    return terms
+
+# ================================================================================
+# Search index
+
+class SearchIndex(object):
+    """
+    Inverted index of the words of the files, with a trigram and prefix index of the words for partial matches
+    """
+
+    def __init__(self, files=()):
+        # id -> (words, name, length)
+        self.docs = {}
+        self.total_length = 0
+
+        # Average file length the BM25 length normalization uses. Set when the index is built, files added later use
+        # the average at the time
+        self.average_length = 1.0
+
+        # word -> (id -> BM25 term score of the word in the file)
+        self.postings = {}
+
+        # trigram -> words having it, and one or two letter prefix -> words starting with it
+        self.word_trigrams = {}
+        self.prefixes = {}
+
+        # Built with mutable sets, frozen at the end. Incremental changes then copy the sets and the postings they
+        # change instead of mutating them
+        files = [(file, file_terms(file)) for file in files]
+        if len(files) > 0:
+            self.average_length = sum(sum(terms.values()) for file, terms in files) / float(len(files))
+
+        for file, terms in files:
+            self._add(file, terms)
+
+        self.word_trigrams = {trigram: frozenset(words) for trigram, words in self.word_trigrams.items()}
+        self.prefixes = {prefix: frozenset(words) for prefix, words in self.prefixes.items()}
+
+    def __len__(self):
+        return len(self.docs)
+
+    # ----------------------------------------------------------------
+    # Updates
+
+    def put(self, file):
+        """
+        Add or replace a file
+        """
+        self.remove(file["id"])
+        if len(self.docs) > 0:
+            self.average_length = self.total_length / float(len(self.docs))
+        self._add(file, file_terms(file), copy=True)
+
+    def remove(self, id):
+        """
+        Remove a file. Does nothing if it is not in the index
+        """
+        doc = self.docs.pop(id, None)
+        if doc is None:
+            return
+
+        terms, name, length = doc
+        self.total_length -= length
+
+        for word in terms:
+            scores = dict(self.postings[word])
+            del scores[id]
+            if len(scores) > 0:
+                self.postings[word] = scores
+                continue
+
+            # Last file with this word
+            del self.postings[word]
+            for key, index in self._word_keys(word):
+                words = index[key] - {word}
+                if len(words) > 0:
+                    index[key] = words
+                else:
+                    del index[key]
+
+    def _add(self, file, terms, copy=False):
+        id = file["id"]
+        length = sum(terms.values())
+        norm = K1 * (1 - B + B * length / self.average_length)
+        self.docs[id] = (tuple(terms), file["name"], length)
+        self.total_length += length
+
+        for word, frequency in terms.items():
+            if word not in self.postings:
+                for key, index in self._word_keys(word):
+                    if copy:
+                        index[key] = index.get(key, frozenset()) | {word}
+                    else:
+                        index.setdefault(key, set()).add(word)
+
+            score = frequency * (K1 + 1) / (frequency + norm)
+            if copy:
+                scores = dict(self.postings.get(word, ()))
+                scores[id] = score
+                self.postings[word] = scores
+            else:
+                self.postings.setdefault(word, {})[id] = score
+
+    def _word_keys(self, word):
+        # The keys a word is indexed under in word_trigrams and prefixes
+        for trigram in trigrams(word):
+            yield trigram, self.word_trigrams
+        for size in (1, 2):
+            if len(word) > size:
+                yield word[:size], self.prefixes
+
+    # ----------------------------------------------------------------
+    # Queries
+
+    def search(self, query, limit=None):
+        """
+        Get the ids of the files matching every word of the query, best first
+
+        query : String - The query
+        limit : Integer - The most ids returned. Every match if None
+
+        return : Array<String> - The file ids, by decreasing score. Ties are sorted by name if there is a limit
+        """
+        postings = self.postings
+        file_count = len(self.docs)
+
+        # Most selective words first, the others are only scored in the files that are left
+        words = []
+        for word in dict.fromkeys(tokenize(query)):
+            matches = self.expand(word)
+            if len(matches) == 0:
+                return []
+            words.append((sum(len(postings.get(match, ())) for match, weight in matches), matches))
+        words.sort(key=operator.itemgetter(0))
+
+        if len(words) == 0:
+            return []
+
+        scores = None
+        for frequency, matches in words:
+            # Best match of the word in every file
+            word_scores = {}
+            for match, weight in matches:
+                for id, score in postings.get(match, {}).items():
+                    if scores is not None and id not in scores:
+                        continue
+                    score *= weight
+                    if score > word_scores.get(id, 0):
+                        word_scores[id] = score
+
+            # The word and all its matches count as one term, so a rare partial match doesn't beat an exact match
+            frequency = min(frequency, file_count)
+            idf = math.log(1 + (file_count - frequency + 0.5) / (frequency + 0.5))
+
+            if scores is None:
+                scores = {id: score * idf for id, score in word_scores.items()}
+            else:
+                scores = {id: scores[id] + score * idf for id, score in word_scores.items()}
+
+            if len(scores) == 0:
+                return []
+
+        if limit is None:
+            # Every match, ex. to pick a random one. Not worth sorting the ties
+            return sorted(scores, key=scores.__getitem__, reverse=True)
+
+        # Top k with a heap, ties sorted by name
+        docs = self.docs
+        order = lambda item: (-item[1], docs[item[0]][1] if item[0] in docs else "")
+
+        top = heapq.nlargest(limit, scores.items(), key=operator.itemgetter(1))
+        if len(top) == limit and len(scores) > limit:
+            # The heap kept any of the files tied with the last one. Keep the first ones by name instead
+            last = top[-1][1]
+            top = [item for item in top if item[1] > last]
+            ties = [id for id, score in scores.items() if score == last]
+            top += [(id, last) for id in heapq.nsmallest(limit - len(top), ties, key=lambda id: docs[id][1] if id in docs else "")]
+
+        return [id for id, score in sorted(top, key=order)]
+
+    def expand(self, word):
+        """
+        Returns the indexed words a query word matches, with how much they count
+
+        word : String - A case folded query word
+
+        return : Array<(String, Float)> - (indexed word, weight) pairs
+        """
+        matches = {}
+        if word in self.postings:
+            matches[word] = EXACT_WEIGHT
+
+        if len(word) < 3:
+            # Too short for trigrams. Words starting with it, then the other words containing it, found by going
+            # through every indexed word
+            for match in self.prefixes.get(word, ()):
+                matches.setdefault(match, PREFIX_WEIGHT)
+            for match in list(self.postings):
+                if word in match:
+                    matches.setdefault(match, SUBSTRING_WEIGHT)
+            return list(matches.items())
+
+        word_trigrams = trigrams(word)
+
+        # Words containing it. They have every trigram of the word
+        found = []
+        for trigram in word_trigrams:
+            words = self.word_trigrams.get(trigram)
+            if words is None:
+                found = None
+                break
+            found.append(words)
+
+        if found:
+            found.sort(key=len)
+            for match in found[0].intersection(*found[1:]):
+                if match != word and word in match:
+                    matches.setdefault(match, PREFIX_WEIGHT if match.startswith(word) else SUBSTRING_WEIGHT)
+
+        if len(matches) > 0:
+            return list(matches.items())
+
+        # Nothing contains it, maybe a typo. Words sharing enough trigrams with it
+        shared = {}
+        for trigram in word_trigrams:
+            for match in self.word_trigrams.get(trigram, ()):
+                shared[match] = shared.get(match, 0) + 1
+
+        similar = []
+        for match, count in shared.items():
+            similarity = 2.0 * count / (len(word_trigrams) + max(len(match) - 2, 1))
+            if similarity >= FUZZY_THRESHOLD:
+                similar.append((similarity, match))
+
+        return [(match, FUZZY_WEIGHT * similarity) for similarity, match in heapq.nlargest(MAX_FUZZY_MATCHES, similar)]
@@ -0,0 +1,152 @@
+import asyncio
+import heapq
+import itertools
+
+from settings import SELECTION_TIMEOUT, SELECTION_MAX_PENDING
+
+# Pending selections of !photo s: the search results a user was shown and must pick from by sending a number.
+#
+# A selection belongs to one user in one channel, so only that user's next message in that channel answers it, and
+# looking it up is a dict lookup. Selections expire after SELECTION_TIMEOUT seconds. Expiry times are kept in one heap
+# driven by a single event loop timer, instead of one wait_for per search. At most SELECTION_MAX_PENDING selections
+# are kept: when full, the one closest to expiring is expired early.
+
+# ================================================================================
+# Selections
+
+class Selection(object):
+    """
+    One open selection
+
+    files : Sequence<Object(id, name, webViewLink)> - The search results shown. A catalog.ResultSet for results of
+    the library index
+    message : Message - The embed listing them. Deleted when the selection ends
+    query : String - The search query
+    page : Integer - The page of results shown in the embed
+    """
+
+    def __init__(self, key, files, message, query, expires_at, sequence):
+        self.key = key
+        self.files = files
+        self.message = message
+        self.query = query
+        self.page = 0
+        self.expires_at = expires_at
+        self.sequence = sequence
+
+class PendingKeys(object):
+    """
+    The (user id, channel id) keys open in any of several SelectionManagers. What message_filter.route checks
+    """
+
+    def __init__(self, *managers):
+        self.managers = managers
+
+    def __contains__(self, key):
+        return any(key in manager for manager in self.managers)
+
+class SelectionManager(object):
+    """
+    Pending selections by (user id, channel id). Used from the event loop only
+    """
+
+    def __init__(self, timeout=SELECTION_TIMEOUT, max_pending=SELECTION_MAX_PENDING, on_expire=None):
+        self.timeout = timeout
+        self.max_pending = max_pending
+
+        # Coroutine function called with a Selection when it expires
+        self.on_expire = on_expire
+
+        self._selections = {}
+
+        # (expires_at, sequence, key). Entries of selections that already ended are skipped when popped
+        self._heap = []
+        self._sequence = itertools.count()
+        self._timer = None
+        self._timer_at = None
+
+    def __len__(self):
+        return len(self._selections)
+
+    def __contains__(self, key):
+        return key in self._selections
+
+    def values(self):
+        return self._selections.values()
+
+    def get(self, key):
+        """
+        Returns the open selection of (user id, channel id), or None
+        """
+        return self._selections.get(key)
+
+    def add(self, key, files, message, query):
+        """
+        Open a selection. Replaces the open selection of the same user in the same channel
+        """
+        loop = asyncio.get_event_loop()
+
+        while len(self._selections) > 0 and len(self._selections) >= self.max_pending and key not in self._selections:
+            self._expire(self._pop_earliest())
+
+        selection = Selection(key, files, message, query, loop.time() + self.timeout, next(self._sequence))
+        self._selections[key] = selection
+        heapq.heappush(self._heap, (selection.expires_at, selection.sequence, key))
+
+        # Entries of ended selections are only removed when popped. Rebuild the heap if they pile up
+        if len(self._heap) > 2 * len(self._selections) + 64:
+            self._heap = [(s.expires_at, s.sequence, s.key) for s in self._selections.values()]
+            heapq.heapify(self._heap)
+
+        self._schedule(loop)
+        return selection
+
+    def pop(self, key):
+        """
+        Close the selection of (user id, channel id) and return it, or None
+        """
+        return self._selections.pop(key, None)
+
+    def _pop_earliest(self):
+        while True:
+            expires_at, sequence, key = heapq.heappop(self._heap)
+            selection = self._selections.get(key)
+            if selection is not None and selection.sequence == sequence:
+                return self._selections.pop(key)
+
+    def _schedule(self, loop):
+        # One timer, set for the earliest expiry
+        while len(self._heap) > 0 and not self._is_open(self._heap[0]):
+            heapq.heappop(self._heap)
+
+        if len(self._heap) == 0:
+            return
+
+        expires_at = self._heap[0][0]
+        if self._timer is not None:
+            if self._timer_at <= expires_at:
+                return
+            self._timer.cancel()
+
+        self._timer = loop.call_at(expires_at, self._on_timer, loop)
+        self._timer_at = expires_at
+
+    def _on_timer(self, loop):
+        self._timer = None
+        self._timer_at = None
+
+        now = loop.time()
+        while len(self._heap) > 0 and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if self._is_open(entry):
+                self._expire(self._selections.pop(entry[2]))
+
+        self._schedule(loop)
+
+    def _is_open(self, entry):
+        selection = self._selections.get(entry[2])
+        return selection is not None and selection.sequence == entry[1]
+
+    def _expire(self, selection):
+        if self.on_expire is not None:
+            asyncio.ensure_future(self.on_expire(selection))
@@ -0,0 +1,191 @@
+import asyncio
+import collections
+import time
+
+import drive_limits
+import metrics
+from settings import SEND_MAX_UPLOADS, SEND_MAX_QUEUED, SEND_CHANNEL_RATE, SEND_CHANNEL_BURST
+
+# Every message the bot sends goes through here instead of ctx.send, so bursts of uploads don't fight over bandwidth
+# and stay within the Discord rate limit of each channel.
+#
+# Every channel has two queues: text replies and uploads (messages with a file). Text replies are sent first, so an
+# error message or a search embed never waits behind a video. Messages to one channel are spaced to
+# SEND_CHANNEL_RATE per second, and at most SEND_MAX_UPLOADS uploads run at the same time across channels. An upload
+# waiting behind others tells the user it is queued, and one more than SEND_MAX_QUEUED uploads in a channel is
+# refused. The time from queueing to sent is recorded per channel.
+
+# The queues of a channel
+TEXT = "text"
+UPLOAD = "upload"
+
+def channel_id(destination):
+    """
+    Returns the id of the channel a message is sent to
+
+    destination : Messageable - A Context, or a channel
+    """
+    channel = getattr(destination, "channel", destination)
+    return getattr(channel, "id", None)
+
+class _Channel(object):
+    """
+    Queues of one channel
+    """
+
+    def __init__(self, rate, burst):
+        self.queues = {TEXT: collections.deque(), UPLOAD: collections.deque()}
+        self.workers = {}
+        self.sending = {TEXT: False, UPLOAD: False}
+        self.bucket = drive_limits.TokenBucket(rate, burst)
+
+        # Set while no text reply is waiting. Uploads wait for it
+        self.text_idle = asyncio.Event()
+        self.text_idle.set()
+
+    def idle(self):
+        return len(self.workers) == 0 and all(len(queue) == 0 for queue in self.queues.values())
+
+class SendQueue(object):
+    """
+    Outbound message dispatcher. Used from the event loop only
+    """
+
+    def __init__(self, max_uploads=SEND_MAX_UPLOADS, max_queued=SEND_MAX_QUEUED, rate=SEND_CHANNEL_RATE,
+                 burst=SEND_CHANNEL_BURST):
+        self.max_uploads = max_uploads
+        self.max_queued = max_queued
+        self.rate = rate
+        self.burst = burst
+
+        # Counters
+        self.sent = 0
+        self.refused = 0
+        self.uploading = 0
+
+        # channel id -> _Channel, while it has something to send
+        self._channels = {}
+
+        # Created on the running loop when first needed
+        self._uploads = None
+        self._loop = None
+
+    def stats(self):
+        """
+        Returns the queue counters
+        """
+        return {
+            "sent": self.sent,
+            "refused": self.refused,
+            "uploading": self.uploading,
+            "channels": len(self._channels),
+            "queued": sum(len(queue) for state in self._channels.values() for queue in state.queues.values()),
+        }
+
+    async def send(self, destination, content=None, **kwargs):
+        """
+        Send a message after the ones queued before it in the channel, and wait until it is sent
+
+        destination : Messageable - Where to send it. A Context or a channel
+        content, kwargs : Same as Messageable.send. Ex. file=discord.File(...), embed=embed
+
+        return : discord.Message - The message sent, or None if the upload queue of the channel is full
+        """
+        key = channel_id(destination)
+        state = self._channels.get(key)
+        if state is None:
+            state = self._channels[key] = _Channel(self.rate, self.burst)
+
+        kind = UPLOAD if kwargs.get("file") is not None or kwargs.get("files") else TEXT
+        queue = state.queues[kind]
+
+        if kind == UPLOAD:
+            ahead = len(queue) + state.sending[UPLOAD]
+            if ahead >= self.max_queued:
+                self.refused += 1
+                await self.send(destination, "Too many uploads waiting in this channel, try again in a moment")
+                return None
+        else:
+            state.text_idle.clear()
+
+        future = asyncio.get_running_loop().create_future()
+        queue.append((destination, content, kwargs, future, time.perf_counter()))
+
+        if kind not in state.workers:
+            state.workers[kind] = asyncio.ensure_future(self._work(key, state, kind))
+
+        # Backpressure. Tell the user before making them wait
+        if kind == UPLOAD and ahead > 0:
+            await self.send(destination, "Queued, {0} upload{1} ahead of yours in this channel".format(ahead, "" if ahead == 1 else "s"))
+        elif kind == UPLOAD and self.uploading >= self.max_uploads:
+            await self.send(destination, "Queued, waiting for other uploads to finish")
+
+        return await future
+
+    async def _work(self, key, state, kind):
+        queue = state.queues[kind]
+        try:
+            while len(queue) > 0:
+                if kind == UPLOAD:
+                    await state.text_idle.wait()
+
+                destination, content, kwargs, future, queued_at = queue.popleft()
+                if future.done():
+                    # The command was cancelled
+                    continue
+
+                state.sending[kind] = True
+                try:
+                    wait = state.bucket.reserve()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+
+                    if kind == UPLOAD:
+                        async with self._upload_slots():
+                            self.uploading += 1
+                            try:
+                                message = await destination.send(content, **kwargs)
+                            finally:
+                                self.uploading -= 1
+                    else:
+                        message = await destination.send(content, **kwargs)
+                except Exception as exception:
+                    if not future.done():
+                        future.set_exception(exception)
+                else:
+                    self.sent += 1
+                    metrics.observe("send", str(key), time.perf_counter() - queued_at)
+                    if not future.done():
+                        future.set_result(message)
+                finally:
+                    state.sending[kind] = False
+
+                if kind == TEXT and len(queue) == 0:
+                    state.text_idle.set()
+        finally:
+            del state.workers[kind]
+            if kind == TEXT:
+                state.text_idle.set()
+            if state.idle() and self._channels.get(key) is state:
+                del self._channels[key]
+
+    def _upload_slots(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._uploads = asyncio.Semaphore(self.max_uploads)
+            self._loop = loop
+
+        return self._uploads
+
+# Global Vars
+queue = SendQueue()
+
+metrics.register_collector("send_queue", lambda: queue.stats())
+
+async def send(destination, content=None, **kwargs):
+    """
+    Send a message through the send queue. Use it instead of ctx.send or channel.send
+
+    Ex. await send_queue.send(ctx, "Sending Photo", file=file_photo, embed=embed)
+    """
+    return await queue.send(destination, content, **kwargs)
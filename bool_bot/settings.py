@@ -8,3 +8,98 @@ load_dotenv(dotenv_path=env_path)
 
 DISCORD_API_KEY = os.environ.get("DISCORD_API_KEY")
 ROOT_PHOTO_FOLDER_ID = os.environ.get("ROOT_PHOTO_FILE_ID")
+
+# Number of threads used to run blocking Google Drive calls off the event loop
+DRIVE_THREAD_POOL_SIZE = int(os.environ.get("DRIVE_THREAD_POOL_SIZE", 8))
+
+# SQLite file the photo/video library index is stored in
+LIBRARY_INDEX_PATH = os.environ.get("LIBRARY_INDEX_PATH", "./bool_bot/files/library.db")
+
+# Seconds between two polls of the Drive changes feed, and the longest wait after repeated failures
+DRIVE_SYNC_INTERVAL = float(os.environ.get("DRIVE_SYNC_INTERVAL", 60))
+DRIVE_SYNC_MAX_BACKOFF = float(os.environ.get("DRIVE_SYNC_MAX_BACKOFF", 900))
+
+# Directory and size budget (in bytes) of the cache of downloaded photos and videos
+MEDIA_CACHE_DIR = os.environ.get("MEDIA_CACHE_DIR", "./bool_bot/files/cache/")
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get("MEDIA_CACHE_MAX_BYTES", 500 * 1024 * 1024))
+
+# Downloads bigger than this (in bytes) are buffered in an anonymous temporary file instead of memory
+SPOOL_MAX_MEMORY = int(os.environ.get("SPOOL_MAX_MEMORY", 16 * 1024 * 1024))
+
+# Number of folder listing queries sent to Drive at the same time
+DRIVE_LIST_PARALLELISM = int(os.environ.get("DRIVE_LIST_PARALLELISM", 4))
+
+# Seconds Drive metadata requests wait to be sent together in one batch request
+DRIVE_BATCH_WINDOW = float(os.environ.get("DRIVE_BATCH_WINDOW", 0.01))
+
+# Optional metrics exports: a JSON file rewritten every METRICS_DUMP_INTERVAL seconds, and a local port serving
+# the Prometheus text format
+METRICS_FILE = os.environ.get("METRICS_FILE")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0)) or None
+METRICS_DUMP_INTERVAL = float(os.environ.get("METRICS_DUMP_INTERVAL", 60))
+
+# SQLite file the bot channels of every guild are stored in, and the seconds changes wait before being written
+CHANNEL_REGISTRY_PATH = os.environ.get("CHANNEL_REGISTRY_PATH", "./bool_bot/files/channels.db")
+CHANNEL_FLUSH_DELAY = float(os.environ.get("CHANNEL_FLUSH_DELAY", 1.0))
+
+# Seconds a !photo s selection stays open, and the most selections open at the same time
+SELECTION_TIMEOUT = float(os.environ.get("SELECTION_TIMEOUT", 10))
+SELECTION_MAX_PENDING = int(os.environ.get("SELECTION_MAX_PENDING", 10000))
+
+# Photos are sent at most PHOTO_MAX_DIMENSION pixels wide and high, recompressed to about PHOTO_TARGET_BYTES. Files
+# bigger than DISCORD_UPLOAD_LIMIT bytes are sent as a link instead
+PHOTO_MAX_DIMENSION = int(os.environ.get("PHOTO_MAX_DIMENSION", 1600))
+PHOTO_TARGET_BYTES = int(os.environ.get("PHOTO_TARGET_BYTES", 1024 * 1024))
+DISCORD_UPLOAD_LIMIT = int(os.environ.get("DISCORD_UPLOAD_LIMIT", 8 * 1024 * 1024))
+
+# Random photos and videos kept ready per popular query or folder, the bytes they can use in total, the number of
+# queries kept, how many times a query must be asked before it is prefetched, and how long (seconds) a prefetched
+# file is kept
+PREFETCH_DEPTH = int(os.environ.get("PREFETCH_DEPTH", 2))
+PREFETCH_MAX_BYTES = int(os.environ.get("PREFETCH_MAX_BYTES", 64 * 1024 * 1024))
+PREFETCH_MAX_QUERIES = int(os.environ.get("PREFETCH_MAX_QUERIES", 32))
+PREFETCH_MIN_REQUESTS = int(os.environ.get("PREFETCH_MIN_REQUESTS", 2))
+PREFETCH_TTL = float(os.environ.get("PREFETCH_TTL", 600))
+
+# Drive requests per second sent by the bot, and how many can be sent at once after a quiet period. 0 for no limit
+DRIVE_RATE_LIMIT = float(os.environ.get("DRIVE_RATE_LIMIT", 10))
+DRIVE_RATE_BURST = int(os.environ.get("DRIVE_RATE_BURST", 20))
+
+# Retries of a Drive request that was throttled (403 rate limit, 429) or failed on the server (5xx), and the first
+# and longest wait (seconds) between two tries
+DRIVE_MAX_RETRIES = int(os.environ.get("DRIVE_MAX_RETRIES", 5))
+DRIVE_RETRY_BASE_DELAY = float(os.environ.get("DRIVE_RETRY_BASE_DELAY", 0.5))
+DRIVE_RETRY_MAX_DELAY = float(os.environ.get("DRIVE_RETRY_MAX_DELAY", 32))
+
+# Most uploads sent to Discord at the same time, most uploads waiting in one channel, and the messages per second
+# (and burst) sent to one channel
+SEND_MAX_UPLOADS = int(os.environ.get("SEND_MAX_UPLOADS", 3))
+SEND_MAX_QUEUED = int(os.environ.get("SEND_MAX_QUEUED", 20))
+SEND_CHANNEL_RATE = float(os.environ.get("SEND_CHANNEL_RATE", 1))
+SEND_CHANNEL_BURST = int(os.environ.get("SEND_CHANNEL_BURST", 5))
+
+# Downloads are split in ranges of DOWNLOAD_CHUNK_SIZE bytes, fetched DOWNLOAD_PARALLELISM at a time
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", 2 * 1024 * 1024))
+DOWNLOAD_PARALLELISM = int(os.environ.get("DOWNLOAD_PARALLELISM", 4))
+# A download that still fails once its requests gave up is resumed this many times
+DOWNLOAD_RESUMES = int(os.environ.get("DOWNLOAD_RESUMES", 2))
+
+# Most connections to one Drive host at the same time, the seconds a Drive request may take, and the seconds an idle
+# connection is kept open
+DRIVE_MAX_CONNECTIONS = int(os.environ.get("DRIVE_MAX_CONNECTIONS", 16))
+DRIVE_HTTP_TIMEOUT = float(os.environ.get("DRIVE_HTTP_TIMEOUT", 60))
+DRIVE_CONNECTION_IDLE_TIMEOUT = float(os.environ.get("DRIVE_CONNECTION_IDLE_TIMEOUT", 60))
+
+# Most Drive list results kept, and how long (seconds) listings of folders, of files, and empty results are kept
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get("QUERY_CACHE_MAX_ENTRIES", 256))
+QUERY_CACHE_FOLDER_TTL = float(os.environ.get("QUERY_CACHE_FOLDER_TTL", 300))
+QUERY_CACHE_FILE_TTL = float(os.environ.get("QUERY_CACHE_FILE_TTL", 60))
+QUERY_CACHE_NEGATIVE_TTL = float(os.environ.get("QUERY_CACHE_NEGATIVE_TTL", 30))
+
+# Discord shards: unset for no sharding, "auto" for the count Discord recommends, or a number. SHARD_IDS (ex. "0,2")
+# limits the shards run by this process. SHARD_PROCESSES > 1 splits the shards over that many processes, started
+# SHARD_START_DELAY seconds apart
+BOT_SHARDS = os.environ.get("BOT_SHARDS", "").strip()
+SHARD_IDS = [int(id) for id in os.environ.get("SHARD_IDS", "").split(",") if id.strip()]
+SHARD_PROCESSES = int(os.environ.get("SHARD_PROCESSES", 1))
+SHARD_START_DELAY = float(os.environ.get("SHARD_START_DELAY", 5))
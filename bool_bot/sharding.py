@@ -0,0 +1,131 @@
+import os
+import subprocess
+import sys
+import time
+
+from settings import BOT_SHARDS, SHARD_IDS, SHARD_PROCESSES, SHARD_START_DELAY, LIBRARY_INDEX_PATH
+
+try:
+    import fcntl
+except ImportError:
+    # Windows. Only one process is supported there
+    fcntl = None
+
+# Running the bot as several Discord shards, in one process or many.
+#
+# BOT_SHARDS unset runs a regular unsharded bot. BOT_SHARDS=auto runs every shard Discord recommends in this process,
+# BOT_SHARDS=N runs N shards, only those in SHARD_IDS if set. With SHARD_PROCESSES=P, __main__ starts P processes
+# running BOT_SHARDS / P shards each.
+#
+# The processes share the library index and the channel registry (SQLite in WAL mode, so reads never wait on a
+# write) and the media cache directory. Only one process, the leader, rebuilds the library index and follows the
+# Drive changes feed. The others reload the index when it changes, so adding a process adds capacity without adding
+# Drive traffic. The leader holds a lock on a file next to the index; if it stops, another process takes over.
+#
+# Pending !photo s selections stay in the process of the shard that got the command, since Discord sends the answer
+# of a user in a guild to the same shard.
+
+# ================================================================================
+# Bot
+
+def make_bot(**kwargs):
+    """
+    Returns the bot for this process: a commands.Bot, or a commands.AutoShardedBot running the shards in settings
+
+    kwargs : Passed to the bot. Ex. command_prefix="!"
+    """
+    from discord.ext import commands
+
+    if not BOT_SHARDS:
+        return commands.Bot(**kwargs)
+
+    if BOT_SHARDS != "auto":
+        kwargs["shard_count"] = int(BOT_SHARDS)
+        if SHARD_IDS:
+            kwargs["shard_ids"] = SHARD_IDS
+
+    return commands.AutoShardedBot(**kwargs)
+
+def process_shards(shard_count, processes):
+    """
+    Returns the shard ids of every process. Ex. [[0, 2], [1, 3]] for 4 shards in 2 processes
+    """
+    return [list(range(i, shard_count, processes)) for i in range(processes) if i < shard_count]
+
+def should_launch():
+    """
+    Returns True if this process must start the shard processes instead of running the bot
+    """
+    return SHARD_PROCESSES > 1 and not SHARD_IDS
+
+def launch():
+    """
+    Run every shard process and wait for them. Stops them all on Ctrl+C or if one of them stops
+    """
+    if not BOT_SHARDS.isdigit():
+        sys.exit("SHARD_PROCESSES needs BOT_SHARDS set to a number of shards")
+
+    children = []
+    try:
+        for i, shard_ids in enumerate(process_shards(int(BOT_SHARDS), SHARD_PROCESSES)):
+            if i > 0:
+                # Discord only lets a bot log in one shard at a time
+                time.sleep(SHARD_START_DELAY)
+
+            env = dict(os.environ, SHARD_IDS=",".join(str(id) for id in shard_ids), SHARD_PROCESSES="1")
+            print("Starting shards {0}".format(env["SHARD_IDS"]))
+            children.append(subprocess.Popen([sys.executable] + sys.argv, env=env))
+
+        while all(child.poll() is None for child in children):
+            time.sleep(1)
+
+        print("A shard process stopped, stopping the others")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for child in children:
+            if child.poll() is None:
+                child.terminate()
+        for child in children:
+            child.wait()
+
+# ================================================================================
+# Leader
+
+class Leader(object):
+    """
+    Lock held by the process keeping the shared library index up to date
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        """
+        Returns True if this process is the leader, taking the lock if it is free. Never waits
+        """
+        if self._file is not None:
+            return True
+
+        if fcntl is None:
+            self._file = True
+            return True
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        lock_file = open(self.path, "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+
+        # Kept open, the lock is released when the process exits
+        self._file = lock_file
+        return True
+
+# Global Vars
+leader = Leader(LIBRARY_INDEX_PATH + ".lock")
@@ -0,0 +1,42 @@
+import os
+import sys
+
+# The bot imports its modules by bare name (import google_drive_feat, from settings import ...) because it is
+# started with "python3 bool_bot". Put the package directory on the path so the tests see the same modules.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import pytest
+
+import drive_limits
+import google_drive_feat
+import query_cache
+from fake_drive import FakeDrive
+
+@pytest.fixture(autouse=True)
+def no_drive_rate_limit():
+    """
+    The tests send requests to fake_drive much faster than the Drive quota allows. Tests of the limit set their own
+    """
+    limiter = drive_limits.limiter
+    drive_limits.set_rate_limit(0)
+    yield
+    drive_limits.limiter = limiter
+
+@pytest.fixture(autouse=True)
+def empty_query_cache(monkeypatch):
+    """
+    Every test starts with no cached Drive listings, so the requests it counts are sent
+    """
+    monkeypatch.setattr(query_cache, "cache", query_cache.QueryCache())
+
+@pytest.fixture
+def fake_drive(request, monkeypatch):
+    """
+    A FakeDrive the Drive calls go to, retrying throttled requests without waiting long. Tests needing other
+    FakeDrive arguments parametrize it: @pytest.mark.parametrize("fake_drive", [{"latency": 0.01}], indirect=True)
+    """
+    fake = FakeDrive(**getattr(request, "param", {}))
+    google_drive_feat.set_service(fake)
+    monkeypatch.setattr(drive_limits, "DRIVE_RETRY_BASE_DELAY", 0.001)
+    yield fake
+    google_drive_feat.set_service(None)
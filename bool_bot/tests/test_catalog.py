@@ -0,0 +1,97 @@
+import sys
+
+import catalog
+
+DRIVE_FILE = {
+    "id": "abc",
+    "name": "kurt.jpg",
+    "mimeType": "image/jpeg",
+    "parents": ["folder1"],
+    "webViewLink": "https://drive.google.com/file/d/abc/view?usp=drivesdk",
+    "md5Checksum": "0123456789abcdef0123456789abcdef",
+    "modifiedTime": "2020-10-05T12:00:00.000Z",
+}
+
+def record(id, name="kurt.jpg", parent="folder1"):
+    return catalog.FileRecord(id, name, None, "image/jpeg", parent)
+
+def test_record_reads_like_drive_file():
+    """
+    Test a record gives back the fields of the Drive file, and only those that are set
+    """
+    file = catalog.FileRecord.from_drive(DRIVE_FILE)
+
+    assert dict(file) == DRIVE_FILE
+    assert file == DRIVE_FILE
+    assert file["parents"] == ["folder1"]
+    assert "description" not in file
+    assert file.get("description", "") == ""
+    assert catalog.FileRecord.from_drive(file) == file
+
+def test_record_is_compact():
+    """
+    Test the usual webViewLink and the md5Checksum are not stored as strings, and mime types and parents are shared
+    """
+    file = catalog.FileRecord.from_drive(DRIVE_FILE)
+    other = catalog.FileRecord.from_drive(dict(DRIVE_FILE, id="def", parents=["".join(["folder", "1"])]))
+
+    assert isinstance(file._link, int)
+    assert len(file._md5) == 16
+    assert file.parent_id is other.parent_id
+    assert file.mime_type is other.mime_type
+    assert not hasattr(file, "__dict__")
+
+    # Other forms are kept as they are
+    custom = catalog.FileRecord("x", "x.jpg", web_view_link="link", md5_checksum="0123456789ABCDEF0123456789ABCDEF")
+    assert custom["webViewLink"] == "link"
+    assert custom["md5Checksum"] == "0123456789ABCDEF0123456789ABCDEF"
+
+def test_results_are_positions():
+    files = catalog.Catalog([record("1", "a.jpg"), record("2", "b.jpg"), record("3", "c.jpg")])
+
+    results = files.results(["3", "missing", "1"])
+
+    assert [file["id"] for file in results] == ["3", "1"]
+    assert results._positions.itemsize == 4
+    assert [file["id"] for file in results[1:]] == ["1"]
+    assert results == [files.get("3"), files.get("1")]
+    assert files.results([]) == []
+
+def test_results_survive_changes():
+    """
+    Test results taken before a file is replaced or removed still resolve to it
+    """
+    files = catalog.Catalog([record("1", "a.jpg"), record("2", "b.jpg")])
+    results = files.results(["1", "2"])
+
+    files.put(record("1", "renamed.jpg"))
+    assert files.remove("2")
+    assert not files.remove("2")
+    files.put(record("4", "d.jpg"))
+
+    assert [file["name"] for file in results] == ["renamed.jpg", "b.jpg"]
+    assert len(files) == 2
+    assert files.get("2") is None
+    assert sorted(file["id"] for file in files.values()) == ["1", "4"]
+    assert [file["id"] for file in files.select(lambda file: file.name == "d.jpg")] == ["4"]
+
+def test_memory_per_file_is_flat():
+    """
+    Test the bytes per file don't grow with the library
+    """
+    def bytes_per_file(count):
+        files = catalog.Catalog(catalog.FileRecord.from_drive(dict(DRIVE_FILE, id="file{0:06d}".format(i),
+                                                                   name="photo{0:06d}.jpg".format(i),
+                                                                   parents=["folder{0}".format(i % 20)]))
+                                for i in range(count))
+        return files.nbytes() / float(count)
+
+    small = bytes_per_file(1000)
+    large = bytes_per_file(20000)
+
+    assert large < small * 1.1
+
+    # The Drive dict the library used to keep, with its values
+    drive_bytes = sys.getsizeof(DRIVE_FILE) + sum(sys.getsizeof(value) for value in DRIVE_FILE.values())
+    drive_bytes += sys.getsizeof(DRIVE_FILE["parents"][0])
+    assert large < drive_bytes * 0.75
@@ -0,0 +1,128 @@
+import pytest
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+import channel
+
+GUILDS = 1000
+
+class FakeContext(object):
+    def __init__(self, guild_id, text_channels, channel_mentions=()):
+        self.guild = SimpleNamespace(id=guild_id, text_channels=text_channels)
+        self.message = SimpleNamespace(channel_mentions=list(channel_mentions))
+        self.sent = []
+
+    async def send(self, content):
+        self.sent.append(content)
+
+def text_channel(id, name):
+    return SimpleNamespace(id=id, name=name)
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    registry = channel.ChannelRegistry(str(tmp_path / "channels.db"))
+    monkeypatch.setattr(channel, "registry", registry)
+    return registry
+
+def test_many_guilds(registry, tmp_path):
+    """
+    Test bot channels are kept per guild by channel id, and survive a reload
+    """
+    for guild_id in range(GUILDS):
+        # Every guild has a channel named general, with its own id
+        registry.add(guild_id, guild_id * 10)
+        if guild_id % 2 == 0:
+            registry.add(guild_id, guild_id * 10 + 1)
+
+    assert registry.contains(3, 30)
+    assert not registry.contains(3, 40)
+    assert registry.channels(4) == {40, 41}
+    assert registry.channels(GUILDS) == set()
+
+    assert registry.remove(4, 40)
+    assert not registry.remove(4, 40)
+    assert not registry.remove(5, 40)
+
+    reloaded = channel.ChannelRegistry(str(tmp_path / "channels.db"))
+    assert reloaded.load() == GUILDS + GUILDS // 2 - 1
+    assert reloaded.guilds == registry.guilds
+
+@pytest.mark.asyncio
+async def test_write_behind(registry, tmp_path, monkeypatch):
+    """
+    Test changes made on the event loop are written later, together
+    """
+    monkeypatch.setattr(channel, "CHANNEL_FLUSH_DELAY", 0.05)
+
+    registry.add(1, 10)
+    registry.add(1, 11)
+    registry.remove(1, 10)
+    assert registry.channels(1) == {11}
+
+    reloaded = channel.ChannelRegistry(str(tmp_path / "channels.db"))
+    assert reloaded.load() == 0
+
+    await asyncio.sleep(0.3)
+    assert reloaded.load() == 1
+    assert reloaded.channels(1) == {11}
+
+@pytest.mark.asyncio
+async def test_failed_write_is_retried(registry, tmp_path, monkeypatch, capsys):
+    """
+    Test changes stay pending when writing them fails, and are written by the next flush
+    """
+    monkeypatch.setattr(channel, "CHANNEL_FLUSH_DELAY", 0.05)
+    connect = registry._connect
+    failures = [sqlite3.OperationalError("database is locked")]
+
+    def flaky_connect():
+        if failures:
+            raise failures.pop()
+        return connect()
+
+    monkeypatch.setattr(registry, "_connect", flaky_connect)
+
+    registry.add(1, 10)
+    registry.add(1, 11)
+    await asyncio.sleep(0.3)
+
+    assert "Could not save the bot channels" in capsys.readouterr().out
+    assert registry._pending == []
+
+    reloaded = channel.ChannelRegistry(str(tmp_path / "channels.db"))
+    assert reloaded.load() == 2
+
+def test_flush_keeps_changes_on_failure(registry, monkeypatch):
+    registry._pending.append((1, 11, True))
+    monkeypatch.setattr(registry, "_connect", lambda: sqlite3.connect("/nonexistent/channels.db"))
+
+    with pytest.raises(sqlite3.OperationalError):
+        registry.flush()
+
+    assert registry._pending == [(1, 11, True)]
+
+@pytest.mark.asyncio
+async def test_channel_add_and_remove(registry):
+    """
+    Test the channel commands in two guilds with the same channel names
+    """
+    first = FakeContext(1, [text_channel(10, "general"), text_channel(11, "bot")])
+    second = FakeContext(2, [text_channel(20, "general"), text_channel(21, "bot")])
+
+    await channel.channel_add(first, "bot")
+    await channel.channel_add(first, "bot")
+    await channel.channel_add(first, "missing")
+    assert first.sent == ["Sucessfully added to bot text channel", "Channel already added", "Cannot find channel missing"]
+    assert registry.channels(1) == {11}
+    assert registry.channels(2) == set()
+
+    second.message.channel_mentions = [text_channel(20, "general")]
+    await channel.channel_add(second, "<#20>")
+    assert registry.channels(2) == {20}
+
+    await channel.channel_remove(first, "bot")
+    await channel.channel_remove(first, "bot")
+    assert first.sent[3:] == ["Sucessfully remove bot from bot text channel", "Cannot delete channel. Channel is not in this channel already"]
+    assert registry.channels(1) == set()
+    assert registry.channels(2) == {20}
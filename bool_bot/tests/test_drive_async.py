@@ -0,0 +1,86 @@
+import pytest
+import asyncio
+import io
+import itertools
+import time
+import types
+
+import google_drive_feat
+import drive_async
+import drive_batch
+import media_cache
+import photo
+
+# Simulated latency of one Drive round trip
+DRIVE_LATENCY = 0.2
+
+# Channel ids of the contexts
+channel_ids = itertools.count(1)
+
+class Context(object):
+    """
+    Stand in for discord.ext.commands.Context. Every context is in its own channel
+    """
+    def __init__(self):
+        self.sent = []
+        self.channel = types.SimpleNamespace(id=next(channel_ids))
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+
+def slow_search(query, video=False):
+    time.sleep(DRIVE_LATENCY)
+    return [{"id": query, "name": query + ".jpg", "description": query}]
+
+def slow_download(fileId, max_memory=None, md5=None, size=None):
+    time.sleep(DRIVE_LATENCY)
+    return io.BytesIO(b"photo")
+
+@pytest.mark.asyncio
+async def test_run_does_not_block_event_loop():
+    """
+    Test the event loop keeps running while a Drive call is in progress
+    """
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.01)
+
+    task = asyncio.ensure_future(ticker())
+    await drive_async.run(time.sleep, DRIVE_LATENCY)
+    task.cancel()
+
+    assert len(ticks) > 5
+
+@pytest.mark.asyncio
+async def test_concurrent_photo_random(mocker, tmp_path):
+    """
+    Test N simultaneous !photo r calls finish in about the time of one
+    """
+    concurrency = 5
+    mocker.patch.object(media_cache, "cache", media_cache.MediaCache(str(tmp_path), 1024))
+    mocker.patch.object(google_drive_feat, "get_files_search", side_effect=slow_search)
+    mocker.patch.object(drive_batch, "get_file_metadata", return_value={"md5Checksum": "abc"})
+    mocker.patch.object(google_drive_feat, "get_file_metadata", return_value={"md5Checksum": "abc", "size": "10"})
+    mocker.patch.object(google_drive_feat, "download_file_to_buffer", side_effect=slow_download)
+    drive_async.set_pool_size(concurrency)
+
+    contexts = [Context() for _ in range(concurrency)]
+
+    start = time.perf_counter()
+    await asyncio.gather(*[photo.photo_random(ctx, "justin{0}".format(i)) for i, ctx in enumerate(contexts)])
+    elapsed = time.perf_counter() - start
+
+    # One call is a search plus a download
+    assert elapsed < 2 * DRIVE_LATENCY * 1.5
+    for ctx in contexts:
+        assert ctx.sent == ["Sending Photo"]
+
+def test_set_pool_size_rejects_zero():
+    """
+    Test the pool needs at least one thread
+    """
+    with pytest.raises(ValueError):
+        drive_async.set_pool_size(0)
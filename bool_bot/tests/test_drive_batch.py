@@ -0,0 +1,72 @@
+import pytest
+import asyncio
+
+from googleapiclient.errors import HttpError
+
+import drive_batch
+
+# Requests take some time, so the ones sent together end up in the same batch
+pytestmark = pytest.mark.parametrize("fake_drive", [{"latency": 0.01}], indirect=True)
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_are_batched(fake_drive, mocker):
+    """
+    Test metadata requests sent at the same time cost one batch request
+    """
+    mocker.patch.object(drive_batch, "batcher", drive_batch.DriveBatcher(window=0.01))
+    ids = [fake_drive.add_file("photo{0}.jpg".format(i)) for i in range(20)]
+
+    results = await asyncio.gather(*[drive_batch.get_file_metadata(id) for id in ids])
+
+    assert [result["id"] for result in results] == ids
+    assert fake_drive.calls["batch"] == 1
+    assert fake_drive.calls["files.get"] == 0
+
+@pytest.mark.asyncio
+async def test_batch_size_limit(fake_drive, mocker):
+    """
+    Test batches are sent as soon as they are full
+    """
+    mocker.patch.object(drive_batch, "batcher", drive_batch.DriveBatcher(window=10, max_size=5))
+    ids = [fake_drive.add_file("photo{0}.jpg".format(i)) for i in range(10)]
+
+    results = await asyncio.wait_for(asyncio.gather(*[drive_batch.get_file_metadata(id) for id in ids]), 1)
+
+    assert len(results) == 10
+    assert fake_drive.calls["batch"] == 2
+
+@pytest.mark.asyncio
+async def test_errors_go_to_their_request(fake_drive, mocker):
+    """
+    Test a failing request in a batch doesn't fail the others
+    """
+    mocker.patch.object(drive_batch, "batcher", drive_batch.DriveBatcher(window=0.01))
+    id = fake_drive.add_file("photo.jpg")
+
+    results = await asyncio.gather(drive_batch.get_file_metadata(id), drive_batch.get_file_metadata("missing"),
+                                   return_exceptions=True)
+
+    assert results[0]["id"] == id
+    assert isinstance(results[1], HttpError)
+    assert results[1].resp.status == 404
+
+@pytest.mark.asyncio
+async def test_folder_contents_and_file_id(fake_drive, mocker):
+    """
+    Test !photo rf and !photo e lookups from many users share batches
+    """
+    mocker.patch.object(drive_batch, "batcher", drive_batch.DriveBatcher(window=0.01))
+    root = fake_drive.add_folder("Photos")
+    mocker.patch.object(drive_batch, "ROOT_PHOTO_FOLDER_ID", root)
+    folder = fake_drive.add_folder("test", root)
+    fake_drive.add_file("kurt.jpg", folder)
+
+    results = await asyncio.gather(*([drive_batch.get_folder_contents("test") for _ in range(5)] +
+                                     [drive_batch.get_file_id("kurt.jpg") for _ in range(5)]))
+
+    assert [file["name"] for file in results[0]] == ["kurt.jpg"]
+    assert results[5][0]["name"] == "kurt.jpg"
+    # The identical folder name lookups are sent once, with the file id lookups in one batch. The folder listing is
+    # then sent alone
+    assert fake_drive.calls["batch"] == 1
+    assert fake_drive.calls["files.list"] == 1
@@ -0,0 +1,161 @@
+import pytest
+import functools
+import io
+import time
+
+import google_drive_feat
+import drive_download
+import drive_limits
+
+def test_ranges_are_fetched_at_the_same_time(fake_drive):
+    """
+    Test a big file is downloaded in parallel ranges and checked against its md5Checksum
+    """
+    id = fake_drive.add_file("video.mp4", mimeType="video/mp4", size=10000)
+    fake_drive.latency = 0.05
+    buffer = io.BytesIO()
+
+    download = drive_download.RangeDownload(id, buffer, chunk_size=1000, parallelism=10)
+    download.run()
+
+    assert buffer.getvalue() == fake_drive.read(id)
+    assert fake_drive.calls["files.get_media"] == 10
+    assert fake_drive.calls["files.get"] == 1
+
+def test_known_size_and_md5(fake_drive, monkeypatch):
+    """
+    Test a download given the size and md5Checksum doesn't look them up, and one given an old size starts over
+    """
+    id = fake_drive.add_file("video.mp4", mimeType="video/mp4", size=4000)
+    md5 = fake_drive.items[id]["md5Checksum"]
+    buffer = io.BytesIO()
+
+    assert drive_download.RangeDownload(id, buffer, md5, chunk_size=1000, parallelism=4, size=4000).run() == 4000
+    assert buffer.getvalue() == fake_drive.read(id)
+    assert fake_drive.calls["files.get_media"] == 4
+    assert fake_drive.calls["files.get"] == 0
+
+    monkeypatch.setattr(drive_download, "RangeDownload",
+                        functools.partial(drive_download.RangeDownload, chunk_size=1000, parallelism=1))
+    buffer = io.BytesIO()
+    assert drive_download.download(id, buffer, md5, size=3000) == 4000
+    assert buffer.getvalue() == fake_drive.read(id)
+
+def test_small_file_is_one_request(fake_drive):
+    id = fake_drive.add_file("kurt.jpg", content=b"kurt at the beach")
+    buffer = io.BytesIO()
+
+    assert drive_download.RangeDownload(id, buffer, chunk_size=1000).run() == 17
+    assert buffer.getvalue() == b"kurt at the beach"
+    assert fake_drive.calls["files.get_media"] == 1
+    assert fake_drive.calls["files.get"] == 0
+
+def test_empty_file(fake_drive):
+    id = fake_drive.add_file("empty.jpg", content=b"")
+    buffer = io.BytesIO()
+
+    assert drive_download.RangeDownload(id, buffer).run() == 0
+    assert buffer.getvalue() == b""
+
+def test_cut_range_continues_where_it_stopped(fake_drive):
+    """
+    Test a range cut short is asked again from the last byte received, not from the start of the file
+    """
+    id = fake_drive.add_file("video.mp4", mimeType="video/mp4", size=4000)
+    fake_drive.cut_downloads(1, 300)
+    buffer = io.BytesIO()
+
+    drive_download.RangeDownload(id, buffer, chunk_size=1000, parallelism=1).run()
+
+    assert buffer.getvalue() == fake_drive.read(id)
+    assert fake_drive.calls["files.get_media"] == 5
+
+def test_failed_download_is_resumed(fake_drive, monkeypatch):
+    """
+    Test a download failing for good keeps the ranges it got, and run() again only fetches the rest
+    """
+    monkeypatch.setattr(drive_limits, "DRIVE_MAX_RETRIES", 0)
+    id = fake_drive.add_file("video.mp4", mimeType="video/mp4", size=4000)
+    buffer = io.BytesIO()
+    download = drive_download.RangeDownload(id, buffer, md5=fake_drive.items[id]["md5Checksum"], chunk_size=1000, parallelism=1)
+
+    fetch = download._fetch
+    def fail_third_range(start):
+        if start == 2000:
+            fake_drive.throttle(1, 503, "backendError")
+        return fetch(start)
+    monkeypatch.setattr(download, "_fetch", fail_third_range)
+
+    with pytest.raises(Exception):
+        download.run()
+    assert download.missing() == [2000, 3000]
+
+    monkeypatch.setattr(download, "_fetch", fetch)
+    fake_drive.calls.clear()
+    download.run()
+
+    assert buffer.getvalue() == fake_drive.read(id)
+    assert fake_drive.calls["files.get_media"] == 2
+
+def test_download_resumes(fake_drive, monkeypatch):
+    """
+    Test download() resumes a failed download, fetching only the ranges still missing
+    """
+    monkeypatch.setattr(drive_limits, "DRIVE_MAX_RETRIES", 0)
+    monkeypatch.setattr(drive_download, "RangeDownload",
+                        functools.partial(drive_download.RangeDownload, chunk_size=1000, parallelism=1))
+    id = fake_drive.add_file("video.mp4", mimeType="video/mp4", size=4000)
+    fake_drive.cut_downloads(1, 300)
+    fake_drive.throttle(1, 503, "backendError")
+    buffer = io.BytesIO()
+
+    assert drive_download.download(id, buffer, fake_drive.items[id]["md5Checksum"]) == 4000
+
+    assert buffer.getvalue() == fake_drive.read(id)
+    # The throttled request, then the 4 ranges and the rest of the cut one
+    assert fake_drive.calls["files.get_media"] == 6
+
+    fake_drive.throttle(10, 503, "backendError")
+    with pytest.raises(Exception):
+        drive_download.download(id, io.BytesIO(), resumes=1)
+    assert fake_drive.calls["files.get_media"] == 6 + 2
+
+def test_parallelism_is_per_download(fake_drive, monkeypatch):
+    """
+    Test a download never has more ranges in flight than its parallelism
+    """
+    id = fake_drive.add_file("video.mp4", mimeType="video/mp4", size=8000)
+    download = drive_download.RangeDownload(id, io.BytesIO(), chunk_size=1000, parallelism=2)
+
+    running = []
+    most = []
+    fetch = download._fetch
+    def counting_fetch(start):
+        running.append(start)
+        most.append(len(running))
+        time.sleep(0.02)
+        running.remove(start)
+        return fetch(start)
+    monkeypatch.setattr(download, "_fetch", counting_fetch)
+
+    assert download.run() == 8000
+    assert max(most) == 2
+
+def test_checksum_mismatch(fake_drive):
+    id = fake_drive.add_file("video.mp4", mimeType="video/mp4", size=3000)
+    buffer = io.BytesIO()
+
+    with pytest.raises(drive_download.ChecksumError):
+        drive_download.RangeDownload(id, buffer, md5="0" * 32, chunk_size=1000).run()
+
+def test_download_to_spooled_buffer(fake_drive):
+    """
+    Test google_drive_feat downloads big files in ranges into an anonymous temporary file
+    """
+    id = fake_drive.add_file("video.mp4", mimeType="video/mp4", size=5000)
+
+    buffer = google_drive_feat.download_file_to_buffer(id, max_memory=1500)
+
+    assert not isinstance(buffer, io.BytesIO)
+    assert buffer.read() == fake_drive.read(id)
+    buffer.close()
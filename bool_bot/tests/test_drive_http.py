@@ -0,0 +1,76 @@
+import pytest
+import http.server
+import threading
+import time
+
+import drive_http
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        # Slow enough for concurrent requests to overlap
+        time.sleep(0.02)
+        body = self.path.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{0}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+def test_connections_are_reused(server):
+    """
+    Test requests one after the other go over one kept alive connection
+    """
+    pool = drive_http.PooledHttp()
+
+    for i in range(5):
+        response, content = pool.request("{0}/file{1}".format(server, i))
+        assert response.status == 200
+        assert content == "/file{0}".format(i).encode("utf-8")
+
+    assert pool.stats()["opened"] == 1
+    assert pool.stats()["reused"] == 4
+    pool.close()
+
+def test_connections_per_host_are_limited(server):
+    """
+    Test concurrent requests from many threads open at most max_per_host connections, and reuse them afterwards
+    """
+    pool = drive_http.PooledHttp(max_per_host=3)
+    def request():
+        pool.request(server + "/file")
+
+    threads = [threading.Thread(target=request) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = pool.stats()
+    assert stats["opened"] <= 3
+    assert stats["opened"] + stats["reused"] == 12
+    assert stats["idle"] == stats["opened"]
+    pool.close()
+
+def test_idle_connections_are_closed(server):
+    pool = drive_http.PooledHttp(idle_timeout=0.05)
+
+    pool.request(server + "/file")
+    time.sleep(0.1)
+    pool.request(server + "/file")
+
+    assert pool.stats()["opened"] == 2
+    assert pool.stats()["closed"] == 1
+    pool.close()
@@ -0,0 +1,129 @@
+import pytest
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+import google_drive_feat
+import drive_async
+import drive_batch
+import drive_limits
+
+@pytest.mark.parametrize("status, reason", [
+    (403, "userRateLimitExceeded"),
+    (403, "rateLimitExceeded"),
+    (429, "rateLimitExceeded"),
+    (500, "backendError"),
+    (503, "backendError"),
+])
+def test_throttled_requests_are_retried(fake_drive, status, reason):
+    """
+    Test a request throttled or failing on the Drive side succeeds once Drive accepts it again
+    """
+    id = fake_drive.add_file("kurt.jpg")
+    fake_drive.throttle(3, status, reason)
+
+    files = google_drive_feat.list_files("name = 'kurt.jpg'", "id, name")
+
+    assert [file["id"] for file in files] == [id]
+    assert fake_drive.calls["throttled"] == 3
+    assert fake_drive.calls["files.list"] == 4
+
+def test_refused_requests_are_not_retried(fake_drive):
+    """
+    Test a 403 that is not a rate limit fails right away
+    """
+    fake_drive.throttle(1, 403, "insufficientFilePermissions")
+
+    with pytest.raises(HttpError):
+        google_drive_feat.list_files("trashed = false", "id")
+
+    assert fake_drive.calls["files.list"] == 1
+
+def test_gives_up_after_max_retries(fake_drive, monkeypatch):
+    """
+    Test a request throttled on every try fails after DRIVE_MAX_RETRIES retries
+    """
+    monkeypatch.setattr(drive_limits, "DRIVE_MAX_RETRIES", 2)
+    fake_drive.throttle(10, 429, "rateLimitExceeded")
+
+    with pytest.raises(HttpError):
+        google_drive_feat.get_file_metadata("id1")
+
+    assert fake_drive.calls["files.get"] == 3
+
+@pytest.mark.asyncio
+async def test_batch_retries_throttled_requests(fake_drive, mocker):
+    """
+    Test only the throttled requests of a batch are sent again
+    """
+    mocker.patch.object(drive_batch, "batcher", drive_batch.DriveBatcher(window=0.01))
+    ids = [fake_drive.add_file("photo{0}.jpg".format(i)) for i in range(5)]
+    fake_drive.throttle(2)
+
+    results = await asyncio.gather(*[drive_batch.get_file_metadata(id) for id in ids])
+
+    assert [result["id"] for result in results] == ids
+    assert fake_drive.calls["batch"] == 2
+
+def test_retry_delay():
+    """
+    Test retries wait a random time up to a delay doubling on every attempt, and at least Retry-After
+    """
+    for attempt in range(10):
+        delay = drive_limits.retry_delay(attempt)
+        assert 0 <= delay <= min(drive_limits.DRIVE_RETRY_MAX_DELAY, drive_limits.DRIVE_RETRY_BASE_DELAY * 2 ** attempt)
+
+    exception = HttpError(httplib2.Response({"status": 429, "retry-after": "3"}), b"")
+    assert drive_limits.retry_delay(0, exception) >= 3
+
+def test_token_bucket():
+    """
+    Test the bucket lets a burst through, then limits the rate
+    """
+    bucket = drive_limits.TokenBucket(rate=100, burst=5)
+
+    start = time.perf_counter()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.perf_counter() - start < 0.02
+
+    for _ in range(10):
+        bucket.acquire()
+    assert time.perf_counter() - start >= 0.09
+
+def test_identical_lists_are_coalesced(fake_drive):
+    """
+    Test the same listing asked from several threads at once is sent once
+    """
+    fake_drive.latency = 0.1
+    for i in range(3):
+        fake_drive.add_file("justin{0}.jpg".format(i))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: google_drive_feat.list_files("trashed = false", "id, name"), range(8)))
+
+    assert fake_drive.calls["files.list"] == 1
+    assert all(len(files) == 3 for files in results)
+    # Every caller gets its own list
+    assert len({id(files) for files in results}) == 8
+
+@pytest.mark.asyncio
+async def test_identical_searches_are_coalesced(mocker):
+    """
+    Test many users searching the same thing at once cost one search
+    """
+    def slow_search(query, video=False):
+        time.sleep(0.1)
+        return [{"id": "id1", "name": query + ".jpg"}]
+
+    search = mocker.patch.object(google_drive_feat, "get_files_search", side_effect=slow_search)
+
+    results = await asyncio.gather(*([drive_async.get_files_search("justin") for _ in range(10)] +
+                                     [drive_async.get_files_search("kurt")]))
+
+    assert search.call_count == 2
+    assert results[0] == results[9] == [{"id": "id1", "name": "justin.jpg"}]
+    assert results[10] == [{"id": "id1", "name": "kurt.jpg"}]
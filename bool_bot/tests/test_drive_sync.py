@@ -0,0 +1,124 @@
+import pytest
+
+import google_drive_feat
+import library_index
+import drive_sync
+
+ROOT = "root"
+
+def drive_file(id, name, parent="folder1", mimeType="image/jpeg", **kwargs):
+    file = {"id": id, "name": name, "mimeType": mimeType, "parents": [parent], "webViewLink": "link" + id}
+    file.update(kwargs)
+    return {"fileId": id, "removed": False, "file": file}
+
+@pytest.fixture
+def library(tmp_path):
+    index = library_index.LibraryIndex(str(tmp_path / "library.db"))
+    index.replace(
+        [{"id": "folder1", "name": "test", "parents": [ROOT]}],
+        [
+            {"id": "1", "name": "justin.jpg", "mimeType": "image/jpeg", "parents": ["folder1"], "webViewLink": "link1"},
+            {"id": "2", "name": "kurt.jpg", "mimeType": "image/jpeg", "parents": ["folder1"], "webViewLink": "link2"},
+        ],
+        "token1",
+    )
+    return index
+
+def test_apply_changes(library):
+    """
+    Test adds, renames, description edits and trashes are applied and saved
+    """
+    changes = [
+        drive_file("3", "jey.jpg"),
+        drive_file("1", "alex.jpg"),
+        drive_file("2", "kurt.jpg", description="justin"),
+        drive_file("4", "other.jpg", parent="elsewhere"),
+        {"fileId": "3", "removed": False, "file": dict(drive_file("3", "jey.jpg")["file"], trashed=True)},
+    ]
+
+    assert library.apply_changes(changes, "token2", ROOT) == 4
+
+    assert [file["id"] for file in library.search("alex")] == ["1"]
+    assert [file["id"] for file in library.search("justin")] == ["2"]
+    assert library.search("jey") == []
+    assert library.search("other") == []
+
+    loaded = library_index.LibraryIndex(library.path)
+    loaded.load()
+    assert loaded.page_token == "token2"
+    assert [file["id"] for file in loaded.search("justin")] == ["2"]
+
+def test_removed_and_new_folders(fake_drive, library):
+    """
+    Test folders added to the root folder are tracked and removed files leave the index
+    """
+    changes = [
+        drive_file("folder2", "beach", parent=ROOT, mimeType=library_index.FOLDER_MIME_TYPE),
+        drive_file("5", "sand.jpg", parent="folder2"),
+        {"fileId": "2", "removed": True},
+    ]
+
+    library.apply_changes(changes, "token2", ROOT)
+
+    assert [file["id"] for file in library.folder_contents("beach")] == ["5"]
+    assert library.search("kurt") == []
+
+def test_trashed_folder_takes_its_contents(fake_drive, library):
+    """
+    Test a folder trashed or moved out of the tree removes its sub folders and every file in them
+    """
+    changes = [
+        drive_file("folder2", "beach", parent="folder1", mimeType=library_index.FOLDER_MIME_TYPE),
+        drive_file("5", "sand.jpg", parent="folder2"),
+        {"fileId": "folder1", "removed": False, "file": dict(drive_file("folder1", "test", parent=ROOT,
+                                                                        mimeType=library_index.FOLDER_MIME_TYPE)["file"], trashed=True)},
+    ]
+
+    library.apply_changes(changes, "token2", ROOT)
+
+    assert library.search("kurt") == []
+    assert library.search("sand") == []
+    assert library.folder_contents("beach") == "No Folder"
+    assert len(library) == 0
+
+    loaded = library_index.LibraryIndex(library.path)
+    assert loaded.load() == 0
+    assert loaded.folder_listing(ROOT) == []
+
+def test_folder_moved_into_the_tree(fake_drive, library):
+    """
+    Test a folder moved into the tree brings the files already in it and in its sub folders
+    """
+    trip = fake_drive.add_folder("trip")
+    day = fake_drive.add_folder("day1", trip)
+    fake_drive.add_file("sand.jpg", trip)
+    fake_drive.add_file("kurt-beach.jpg", day)
+
+    library.apply_changes([drive_file(trip, "trip", parent=ROOT, mimeType=library_index.FOLDER_MIME_TYPE)], "token2", ROOT)
+
+    assert [file["name"] for file in library.search("sand")] == ["sand.jpg"]
+    assert sorted(file["name"] for file in library.folder_contents("trip")) == ["kurt-beach.jpg", "sand.jpg"]
+    assert [folder["name"] for depth, folder in library.folder_listing(ROOT)] == ["test", "trip", "day1"]
+
+    loaded = library_index.LibraryIndex(library.path)
+    loaded.load()
+    assert [file["name"] for file in loaded.search("beach")] == ["kurt-beach.jpg"]
+
+def test_sync_once(mocker, library):
+    """
+    Test a poll asks for the changes since the saved token
+    """
+    get_changes = mocker.patch.object(google_drive_feat, "get_changes", return_value=([drive_file("3", "jey.jpg")], "token2"))
+
+    assert drive_sync.sync_once(library) == 1
+
+    get_changes.assert_called_once_with("token1")
+    assert library.page_token == "token2"
+
+def test_next_delay():
+    """
+    Test the delay doubles after failures up to the maximum and resets after a success
+    """
+    assert drive_sync.next_delay(60, True, 60, 300) == 120
+    assert drive_sync.next_delay(240, True, 60, 300) == 300
+    assert drive_sync.next_delay(300, False, 60, 300) == 60
@@ -0,0 +1,87 @@
+import pytest
+import io
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseDownload
+
+import google_drive_feat
+
+pytestmark = pytest.mark.parametrize("fake_drive", [{"file_size": 5000}], indirect=True)
+
+def test_download(fake_drive):
+    """
+    Test google_drive_feat downloads the contents of a fake file
+    """
+    id = fake_drive.add_file("kurt.jpg", content=b"kurt at the beach")
+    generated = fake_drive.add_file("justin.jpg")
+
+    assert google_drive_feat.download_file_to_buffer(id).read() == b"kurt at the beach"
+    assert google_drive_feat.download_file_to_buffer(generated).read() == fake_drive.read(generated)
+    assert len(fake_drive.read(generated)) == 5000
+    assert fake_drive.calls["files.get_media"] == 2
+
+def test_download_in_chunks(fake_drive):
+    """
+    Test Range requests, the way MediaIoBaseDownload downloads big files
+    """
+    id = fake_drive.add_file("video.mp4", mimeType="video/mp4", size=10000)
+    buffer = io.BytesIO()
+    downloader = MediaIoBaseDownload(buffer, google_drive_feat.get_service().files().get_media(fileId=id), chunksize=3000)
+
+    done = False
+    while not done:
+        status, done = downloader.next_chunk()
+
+    assert buffer.getvalue() == fake_drive.read(id)
+    assert fake_drive.calls["files.get_media"] == 4
+
+def test_edited_file_has_new_contents(fake_drive):
+    """
+    Test generated contents and checksum change when a file is modified
+    """
+    id = fake_drive.add_file("kurt.jpg")
+    contents, checksum = fake_drive.read(id), fake_drive.items[id]["md5Checksum"]
+
+    fake_drive.touch(id)
+
+    assert fake_drive.read(id) != contents
+    assert fake_drive.items[id]["md5Checksum"] != checksum
+
+def test_missing_file(fake_drive):
+    """
+    Test downloading or getting a file that doesn't exist fails like Drive, with a 404
+    """
+    with pytest.raises(HttpError) as error:
+        google_drive_feat.download_file_to_buffer("missing")
+
+    assert error.value.resp.status == 404
+
+    # Not found is not retried
+    with pytest.raises(HttpError) as error:
+        google_drive_feat.get_file_metadata("missing")
+
+    assert error.value.resp.status == 404
+    assert fake_drive.calls["files.get"] == 1
+
+def test_throttled_download_is_retried(fake_drive):
+    """
+    Test a download throttled by Drive is retried
+    """
+    id = fake_drive.add_file("kurt.jpg", content=b"kurt")
+    fake_drive.throttle(2, 429, "rateLimitExceeded")
+
+    assert google_drive_feat.download_file_to_buffer(id).read() == b"kurt"
+    assert fake_drive.calls["files.get_media"] == 3
+
+def test_add_library(fake_drive, mocker):
+    """
+    Test the generated library can be searched through google_drive_feat
+    """
+    root = fake_drive.add_library(folders=4, photos_per_folder=30, videos_per_folder=2)
+    mocker.patch.object(google_drive_feat, "ROOT_PHOTO_FOLDER_ID", root)
+
+    files = google_drive_feat.get_library_files(google_drive_feat.get_folder_ids(root)[0])
+
+    assert len(files) == 4 * 32
+    assert sum(file["mimeType"] == "video/mp4" for file in files) == 4 * 2
+    assert len(google_drive_feat.get_files_search("justin")) > 0
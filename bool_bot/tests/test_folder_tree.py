@@ -0,0 +1,82 @@
+import google_drive_feat
+import folder_tree
+import library_index
+
+def build_tree(fake_drive, root, depth, width):
+    """
+    Add width sub folders to root, depth levels deep. Returns the ids by level
+    """
+    levels = [[root]]
+    for level in range(depth):
+        levels.append([
+            fake_drive.add_folder("folder{0}-{1}-{2}".format(level, i, j), parent)
+            for i, parent in enumerate(levels[-1]) for j in range(width)
+        ])
+    return levels[1:]
+
+def test_crawl_one_query_per_level(fake_drive):
+    """
+    Test every nested folder is found with one query per level
+    """
+    root = fake_drive.add_folder("Photos")
+    levels = build_tree(fake_drive, root, 3, 3)
+
+    folders = folder_tree.crawl(root)
+
+    assert sorted(folder["id"] for folder in folders) == sorted(id for level in levels for id in level)
+    assert fake_drive.calls["files.list"] == 3 + 1
+
+def test_refresh_only_changed_subtrees(fake_drive):
+    """
+    Test a second crawl reuses the sub trees of folders that didn't change
+    """
+    root = fake_drive.add_folder("Photos")
+    levels = build_tree(fake_drive, root, 3, 3)
+    known = {folder["id"]: folder for folder in folder_tree.crawl(root)}
+
+    changed = levels[0][0]
+    new_folder = fake_drive.add_folder("new", changed)
+    fake_drive.touch(changed)
+    fake_drive.calls.clear()
+
+    folders = folder_tree.crawl(root, known)
+
+    assert len(folders) == len(known) + 1
+    assert new_folder in [folder["id"] for folder in folders]
+    # Root level, the changed folder, then the new folder. The unchanged sub trees are reused
+    assert fake_drive.calls["files.list"] == 3
+
+def test_walk():
+    """
+    Test the tree is printed depth first, sorted by name
+    """
+    folders = {
+        "a": {"id": "a", "name": "beach", "parents": ["root"]},
+        "b": {"id": "b", "name": "2020", "parents": ["a"]},
+        "c": {"id": "c", "name": "alex", "parents": ["root"]},
+    }
+
+    lines = folder_tree.walk(folders, folder_tree.children_map(folders.values()), "root")
+
+    assert [(depth, folder["name"]) for depth, folder in lines] == [(0, "alex"), (0, "beach"), (1, "2020")]
+
+def test_library_covers_nested_folders(fake_drive, mocker, tmp_path):
+    """
+    Test the library index searches photos in nested folders and !photo rf finds nested folders
+    """
+    root = fake_drive.add_folder("Photos")
+    people = fake_drive.add_folder("people", root)
+    justin = fake_drive.add_folder("justin", people)
+    fake_drive.add_file("justin-beach.jpg", justin)
+    fake_drive.add_file("kurt.jpg", people)
+    fake_drive.add_file("root.jpg", root)
+
+    library = library_index.LibraryIndex(str(tmp_path / "library.db"))
+    mocker.patch.object(google_drive_feat, "get_start_page_token", return_value="token")
+
+    assert library.rebuild(root) == 3
+
+    assert [file["name"] for file in library.search("beach")] == ["justin-beach.jpg"]
+    assert [file["name"] for file in library.folder_contents("justin")] == ["justin-beach.jpg"]
+    assert sorted(file["name"] for file in library.folder_contents("people")) == ["justin-beach.jpg", "kurt.jpg"]
+    assert [(depth, folder["name"]) for depth, folder in library.folder_listing(root)] == [(0, "people"), (1, "justin")]
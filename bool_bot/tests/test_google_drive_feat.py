@@ -1,7 +1,10 @@
 import pytest
 import os
+import datetime
+import io
 
-from bool_bot import google_drive_feat
+import google_drive_feat
+import fake_drive
 
 @pytest.mark.asyncio
 async def test_get_recent_files(mocker):
@@ -65,4 +68,122 @@ async def test_get_files_search(mocker):
     results = google_drive_feat.get_files_search("jey")
 
     spy.assert_called_once_with("jey")
-    assert len(results) > 0
\ No newline at end of file
+    assert len(results) > 0
+
+class FakeCredentials(object):
+    """
+    Stand in for google.oauth2.credentials.Credentials
+    """
+    def __init__(self, token="token", expires_in=3600):
+        self.token = token
+        self.refresh_token = "refresh"
+        self.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=expires_in)
+        self.refresh_calls = 0
+
+    @property
+    def valid(self):
+        return self.expiry > datetime.datetime.utcnow()
+
+    def refresh(self, request):
+        self.refresh_calls += 1
+        self.token = "token{0}".format(self.refresh_calls)
+        self.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=3600)
+
+def test_service_is_built_once(mocker):
+    """
+    Test the credentials and service are loaded once and shared between calls
+    """
+    google_drive_feat.reset_client()
+    load = mocker.patch.object(google_drive_feat, "_load_credentials", return_value=FakeCredentials())
+    build = mocker.patch.object(google_drive_feat, "build", return_value=object())
+
+    service_one = google_drive_feat.get_service()
+    service_two = google_drive_feat.get_service()
+
+    assert service_one is service_two
+    load.assert_called_once()
+    build.assert_called_once()
+    google_drive_feat.reset_client()
+
+def test_credentials_refreshed_before_expiry(mocker):
+    """
+    Test credentials close to expiry are refreshed and only then saved to token.pickle
+    """
+    google_drive_feat.reset_client()
+    creds = FakeCredentials(expires_in=60)
+    mocker.patch.object(google_drive_feat, "_load_credentials", return_value=creds)
+    save = mocker.patch.object(google_drive_feat, "_save_credentials")
+
+    google_drive_feat.authenticate()
+    google_drive_feat.authenticate()
+
+    assert creds.refresh_calls == 1
+    save.assert_called_once_with(creds)
+    google_drive_feat.reset_client()
+
+def test_spooled_buffer():
+    """
+    Test downloads stay in memory until they are bigger than max_memory
+    """
+    small = google_drive_feat.SpooledBuffer(10)
+    small.write(b"12345")
+    assert isinstance(small.file, io.BytesIO)
+
+    big = google_drive_feat.SpooledBuffer(10)
+    big.write(b"12345")
+    big.write(b"678901")
+    assert not isinstance(big.file, io.BytesIO)
+    big.file.seek(0)
+    assert big.file.read() == b"12345678901"
+    big.file.close()
+
+# Small pages, so listings take several
+small_pages = pytest.mark.parametrize("fake_drive", [{"max_page_size": 7}], indirect=True)
+
+@small_pages
+def test_listing_is_not_truncated(fake_drive, mocker):
+    """
+    Test folders and files past the first page are listed
+    """
+    root = fake_drive.add_folder("Photos")
+    mocker.patch.object(google_drive_feat, "ROOT_PHOTO_FOLDER_ID", root)
+    mocker.patch.object(google_drive_feat, "PARENTS_PER_QUERY", 4)
+
+    for i in range(15):
+        folder = fake_drive.add_folder("folder{0}".format(i), root)
+        for j in range(12):
+            fake_drive.add_file("justin{0}-{1}.jpg".format(i, j), folder)
+        fake_drive.add_file("justin{0}.mp4".format(i), folder, mimeType="video/mp4")
+    fake_drive.add_file("kurt.jpg", root)
+
+    folder_ids, folder_names = google_drive_feat.get_folder_ids(root)
+    assert len(folder_ids) == 16
+    assert len(folder_names) == 15
+
+    assert len(google_drive_feat.get_files_search("justin")) == 15 * 12
+    assert len(google_drive_feat.get_files_search("justin", video=True)) == 15
+    assert len(google_drive_feat.get_files_search("kurt")) == 1
+    assert len(google_drive_feat.get_folder_contents("folder3")) == 12
+    assert google_drive_feat.get_folder_contents("folder99") == "No Folder"
+
+@small_pages
+def test_parents_are_batched(fake_drive):
+    """
+    Test folders are listed PARENTS_PER_QUERY at a time
+    """
+    parents = [fake_drive.add_folder("folder{0}".format(i)) for i in range(google_drive_feat.PARENTS_PER_QUERY * 2)]
+    for parent in parents:
+        fake_drive.add_file("photo.jpg", parent)
+
+    files = google_drive_feat.list_files_in_parents(parents, "trashed = false", "id")
+
+    assert len(files) == len(parents)
+    # Two queries, each one paged max_page_size files at a time
+    assert fake_drive.calls["files.list"] == 2 * -(-google_drive_feat.PARENTS_PER_QUERY // fake_drive.max_page_size)
+
+def test_escape_query():
+    """
+    Test quotes in names can't break out of a query
+    """
+    assert google_drive_feat.escape_query("kurt's") == "kurt\\'s"
+    assert fake_drive.parse_query("name = '{0}'".format(google_drive_feat.escape_query("kurt's")))({"name": "kurt's"})
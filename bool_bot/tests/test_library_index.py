@@ -0,0 +1,91 @@
+import pytest
+
+import google_drive_feat
+import library_index
+
+ROOT = "root"
+
+FOLDERS = [
+    {"id": "folder1", "name": "test", "parents": [ROOT]},
+    {"id": "folder2", "name": "beach", "parents": [ROOT]},
+]
+
+FILES = [
+    {"id": "1", "name": "justin.jpg", "mimeType": "image/jpeg", "parents": ["folder1"], "webViewLink": "link1"},
+    {"id": "2", "name": "kurt.png", "description": "kurt and justin", "mimeType": "image/png", "parents": ["folder2"], "webViewLink": "link2"},
+    {"id": "3", "name": "Justin.jpg", "mimeType": "image/jpeg", "parents": ["folder2"], "webViewLink": "link3"},
+    {"id": "4", "name": "justin.mp4", "mimeType": "video/mp4", "parents": ["folder1"], "webViewLink": "link4"},
+]
+
+@pytest.fixture
+def library(tmp_path):
+    index = library_index.LibraryIndex(str(tmp_path / "library.db"))
+    index.replace(FOLDERS, FILES)
+    return index
+
+def test_search(library):
+    """
+    Test search matches the name or description ignoring case, name matches first
+    """
+    assert [file["id"] for file in library.search("justin", limit=10)] == ["3", "1", "2"]
+    assert [file["id"] for file in library.search("Justin", limit=10)] == ["3", "1", "2"]
+    assert sorted(file["id"] for file in library.search("justin")) == ["1", "2", "3"]
+    assert [file["id"] for file in library.search("justin", limit=1)] == ["3"]
+    assert [file["id"] for file in library.search("justin", video=True)] == ["4"]
+    assert [file["id"] for file in library.search("ku")] == ["2"]
+    assert library.search("nobody") == []
+
+def test_folder_contents(library):
+    """
+    Test folder contents returns the photos of the folder
+    """
+    assert [file["id"] for file in library.folder_contents("test")] == ["1"]
+    assert library.folder_contents("missing") == "No Folder"
+
+def test_load(library):
+    """
+    Test the index is saved and loaded back from SQLite
+    """
+    loaded = library_index.LibraryIndex(library.path)
+
+    assert loaded.load() == len(FILES)
+    assert loaded.ready
+    assert loaded.search("kurt") == library.search("kurt")
+    assert loaded.get_file("2") == FILES[1]
+
+def test_stats(library):
+    stats = library.stats()
+
+    assert stats["files"] == len(FILES)
+    assert stats["folders"] == len(FOLDERS)
+    assert stats["bytes_per_file"] > 0
+
+@pytest.mark.asyncio
+async def test_search_files_without_drive(mocker, library):
+    """
+    Test searches are answered by the index without calling Drive
+    """
+    mocker.patch.object(library_index, "library", library)
+    drive = mocker.patch.object(google_drive_feat, "get_files_search")
+
+    found_files = await library_index.search_files("kurt")
+
+    assert [file["id"] for file in found_files] == ["2"]
+    drive.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_start_after_load_failure(mocker, tmp_path):
+    """
+    Test the index is still rebuilt when the saved one can't be loaded
+    """
+    path = tmp_path / "library.db"
+    path.write_bytes(b"not a database" * 100)
+    mocker.patch.object(library_index, "library", library_index.LibraryIndex(str(path)))
+    mocker.patch.object(library_index, "_started", False)
+    mocker.patch.object(library_index.sharding.leader, "acquire", return_value=True)
+    refresh = mocker.patch.object(library_index, "refresh", mocker.AsyncMock())
+
+    await library_index.start()
+
+    assert not library_index.library.ready
+    refresh.assert_called_once_with()
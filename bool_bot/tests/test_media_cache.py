@@ -0,0 +1,258 @@
+import pytest
+import asyncio
+import io
+import os
+import time
+
+import google_drive_feat
+import drive_batch
+import library_index
+import media_cache
+
+def fake_download(fileId, max_memory=None, md5=None, size=None):
+    time.sleep(0.05)
+    return io.BytesIO((fileId * 100).encode("utf-8")[:100])
+
+async def read(cache, file_id, version=None):
+    with await cache.open(file_id, version) as buffer:
+        return buffer.read()
+
+def cached_path(cache, file_id):
+    return cache._entries[file_id][0]
+
+@pytest.fixture
+def download(mocker):
+    mocker.patch.object(drive_batch, "get_file_metadata", return_value={"md5Checksum": "v1"})
+    return mocker.patch.object(google_drive_feat, "download_file_to_buffer", side_effect=fake_download)
+
+@pytest.mark.asyncio
+async def test_hit_and_miss(download, tmp_path):
+    """
+    Test a file is only downloaded once
+    """
+    cache = media_cache.MediaCache(str(tmp_path), 1000)
+
+    assert await read(cache, "a") == b"a" * 100
+    assert await read(cache, "a") == b"a" * 100
+
+    assert os.path.getsize(cached_path(cache, "a")) == 100
+    assert download.call_count == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+@pytest.mark.asyncio
+async def test_single_flight(download, tmp_path):
+    """
+    Test concurrent requests for the same file share one download
+    """
+    cache = media_cache.MediaCache(str(tmp_path), 1000)
+
+    contents = await asyncio.gather(*[read(cache, "a", "v1") for _ in range(10)])
+
+    assert contents == [b"a" * 100] * 10
+    assert download.call_count == 1
+    assert cache.shared == 9
+
+@pytest.mark.asyncio
+async def test_lru_eviction(download, tmp_path):
+    """
+    Test the least recently used files are evicted once over the byte budget
+    """
+    cache = media_cache.MediaCache(str(tmp_path), 250)
+
+    await read(cache, "a", "v1")
+    await read(cache, "b", "v1")
+    await read(cache, "a", "v1")
+    await read(cache, "c", "v1")
+
+    assert cache.size == 200
+    assert sorted(cache._entries) == ["a", "c"]
+    cached = sorted(name for name in os.listdir(str(tmp_path)) if name != media_cache.LOCK_FILE)
+    assert cached == sorted(os.path.basename(path) for path, size in cache._entries.values())
+    await read(cache, "b", "v1")
+    assert download.call_count == 4
+
+@pytest.mark.asyncio
+async def test_changed_file_downloaded_again(download, tmp_path):
+    """
+    Test a new version of a file replaces the cached one
+    """
+    cache = media_cache.MediaCache(str(tmp_path), 1000)
+
+    await read(cache, "a", "v1")
+    old_path = cached_path(cache, "a")
+    await read(cache, "a", "v2")
+
+    assert cached_path(cache, "a") != old_path
+    assert not os.path.exists(old_path)
+    assert download.call_count == 2
+    assert cache.size == 100
+
+@pytest.mark.asyncio
+async def test_cache_disabled(download, tmp_path):
+    """
+    Test nothing is written to disk when the cache has no byte budget
+    """
+    cache = media_cache.MediaCache(str(tmp_path), 0)
+
+    assert await read(cache, "a", "v1") == b"a" * 100
+
+    assert os.listdir(str(tmp_path)) == []
+    assert len(cache) == 0
+
+@pytest.mark.asyncio
+async def test_single_flight_without_cache(download, tmp_path):
+    """
+    Test concurrent requests share one download even if nothing is cached, each reading its own copy
+    """
+    cache = media_cache.MediaCache(str(tmp_path), 0)
+
+    contents = await asyncio.gather(*[read(cache, "a", "v1") for _ in range(5)])
+
+    assert contents == [b"a" * 100] * 5
+    assert download.call_count == 1
+    assert cache.shared == 4
+
+@pytest.mark.asyncio
+async def test_cancelled_request_closes_download(download, tmp_path):
+    """
+    Test the download of a cancelled request is closed once done, and the requests waiting on it still get it
+    """
+    cache = media_cache.MediaCache(str(tmp_path), 0)
+    buffers = []
+    download.side_effect = lambda fileId, **kwargs: buffers.append(fake_download(fileId)) or buffers[-1]
+
+    first = asyncio.ensure_future(cache.open("a", "v1"))
+    await asyncio.sleep(0.01)
+    second = asyncio.ensure_future(read(cache, "a", "v1"))
+    await asyncio.sleep(0.01)
+    first.cancel()
+
+    assert await second == b"a" * 100
+    await asyncio.sleep(0.01)
+    assert len(buffers) == 1
+    assert buffers[0].closed
+    assert cache._inflight == {}
+
+@pytest.mark.asyncio
+async def test_version_from_library(download, mocker, tmp_path):
+    """
+    Test the version comes from the library index without asking Drive
+    """
+    library = library_index.LibraryIndex(str(tmp_path / "library.db"))
+    library.replace([], [{"id": "a", "name": "a.jpg", "mimeType": "image/jpeg", "parents": ["root"], "md5Checksum": "v1"}])
+    mocker.patch.object(library_index, "library", library)
+    cache = media_cache.MediaCache(str(tmp_path / "cache"), 1000)
+
+    await read(cache, "a")
+
+    drive_batch.get_file_metadata.assert_not_called()
+    # The download doesn't look up the md5Checksum again
+    assert google_drive_feat.download_file_to_buffer.call_args[1]["md5"] == "v1"
+
+@pytest.mark.asyncio
+async def test_scan(download, tmp_path):
+    """
+    Test files cached by a previous run are reused
+    """
+    await read(media_cache.MediaCache(str(tmp_path), 1000), "a", "v1")
+
+    cache = media_cache.MediaCache(str(tmp_path), 1000)
+    await read(cache, "a", "v1")
+
+    assert cache.hits == 1
+    assert download.call_count == 1
+
+@pytest.mark.asyncio
+async def test_shared_directory(download, tmp_path):
+    """
+    Test a file downloaded by another shard process is read from disk, and a file it evicted is downloaded again
+    """
+    first = media_cache.MediaCache(str(tmp_path), 1000)
+    second = media_cache.MediaCache(str(tmp_path), 1000)
+    await read(first, "a", "v1")
+    await read(second, "b", "v1")
+
+    assert await read(second, "a", "v1") == b"a" * 100
+    assert second.hits == 1
+    assert download.call_count == 2
+
+    first.invalidate("a")
+
+    assert await read(second, "a", "v1") == b"a" * 100
+    assert download.call_count == 3
+
+@pytest.mark.asyncio
+async def test_renditions(download, tmp_path):
+    """
+    Test renditions are cached apart from the original, and survive a restart
+    """
+    class Upper(object):
+        name = "upper"
+
+        def produce(self, file_id, metadata=None):
+            return io.BytesIO(fake_download(file_id).read().upper())
+
+    cache = media_cache.MediaCache(str(tmp_path), 1000)
+
+    assert await read(cache, "a", "v1") == b"a" * 100
+    with await cache.open("a", "v1", rendition=Upper()) as buffer:
+        assert buffer.read() == b"A" * 100
+    with await cache.open("a", "v1", rendition=Upper()) as buffer:
+        assert buffer.read() == b"A" * 100
+
+    assert cache.stats()["misses"] == 2
+    assert sorted(cache._entries) == ["a", "a.upper"]
+
+    restarted = media_cache.MediaCache(str(tmp_path), 1000)
+    with await restarted.open("a", "v1", rendition=Upper()) as buffer:
+        assert buffer.read() == b"A" * 100
+    assert restarted.stats()["hits"] == 1
+
+@pytest.mark.asyncio
+async def test_adopted_during_download(download, tmp_path):
+    """
+    Test a file another shard process writes while the download is in flight is not deleted once the download is done
+    """
+    cache = media_cache.MediaCache(str(tmp_path), 1000)
+    path = cache._path("a", "v1")
+
+    first = asyncio.ensure_future(read(cache, "a", "v1"))
+    await asyncio.sleep(0.01)
+    # Another shard process renames its download into place
+    with open(path, "wb") as fh:
+        fh.write(b"a" * 100)
+    second = asyncio.ensure_future(read(cache, "a", "v1"))
+    await asyncio.sleep(0)
+    assert cache.shared == 1
+    cache._adopt("a", path)
+
+    assert await asyncio.gather(first, second) == [b"a" * 100] * 2
+    assert cached_path(cache, "a") == path
+    assert os.path.exists(path)
+    assert cache.size == 100
+    assert await read(cache, "a", "v1") == b"a" * 100
+    assert download.call_count == 1
+
+@pytest.mark.asyncio
+async def test_rendition_gets_metadata(download, tmp_path):
+    """
+    Test the Drive metadata given to open is handed to the rendition instead of being looked up again
+    """
+    produced = []
+
+    class Recording(object):
+        name = "recording"
+
+        def produce(self, file_id, metadata=None):
+            produced.append(metadata)
+            return fake_download(file_id)
+
+    cache = media_cache.MediaCache(str(tmp_path), 1000)
+    metadata = {"md5Checksum": "v1", "size": "100", "thumbnailLink": "link"}
+
+    with await cache.open("a", rendition=Recording(), metadata=metadata) as buffer:
+        assert buffer.read() == b"a" * 100
+
+    assert produced == [metadata]
+    drive_batch.get_file_metadata.assert_not_called()
@@ -0,0 +1,98 @@
+import pytest
+import io
+import random
+
+import google_drive_feat
+import media_prep
+
+Image = pytest.importorskip("PIL.Image")
+
+def noisy_image(width, height, mode="RGB", format="JPEG"):
+    # Noise doesn't compress, so the photo is big
+    random.seed(1)
+    image = Image.frombytes(mode, (width, height), bytes(random.getrandbits(8) for _ in range(width * height * len(mode))))
+    buffer = io.BytesIO()
+    image.save(buffer, format)
+    buffer.seek(0)
+    return buffer
+
+def test_shrink_big_photo():
+    """
+    Test a big photo is downscaled and recompressed under the target size
+    """
+    original = noisy_image(1200, 800)
+    shrunk = media_prep.shrink_image(original, 600, 100 * 1024)
+
+    image = Image.open(shrunk)
+    assert image.format == "JPEG"
+    assert max(image.size) <= 600
+    assert shrunk.seek(0, 2) <= 100 * 1024
+    assert original.closed
+
+def test_small_photo_unchanged():
+    original = noisy_image(100, 100)
+    assert media_prep.shrink_image(original, 600, 1024 * 1024) is original
+    assert original.tell() == 0
+
+def test_transparent_png():
+    """
+    Test transparent PNGs become JPEGs
+    """
+    shrunk = media_prep.shrink_image(noisy_image(800, 800, "RGBA", "PNG"), 400, 1024 * 1024)
+
+    image = Image.open(shrunk)
+    assert image.format == "JPEG"
+    assert image.size == (400, 400)
+
+def test_not_an_image():
+    original = io.BytesIO(b"<svg></svg>")
+    assert media_prep.shrink_image(original, 10, 1) is original
+
+def test_thumbnail_url():
+    assert media_prep.thumbnail_url("https://lh3.googleusercontent.com/abc=s220", 1600) == "https://lh3.googleusercontent.com/abc=s1600"
+
+def test_rendition_uses_thumbnail(mocker):
+    """
+    Test the Drive thumbnail is downloaded instead of a big file
+    """
+    mocker.patch.object(google_drive_feat, "get_file_metadata", return_value={
+        "size": str(20 * 1024 * 1024),
+        "thumbnailLink": "https://lh3.googleusercontent.com/abc=s220",
+        "imageMediaMetadata": {"width": 6000, "height": 4000},
+    })
+    download_link = mocker.patch.object(google_drive_feat, "download_link", return_value=noisy_image(300, 200))
+    download = mocker.patch.object(google_drive_feat, "download_file_to_buffer")
+
+    buffer = media_prep.Rendition(300, 1024 * 1024).produce("a")
+
+    download_link.assert_called_once_with("https://lh3.googleusercontent.com/abc=s300")
+    assert download.call_count == 0
+    assert Image.open(buffer).size == (300, 200)
+
+def test_rendition_without_thumbnail(mocker):
+    """
+    Test big files without a thumbnail are downloaded and shrunk, and small ones are left alone
+    """
+    metadata = mocker.patch.object(google_drive_feat, "get_file_metadata", return_value={
+        "size": str(5 * 1024 * 1024),
+        "imageMediaMetadata": {"width": 1200, "height": 800},
+    })
+    mocker.patch.object(google_drive_feat, "download_file_to_buffer", side_effect=lambda id, **kwargs: noisy_image(1200, 800))
+
+    assert Image.open(media_prep.Rendition(600, 1024 * 1024).produce("a")).size == (600, 400)
+
+    metadata.return_value = {"size": "1000", "imageMediaMetadata": {"width": 1200, "height": 800}}
+    assert Image.open(media_prep.Rendition(1600, 1024 * 1024).produce("a")).size == (1200, 800)
+
+def test_rendition_with_metadata(mocker):
+    """
+    Test the metadata given is used instead of looking it up again
+    """
+    get_file_metadata = mocker.patch.object(google_drive_feat, "get_file_metadata")
+    download = mocker.patch.object(google_drive_feat, "download_file_to_buffer", return_value=noisy_image(100, 100))
+    metadata = {"size": "1000", "md5Checksum": "abc", "imageMediaMetadata": {"width": 100, "height": 100}}
+
+    media_prep.Rendition(1600, 1024 * 1024).produce("a", metadata)
+
+    get_file_metadata.assert_not_called()
+    download.assert_called_once_with("a", md5="abc", size=1000)
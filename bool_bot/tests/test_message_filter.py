@@ -0,0 +1,70 @@
+import pytest
+from types import SimpleNamespace
+
+import channel
+import message_filter
+
+GUILD = 1
+BOT_CHANNEL = 10
+OTHER_CHANNEL = 11
+
+def make_message(content, channel_id=BOT_CHANNEL, author_id=100, bot=False, guild_id=GUILD):
+    return SimpleNamespace(
+        content=content,
+        author=SimpleNamespace(id=author_id, bot=bot),
+        guild=SimpleNamespace(id=guild_id) if guild_id is not None else None,
+        channel=SimpleNamespace(id=channel_id),
+    )
+
+@pytest.fixture(autouse=True)
+def registry(tmp_path, monkeypatch):
+    registry = channel.ChannelRegistry(str(tmp_path / "channels.db"))
+    registry.add(GUILD, BOT_CHANNEL)
+    monkeypatch.setattr(channel, "registry", registry)
+    return registry
+
+def test_commands():
+    """
+    Test commands only run in bot channels, except the channel commands
+    """
+    assert message_filter.route(make_message("!photo s kurt"), {}) == message_filter.COMMAND
+    assert message_filter.route(make_message("!photo s kurt", OTHER_CHANNEL), {}) == message_filter.IGNORE
+    assert message_filter.route(make_message("!channel a test", OTHER_CHANNEL), {}) == message_filter.COMMAND
+    assert message_filter.route(make_message("!channel-list", OTHER_CHANNEL), {}) == message_filter.COMMAND
+
+def test_no_bot_channels(registry):
+    """
+    Test a guild without bot channels is told to add one
+    """
+    registry.remove(GUILD, BOT_CHANNEL)
+
+    assert message_filter.route(make_message("!photo s kurt"), {}) == message_filter.NO_CHANNELS
+    assert message_filter.route(make_message("!channel add test"), {}) == message_filter.COMMAND
+    assert message_filter.route(make_message("hello"), {}) == message_filter.IGNORE
+
+def test_selection():
+    """
+    Test plain messages only go to the search requests if the user has one pending in the channel
+    """
+    pending = {(100, BOT_CHANNEL): {}, (100, OTHER_CHANNEL): {}}
+
+    assert message_filter.route(make_message("1"), pending) == message_filter.SELECTION
+    assert message_filter.route(make_message("1", author_id=200), pending) == message_filter.IGNORE
+    assert message_filter.route(make_message("1", author_id=100, channel_id=12), pending) == message_filter.IGNORE
+    assert message_filter.route(make_message("1", OTHER_CHANNEL), pending) == message_filter.IGNORE
+
+def test_ignored_messages():
+    """
+    Test empty messages, bot messages and direct messages are ignored without crashing
+    """
+    pending = {(100, BOT_CHANNEL): {}, (100, OTHER_CHANNEL): {}}
+
+    assert message_filter.route(make_message(""), {}) == message_filter.IGNORE
+    assert message_filter.route(make_message("!photo s kurt", bot=True), pending) == message_filter.IGNORE
+    assert message_filter.route(make_message("!photo s kurt", guild_id=None), pending) == message_filter.IGNORE
+
+def test_command_name():
+    assert message_filter.command_name("!photo s kurt") == "photo"
+    assert message_filter.command_name("!channel-list") == "channel-list"
+    assert message_filter.command_name("!ls\nmore") == "ls"
+    assert message_filter.command_name("!") == ""
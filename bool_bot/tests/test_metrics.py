@@ -0,0 +1,106 @@
+import pytest
+import json
+import re
+
+import metrics
+import google_drive_feat
+import fake_drive
+
+@pytest.fixture(autouse=True)
+def clean_metrics(monkeypatch):
+    # Collectors registered by a test are dropped after it
+    monkeypatch.setattr(metrics, "_collectors", dict(metrics._collectors))
+    metrics.reset()
+    yield
+    metrics.reset()
+
+def test_histogram_quantiles():
+    """
+    Test quantiles return the bucket upper bound
+    """
+    histogram = metrics.Histogram()
+    for _ in range(90):
+        histogram.observe(0.003)
+    for _ in range(10):
+        histogram.observe(2.0)
+
+    assert histogram.count == 100
+    assert histogram.quantile(0.5) == 0.005
+    assert histogram.quantile(0.95) == 2.5
+    assert histogram.quantile(1) == 2.5
+
+def test_timed_records_latency_and_errors():
+    """
+    Test the decorator records every call and counts the errors
+    """
+    @metrics.timed("drive", "flaky")
+    def flaky(fail):
+        if fail:
+            raise ValueError("fail")
+        return "ok"
+
+    assert flaky(False) == "ok"
+    with pytest.raises(ValueError):
+        flaky(True)
+
+    data = metrics.snapshot()
+    assert data["latency"]["drive"]["flaky"]["count"] == 2
+    assert data["counters"]["errors"]["drive.flaky"] == 1
+
+def test_drive_calls_are_recorded(mocker):
+    """
+    Test google_drive_feat functions are timed
+    """
+    drive = fake_drive.FakeDrive()
+    root = drive.add_folder("Photos")
+    drive.add_folder("test", root)
+    google_drive_feat.set_service(drive)
+    try:
+        google_drive_feat.get_folder_ids(root)
+    finally:
+        google_drive_feat.set_service(None)
+
+    latency = metrics.snapshot()["latency"]["drive"]
+    assert latency["get_folder_ids"]["count"] == 1
+    assert latency["list_files"]["count"] == 1
+
+def test_exports(tmp_path):
+    """
+    Test the JSON file and the Prometheus text contain the metrics and the collectors
+    """
+    metrics.register_collector("test_cache", lambda: {"hits": 3})
+    metrics.observe("command", "photo", 0.2)
+    metrics.increment("errors", "photo")
+
+    path = str(tmp_path / "metrics.json")
+    metrics.write_file(path)
+    with open(path) as fh:
+        data = json.load(fh)
+
+    assert data["latency"]["command"]["photo"]["count"] == 1
+    assert data["collectors"]["test_cache"] == {"hits": 3}
+
+    text = metrics.to_prometheus()
+    assert 'bool_bot_command_latency_seconds_count{name="photo"} 1' in text
+    assert 'bool_bot_command_latency_seconds_bucket{name="photo",le="0.25"} 1' in text
+    assert 'bool_bot_errors_total{name="photo"} 1' in text
+    assert 'bool_bot_test_cache_hits 3' in text
+
+    assert "photo: 1 calls" in metrics.summary()
+
+def test_prometheus_lines_are_valid():
+    """
+    Test every exported line is a valid sample, with collector names and keys that have spaces
+    """
+    sample = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_][a-zA-Z0-9_]*="[^"]*"(,[a-zA-Z_][a-zA-Z0-9_]*="[^"]*")*\})? \S+$')
+
+    metrics.register_collector("test startup", lambda: {"step library index": 0.1, "imports": 0.4})
+    metrics.observe("command", "photo", 0.2)
+    metrics.increment("errors", "photo")
+
+    lines = metrics.to_prometheus().splitlines()
+    for line in lines:
+        assert sample.match(line), line
+        float(line.rsplit(" ", 1)[1])
+
+    assert "bool_bot_test_startup_step_library_index 0.1" in lines
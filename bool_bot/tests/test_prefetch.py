@@ -0,0 +1,135 @@
+import pytest
+import asyncio
+
+import prefetch
+
+def producer(size=10):
+    """
+    Returns a produce function making numbered picks, and the list of picks it made
+    """
+    made = []
+
+    async def produce():
+        item = prefetch.PrefetchedFile({"id": "id{0}".format(len(made))}, b"x" * size)
+        made.append(item)
+        return item
+
+    return produce, made
+
+async def settle(prefetcher):
+    # Let the background refills finish
+    while prefetcher._refills:
+        await asyncio.gather(*prefetcher._refills.values())
+
+@pytest.mark.asyncio
+async def test_popular_query_is_served_from_queue():
+    """
+    Test a query asked again is answered with a pick downloaded in the background
+    """
+    prefetcher = prefetch.Prefetcher(depth=2, max_bytes=1000, min_requests=2)
+    produce, made = producer()
+
+    first = await prefetcher.get(("photo", "justin"), produce)
+    await settle(prefetcher)
+    # Asked once, nothing prefetched
+    assert len(made) == 1
+
+    second = await prefetcher.get(("photo", "justin"), produce)
+    await settle(prefetcher)
+    assert len(made) == 4
+    assert prefetcher.stats()["queued"] == 2
+
+    third = await prefetcher.get(("photo", "justin"), produce)
+    assert third is made[2]
+    assert len({first.file["id"], second.file["id"], third.file["id"]}) == 3
+
+    stats = prefetcher.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["hit_rate"] == pytest.approx(1 / 3.0)
+
+@pytest.mark.asyncio
+async def test_byte_budget():
+    """
+    Test the queued picks never use more than max_bytes
+    """
+    prefetcher = prefetch.Prefetcher(depth=10, max_bytes=35, min_requests=1)
+    produce, made = producer(size=10)
+
+    await prefetcher.get(("photo", "a"), produce)
+    await prefetcher.get(("photo", "b"), produce)
+    await settle(prefetcher)
+
+    assert prefetcher.bytes <= 35
+    assert prefetcher.stats()["queued"] == 3
+
+@pytest.mark.asyncio
+async def test_nothing_found_is_not_queued():
+    """
+    Test what produce returns instead of a pick (ex. an error message) is returned and not prefetched
+    """
+    prefetcher = prefetch.Prefetcher(min_requests=1)
+    calls = []
+
+    async def produce():
+        calls.append(None)
+        return "No Folder"
+
+    assert await prefetcher.get(("folder", "test"), produce) == "No Folder"
+    assert await prefetcher.get(("folder", "test"), produce) == "No Folder"
+    await settle(prefetcher)
+
+    assert len(calls) == 2
+    assert prefetcher.bytes == 0
+
+@pytest.mark.asyncio
+async def test_stale_picks_are_dropped():
+    """
+    Test a pick older than the ttl is not sent
+    """
+    prefetcher = prefetch.Prefetcher(depth=1, min_requests=1, ttl=0.0)
+    produce, made = producer()
+
+    await prefetcher.get(("photo", "justin"), produce)
+    await settle(prefetcher)
+    assert len(made) == 2
+
+    await asyncio.sleep(0.01)
+    item = await prefetcher.get(("photo", "justin"), produce)
+    assert item is made[2]
+    assert prefetcher.hits == 0
+
+@pytest.mark.asyncio
+async def test_least_recent_queries_are_evicted():
+    """
+    Test only the max_queries most recently asked queries keep their picks
+    """
+    prefetcher = prefetch.Prefetcher(depth=1, min_requests=1, max_queries=2)
+    produce, made = producer(size=10)
+
+    for query in ("a", "b", "c"):
+        await prefetcher.get(("photo", query), produce)
+        await settle(prefetcher)
+
+    assert prefetcher.stats()["queries"] == 2
+    assert prefetcher.bytes == 20
+    assert ("photo", "a") not in prefetcher._queries
+
+@pytest.mark.asyncio
+async def test_failed_refill_is_ignored():
+    """
+    Test a download failing in the background doesn't fail the request
+    """
+    prefetcher = prefetch.Prefetcher(min_requests=1)
+    produce, made = producer()
+
+    async def flaky():
+        if len(made) > 0:
+            raise IOError("Drive is down")
+        return await produce()
+
+    item = await prefetcher.get(("photo", "justin"), flaky)
+    await settle(prefetcher)
+
+    assert item is made[0]
+    assert prefetcher.stats()["queued"] == 0
@@ -0,0 +1,101 @@
+import pytest
+import time
+
+import google_drive_feat
+import drive_sync
+import library_index
+import query_cache
+
+@pytest.fixture
+def fake_drive(fake_drive, mocker):
+    """
+    The shared fake Drive, with the root photo folder in it
+    """
+    root = fake_drive.add_folder("Photos")
+    mocker.patch.object(google_drive_feat, "ROOT_PHOTO_FOLDER_ID", root)
+    return fake_drive
+
+def test_normalize():
+    assert query_cache.normalize("'a'  in parents\nand  name = 'x  y'", "name,  id") == \
+        ("'a' in parents and name = 'x  y'", "id,name")
+    assert query_cache.query_parents("('a\\'s' in parents or 'b' in parents) and trashed = false") == {"a's", "b"}
+
+def test_repeated_listing_skips_drive(fake_drive):
+    """
+    Test !ls and searches run again don't list the folders again
+    """
+    fake_drive.add_folder("test", google_drive_feat.ROOT_PHOTO_FOLDER_ID)
+
+    first = google_drive_feat.get_folder_ids(google_drive_feat.ROOT_PHOTO_FOLDER_ID)
+    second = google_drive_feat.get_folder_ids(google_drive_feat.ROOT_PHOTO_FOLDER_ID)
+
+    assert first == second
+    assert fake_drive.calls["files.list"] == 1
+    assert query_cache.cache.stats()["hits"] == 1
+
+def test_missing_folder_is_cached_for_a_short_time(fake_drive):
+    """
+    Test "No Folder" is remembered, but not for as long as a folder that was found
+    """
+    query_cache.cache.ttls[query_cache.NEGATIVE] = 0.05
+
+    assert google_drive_feat.get_folder_contents("test") == "No Folder"
+    assert google_drive_feat.get_folder_contents("test") == "No Folder"
+    assert fake_drive.calls["files.list"] == 1
+    assert query_cache.cache.stats()["negative_hits"] == 1
+
+    fake_drive.add_folder("test", google_drive_feat.ROOT_PHOTO_FOLDER_ID)
+    time.sleep(0.06)
+
+    assert google_drive_feat.get_folder_contents("test") == []
+
+def test_least_recently_used_are_evicted():
+    cache = query_cache.QueryCache(max_entries=2)
+    cache.put("'a' in parents", "id", [{"id": "1"}])
+    cache.put("'b' in parents", "id", [{"id": "2"}])
+    cache.get("'a' in parents", "id")
+    cache.put("'c' in parents", "id", [{"id": "3"}])
+
+    assert cache.get("'a' in parents", "id") == [{"id": "1"}]
+    assert cache.get("'b' in parents", "id") is None
+    assert len(cache) == 2
+
+def test_changes_invalidate_the_listings_they_touch():
+    """
+    Test a change drops the listings of the folder it is in and the listings holding it, and nothing else
+    """
+    cache = query_cache.QueryCache()
+    cache.put("'a' in parents", "id", [{"id": "1"}])
+    cache.put("'b' in parents", "id", [{"id": "2"}])
+    cache.put("'c' in parents", "id", [{"id": "3"}])
+
+    # 1 was moved from a to b, so a is only known from the cached listing
+    cache.invalidate_changes([{"fileId": "1", "removed": False, "file": {"id": "1", "parents": ["b"]}}])
+
+    assert cache.get("'a' in parents", "id") is None
+    assert cache.get("'b' in parents", "id") is None
+    assert cache.get("'c' in parents", "id") == [{"id": "3"}]
+
+def test_listing_started_before_an_invalidation_is_not_stored():
+    cache = query_cache.QueryCache()
+    generation = cache.generation
+    cache.invalidate()
+    cache.put("'a' in parents", "id", [{"id": "1"}], generation)
+
+    assert cache.get("'a' in parents", "id") is None
+
+def test_sync_invalidates(fake_drive, tmp_path):
+    """
+    Test a file added to a folder shows up once drive_sync polls the changes feed
+    """
+    root = google_drive_feat.ROOT_PHOTO_FOLDER_ID
+    folder = fake_drive.add_folder("test", root)
+    library = library_index.LibraryIndex(str(tmp_path / "library.db"))
+    library.rebuild(root)
+
+    assert google_drive_feat.get_folder_contents("test") == []
+
+    fake_drive.add_file("kurt.jpg", folder)
+    drive_sync.sync_once(library)
+
+    assert [file["name"] for file in google_drive_feat.get_folder_contents("test")] == ["kurt.jpg"]
@@ -0,0 +1,76 @@
+import pytest
+
+import search_engine
+
+FILES = [
+    {"id": "1", "name": "kurt.jpg"},
+    {"id": "2", "name": "jeyalex111.jpg", "description": "kurt at the beach"},
+    {"id": "3", "name": "Kurt_Beach_2019.png"},
+    {"id": "4", "name": "justin.jpg", "description": "justin and kurtis"},
+    {"id": "5", "name": "beach.jpg", "description": "sus"},
+]
+
+@pytest.fixture
+def index():
+    return search_engine.SearchIndex(FILES)
+
+def test_tokenize():
+    assert search_engine.tokenize("Kurt_Beach-2019 at THE beach") == ["kurt", "beach", "2019", "at", "the", "beach"]
+
+def test_ranking(index):
+    """
+    Test name matches rank before description matches, and exact words before longer words
+    """
+    assert index.search("kurt", limit=10) == ["1", "3", "2", "4"]
+    assert index.search("KURT", limit=2) == ["1", "3"]
+    assert sorted(index.search("kurt")) == ["1", "2", "3", "4"]
+
+def test_extension(index):
+    """
+    Test a query with the extension finds the file, and the extension alone finds every file having it
+    """
+    assert index.search("kurt.jpg", limit=10) == ["1", "2", "4"]
+    assert sorted(index.search("jpg")) == ["1", "2", "4", "5"]
+    assert index.search("png") == ["3"]
+    assert index.search("kurt", limit=10) == ["1", "3", "2", "4"]
+
+def test_every_word_must_match(index):
+    assert index.search("kurt beach", limit=10) == ["3", "2"]
+    assert index.search("kurt sus") == []
+
+def test_partial_matches(index):
+    """
+    Test prefixes, parts of words and typos
+    """
+    assert index.search("ju") == ["4"]
+    assert index.search("alex") == ["2"]
+    assert index.search("justn") == ["4"]
+
+def test_short_query_matches_inside_words():
+    """
+    Test a one or two letter query finds the words containing it, after the words starting with it
+    """
+    index = search_engine.SearchIndex([{"id": "1", "name": "swimmerkurt.jpg"}, {"id": "2", "name": "kurt.jpg"}])
+
+    assert index.search("ku", limit=10) == ["2", "1"]
+    assert index.search("mm") == ["1"]
+
+def test_incremental_changes(index):
+    """
+    Test put and remove give the same results as building the index again
+    """
+    index.put({"id": "6", "name": "kurt-again.jpg"})
+    index.put({"id": "1", "name": "alex.jpg"})
+    index.remove("5")
+    index.remove("missing")
+
+    files = [{"id": "1", "name": "alex.jpg"}] + FILES[1:4] + [{"id": "6", "name": "kurt-again.jpg"}]
+    rebuilt = search_engine.SearchIndex(files)
+
+    for query in ["kurt", "alex", "beach", "sus", "ku", "again"]:
+        assert index.search(query, limit=10) == rebuilt.search(query, limit=10)
+
+    assert {word: set(scores) for word, scores in index.postings.items()} == {word: set(scores) for word, scores in rebuilt.postings.items()}
+    assert index.word_trigrams == rebuilt.word_trigrams
+    assert index.prefixes == rebuilt.prefixes
+    assert index.total_length == rebuilt.total_length
@@ -0,0 +1,172 @@
+import pytest
+import asyncio
+from types import SimpleNamespace
+
+import selection
+import photo
+
+class FakeMessage(object):
+    def __init__(self, content="", author_id=1, channel=None):
+        self.content = content
+        self.author = SimpleNamespace(id=author_id)
+        self.channel = channel
+        self.deleted = False
+        self.embed = None
+
+    async def delete(self):
+        self.deleted = True
+
+    async def edit(self, embed=None):
+        self.embed = embed
+
+class FakeChannel(object):
+    def __init__(self, id):
+        self.id = id
+        self.sent = []
+
+    async def send(self, content):
+        self.sent.append(content)
+
+@pytest.mark.asyncio
+async def test_expiry():
+    """
+    Test selections expire after the timeout unless they are closed, with one timer
+    """
+    expired = []
+
+    async def on_expire(request):
+        expired.append(request.key)
+
+    manager = selection.SelectionManager(timeout=0.05, on_expire=on_expire)
+    manager.add((1, 10), [], None, "kurt")
+    manager.add((2, 10), [], None, "kurt")
+    manager.add((1, 11), [], None, "kurt")
+    assert manager.pop((2, 10)).query == "kurt"
+    assert (1, 10) in manager and (2, 10) not in manager
+
+    await asyncio.sleep(0.2)
+
+    assert sorted(expired) == [(1, 10), (1, 11)]
+    assert len(manager) == 0
+    assert manager._timer is None
+
+@pytest.mark.asyncio
+async def test_bounded():
+    """
+    Test the oldest selections are expired early when too many are open
+    """
+    expired = []
+
+    async def on_expire(request):
+        expired.append(request.key)
+
+    manager = selection.SelectionManager(timeout=60, max_pending=100, on_expire=on_expire)
+    for user_id in range(5000):
+        manager.add((user_id, 10), [], None, "kurt")
+        if user_id % 2 == 0:
+            manager.pop((user_id, 10))
+
+    await asyncio.sleep(0)
+
+    assert len(manager) == 100
+    assert len(manager._heap) <= 2 * 100 + 64
+    assert len(expired) == 2500 - 100
+    assert expired[0] == (1, 10)
+    assert (4999, 10) in manager
+
+@pytest.mark.asyncio
+async def test_process_search_request(monkeypatch):
+    """
+    Test answers are only taken from the user in the channel of the search, and only once
+    """
+    sent = []
+
+    async def send_photo(ctx, file_id, file_name, description):
+        sent.append(file_id)
+
+    monkeypatch.setattr(photo, "send_photo", send_photo)
+    monkeypatch.setattr(photo, "photo_requests", selection.SelectionManager(timeout=60))
+
+    channel = FakeChannel(10)
+    other_channel = FakeChannel(11)
+    embed = FakeMessage(channel=channel)
+    files = [{"id": "a", "name": "a.jpg", "webViewLink": "la"}, {"id": "b", "name": "b.jpg", "webViewLink": "lb"}]
+    photo.photo_requests.add((1, 10), files, embed, "kurt")
+
+    await photo.process_search_request(FakeMessage("1", author_id=2, channel=channel))
+    await photo.process_search_request(FakeMessage("1", author_id=1, channel=other_channel))
+    assert sent == []
+
+    await photo.process_search_request(FakeMessage("x", channel=channel))
+    await photo.process_search_request(FakeMessage("5", channel=channel))
+    assert channel.sent == ["Please enter a number", "Please enter a number in range of request"]
+
+    await photo.process_search_request(FakeMessage("1", channel=channel))
+    await photo.process_search_request(FakeMessage("0", channel=channel))
+    assert sent == ["b"]
+    assert embed.deleted
+    assert len(photo.photo_requests) == 0
+
+@pytest.mark.asyncio
+async def test_search_pages(monkeypatch):
+    """
+    Test long search results are shown a page at a time
+    """
+    monkeypatch.setattr(photo, "photo_requests", selection.SelectionManager(timeout=60))
+
+    channel = FakeChannel(10)
+    embed = FakeMessage(channel=channel)
+    files = [{"id": str(i), "name": "kurt{0}.jpg".format(i), "webViewLink": ""} for i in range(45)]
+    photo.photo_requests.add((1, 10), files, embed, "kurt")
+
+    first_page = photo.search_embed(files, 0)
+    assert first_page.description.splitlines()[0] == "0. kurt0.jpg"
+    assert len(first_page.description.splitlines()) == photo.RESULTS_PER_PAGE
+    assert first_page.footer.text.startswith("Page 1/3")
+
+    await photo.process_search_request(FakeMessage("p", channel=channel))
+    assert embed.embed is None
+
+    await photo.process_search_request(FakeMessage("n", channel=channel))
+    await photo.process_search_request(FakeMessage("n", channel=channel))
+    await photo.process_search_request(FakeMessage("n", channel=channel))
+    assert photo.photo_requests.get((1, 10)).page == 2
+    assert embed.embed.description.splitlines() == ["40. kurt40.jpg", "41. kurt41.jpg", "42. kurt42.jpg", "43. kurt43.jpg", "44. kurt44.jpg"]
+    assert embed.embed.footer.text.startswith("Page 3/3")
+
+def test_listing_pages():
+    """
+    Test a long folder listing is split into embed sized pages without splitting lines
+    """
+    lines = ["{0}{1}. folder{1}".format("    " * (i % 4), i) for i in range(300)]
+
+    pages = photo.listing_pages(lines)
+
+    assert len(pages) > 1
+    assert all(len(page) <= photo.EMBED_DESCRIPTION_LIMIT for page in pages)
+    assert "".join(pages).splitlines() == lines
+    assert photo.listing_pages([]) == [""]
+    assert photo.listing_pages(["x" * 5000]) == ["x" * (photo.EMBED_DESCRIPTION_LIMIT - 1) + "\n"]
+
+@pytest.mark.asyncio
+async def test_listing_paging(monkeypatch):
+    """
+    Test n and p page through a !ls listing, and any other answer ends the paging
+    """
+    monkeypatch.setattr(photo, "folder_listings", selection.SelectionManager(timeout=60))
+    pending = selection.PendingKeys(photo.photo_requests, photo.folder_listings)
+
+    channel = FakeChannel(10)
+    embed = FakeMessage(channel=channel)
+    photo.folder_listings.add((1, 10), ["0. a\n", "1. b\n"], embed, "ls")
+    assert (1, 10) in pending and (2, 10) not in pending
+
+    await photo.process_listing_request(FakeMessage("n", channel=channel))
+    assert embed.embed.description == "1. b\n"
+    assert embed.embed.footer.text.startswith("Page 2/2")
+
+    await photo.process_listing_request(FakeMessage("n", channel=channel))
+    assert photo.folder_listings.get((1, 10)).page == 1
+
+    await photo.process_listing_request(FakeMessage("hello", channel=channel))
+    assert (1, 10) not in pending
@@ -0,0 +1,165 @@
+import pytest
+import asyncio
+import time
+
+import metrics
+import send_queue
+
+class Channel(object):
+    """
+    Stand in for discord.TextChannel. Uploads take upload_time seconds
+    """
+    def __init__(self, id, upload_time=0.0, log=None):
+        self.id = id
+        self.upload_time = upload_time
+        self.sent = []
+        self.log = log if log is not None else []
+        self.uploading = 0
+        self.most_uploading = 0
+
+    async def send(self, content=None, file=None, **kwargs):
+        if file is not None:
+            self.uploading += 1
+            self.most_uploading = max(self.most_uploading, self.uploading)
+            await asyncio.sleep(self.upload_time)
+            self.uploading -= 1
+
+        self.sent.append(content)
+        self.log.append((self.id, content))
+        return content
+
+def unlimited(**kwargs):
+    return send_queue.SendQueue(rate=0, **kwargs)
+
+@pytest.mark.asyncio
+async def test_text_is_sent_before_waiting_uploads():
+    """
+    Test a text reply doesn't wait behind the uploads queued before it
+    """
+    queue = unlimited()
+    channel = Channel(1, upload_time=0.05)
+
+    uploads = [asyncio.ensure_future(queue.send(channel, "photo{0}".format(i), file=object())) for i in range(3)]
+    await asyncio.sleep(0.01)
+    await queue.send(channel, "No photo found")
+    await asyncio.gather(*uploads)
+
+    photos = [content for content in channel.sent if content.startswith("photo")]
+    assert photos == ["photo0", "photo1", "photo2"]
+    # Only the upload already running was sent before the reply
+    assert channel.sent.index("No photo found") < channel.sent.index("photo1")
+
+@pytest.mark.asyncio
+async def test_uploads_are_capped():
+    """
+    Test at most max_uploads uploads run at the same time across channels
+    """
+    queue = unlimited(max_uploads=2)
+    log = []
+    channels = [Channel(i, upload_time=0.05, log=log) for i in range(6)]
+
+    running = []
+    async def upload(channel):
+        await queue.send(channel, "photo", file=object())
+
+    async def watch():
+        while True:
+            running.append(queue.uploading)
+            await asyncio.sleep(0.005)
+
+    watcher = asyncio.ensure_future(watch())
+    start = time.perf_counter()
+    await asyncio.gather(*[upload(channel) for channel in channels])
+    elapsed = time.perf_counter() - start
+    watcher.cancel()
+
+    assert max(running) == 2
+    assert elapsed >= 3 * 0.05
+    assert all(channel.most_uploading == 1 for channel in channels)
+
+@pytest.mark.asyncio
+async def test_queued_uploads_are_told():
+    """
+    Test an upload waiting behind another one tells the user
+    """
+    queue = unlimited()
+    channel = Channel(1, upload_time=0.05)
+
+    await asyncio.gather(queue.send(channel, "photo0", file=object()), queue.send(channel, "photo1", file=object()))
+
+    assert channel.sent == ["photo0", "Queued, 1 upload ahead of yours in this channel", "photo1"] or \
+        channel.sent == ["Queued, 1 upload ahead of yours in this channel", "photo0", "photo1"]
+
+@pytest.mark.asyncio
+async def test_full_queue_refuses_uploads():
+    """
+    Test uploads over max_queued in a channel are refused
+    """
+    queue = unlimited(max_queued=1)
+    channel = Channel(1, upload_time=0.05)
+
+    results = await asyncio.gather(queue.send(channel, "photo0", file=object()), queue.send(channel, "photo1", file=object()))
+
+    assert results == ["photo0", None]
+    assert "photo1" not in channel.sent
+    assert "Too many uploads waiting in this channel, try again in a moment" in channel.sent
+    assert queue.refused == 1
+
+@pytest.mark.asyncio
+async def test_channel_rate():
+    """
+    Test messages to one channel are spaced to the channel rate after the burst
+    """
+    queue = send_queue.SendQueue(rate=20, burst=2)
+    channel = Channel(1)
+    other = Channel(2)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[queue.send(channel, str(i)) for i in range(6)])
+    elapsed = time.perf_counter() - start
+
+    assert channel.sent == [str(i) for i in range(6)]
+    assert elapsed >= 4 / 20.0 * 0.9
+
+    # Other channels have their own rate
+    start = time.perf_counter()
+    await queue.send(other, "0")
+    assert time.perf_counter() - start < 0.04
+
+@pytest.mark.asyncio
+async def test_latency_is_recorded_per_channel():
+    """
+    Test the time from queueing to sent is recorded for every channel
+    """
+    metrics.reset()
+    queue = unlimited()
+
+    await queue.send(Channel(1), "a")
+    await queue.send(Channel(1), "b")
+    await queue.send(Channel(2), "c")
+
+    latency = metrics.snapshot()["latency"]["send"]
+    assert latency["1"]["count"] == 2
+    assert latency["2"]["count"] == 1
+    metrics.reset()
+
+@pytest.mark.asyncio
+async def test_errors_go_to_the_sender():
+    """
+    Test a failed send raises in the command that sent it, and the next messages are still sent
+    """
+    queue = unlimited()
+    channel = Channel(1)
+
+    async def broken(content=None, **kwargs):
+        raise RuntimeError("Missing permissions")
+
+    channel.send, send = broken, channel.send
+    with pytest.raises(RuntimeError):
+        await queue.send(channel, "a")
+
+    channel.send = send
+    assert await queue.send(channel, "b") == "b"
+    # Channels are forgotten once nothing is queued
+    await asyncio.sleep(0)
+    assert queue.stats()["channels"] == 0
@@ -0,0 +1,54 @@
+import pytest
+
+from discord.ext import commands
+
+import library_index
+import sharding
+
+def test_process_shards():
+    assert sharding.process_shards(4, 2) == [[0, 2], [1, 3]]
+    assert sharding.process_shards(5, 2) == [[0, 2, 4], [1, 3]]
+    assert sharding.process_shards(2, 3) == [[0], [1]]
+
+@pytest.mark.asyncio
+async def test_make_bot(monkeypatch):
+    monkeypatch.setattr(sharding, "BOT_SHARDS", "")
+    assert type(sharding.make_bot(command_prefix="!")) is commands.Bot
+
+    monkeypatch.setattr(sharding, "BOT_SHARDS", "4")
+    monkeypatch.setattr(sharding, "SHARD_IDS", [1, 3])
+    bot = sharding.make_bot(command_prefix="!")
+
+    assert isinstance(bot, commands.AutoShardedBot)
+    assert bot.shard_count == 4
+    assert bot.shard_ids == [1, 3]
+
+def test_one_leader(tmp_path):
+    """
+    Test only one process at a time keeps the library index up to date
+    """
+    first = sharding.Leader(str(tmp_path / "library.db.lock"))
+    second = sharding.Leader(str(tmp_path / "library.db.lock"))
+
+    assert first.acquire()
+    assert first.acquire()
+    assert not second.acquire()
+
+def test_follower_reloads_the_index(tmp_path):
+    """
+    Test a shard process sees the index saved by the leader
+    """
+    path = str(tmp_path / "library.db")
+    leader = library_index.LibraryIndex(path)
+    follower = library_index.LibraryIndex(path)
+    follower.load()
+
+    assert not follower.reload_if_changed()
+
+    leader.replace([{"id": "folder1", "name": "test", "parents": ["root"]}],
+                   [{"id": "1", "name": "justin.jpg", "mimeType": "image/jpeg", "parents": ["folder1"]}])
+
+    assert follower.reload_if_changed()
+    assert follower.ready
+    assert [file["id"] for file in follower.search("justin")] == ["1"]
+    assert not follower.reload_if_changed()
@@ -0,0 +1,87 @@
+import pytest
+import asyncio
+import os
+import subprocess
+import sys
+
+from discord.ext import commands
+
+import startup
+
+@pytest.fixture
+def clean_startup(monkeypatch):
+    monkeypatch.setattr(startup, "phases", {})
+    monkeypatch.setattr(startup, "steps", {})
+    monkeypatch.setattr(startup, "_warmed", False)
+
+@pytest.mark.asyncio
+async def test_warm_runs_steps_at_the_same_time(clean_startup):
+    """
+    Test the warm up steps run concurrently, are timed, and a failing one doesn't stop the others
+    """
+    async def slow():
+        await asyncio.sleep(0.1)
+
+    async def broken():
+        raise RuntimeError("no Drive")
+
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    await startup.warm({"one": slow, "two": slow, "broken": broken})
+
+    assert loop.time() - start < 0.18
+    assert set(startup.steps) == {"one", "two", "broken"}
+    assert startup.steps["one"] >= 0.09
+    assert "warm" in startup.phases
+
+    # Reconnecting doesn't warm up again
+    await startup.warm({"three": slow})
+    assert "three" not in startup.steps
+
+def test_report(clean_startup):
+    startup.phases.update({"imports": 0.5, "connect": 1.25})
+    startup.steps.update({"library index": 0.125})
+
+    assert startup.report() == "Started in 1.75s: imports 0.50s, connect 1.25s (library index 0.12s)"
+
+def test_drive_client_is_imported_lazily():
+    """
+    Test importing the Drive feature doesn't import the Google API client, it is only needed once Drive is used
+    """
+    code = "import sys, google_drive_feat; print('googleapiclient.discovery' in sys.modules)"
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=directory)
+
+    assert output.strip() == b"False"
+
+@pytest.mark.asyncio
+async def test_extensions_register_commands():
+    """
+    Test the cogs register every command and the selection listener
+    """
+    bot = commands.Bot(command_prefix="!")
+    for name in ("cogs.media", "cogs.channels", "cogs.admin"):
+        bot.load_extension(name)
+
+    assert {"files", "phototest", "photo", "video", "listrequests", "ls", "channel-list", "channel", "stats"} <= {
+        command.name for command in bot.commands}
+    assert len(bot.extra_events["on_selection"]) == 1
+    assert bot.selections is not None
+
+@pytest.mark.asyncio
+async def test_failed_extension_does_not_block_commands(monkeypatch, capsys, clean_startup):
+    """
+    Test an extension failing to import is reported and skipped, and the commands of the others are registered
+    """
+    import index
+
+    bot = commands.Bot(command_prefix="!")
+    monkeypatch.setattr(index, "bot", bot)
+    monkeypatch.setattr(index, "extensions_loaded", asyncio.Event())
+    monkeypatch.setattr(index, "EXTENSIONS", ("cogs.missing", "cogs.admin"))
+
+    await asyncio.wait_for(index.import_extensions(), 5)
+
+    assert index.extensions_loaded.is_set()
+    assert "stats" in {command.name for command in bot.commands}
+    assert "Could not load extension cogs.missing" in capsys.readouterr().out
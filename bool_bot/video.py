@@ -1,10 +1,15 @@
 import discord
+import io
 import random
-import os
-import asyncio
 
 # Features
-import google_drive_feat
+import library_index
+import media_cache
+import media_prep
+import prefetch
+import send_queue
+import drive_batch
+from settings import DISCORD_UPLOAD_LIMIT
 
 
 # ================================================================================
@@ -15,36 +20,62 @@ async def video_random(ctx, query):
 
     query : String - The video name or description.  
     """
-    found_files = google_drive_feat.get_files_search(query, video=True)
-    
-    if len(found_files) == 0:
-        await ctx.send("No random video found, probably because there are no video names with the query you requested")
+    async def produce():
+        found_files = await library_index.search_files(query, video=True)
+        if len(found_files) == 0:
+            return None
+        return await prefetch_video(random.choice(found_files))
+
+    # Served from the prefetched videos of the query when it is asked often
+    picked = await prefetch.prefetcher.get(("video", query.casefold()), produce)
+
+    if picked is None:
+        await send_queue.send(ctx, "No random video found, probably because there are no video names with the query you requested")
         return
 
-    
-    random_index = random.randint(0, len(found_files) - 1)
-    random_file_id = found_files[random_index]["id"]
-    random_file_name = found_files[random_index]["name"]
-    
-    await send_video(ctx, random_file_id, random_file_name)
+    if not isinstance(picked, prefetch.PrefetchedFile):
+        # The video is too big to upload, the message says where to watch it
+        return await send_queue.send(ctx, picked)
+
+    await upload_video(ctx, io.BytesIO(picked.data), picked.file["name"])
+
+async def prefetch_video(file):
+    """
+    Download the video of a random pick
+
+    file : Object(id, name) - The picked file
+
+    return : prefetch.PrefetchedFile | String - The file and its video, or a message if the video is too big to upload
+    """
+    metadata = await drive_batch.get_file_metadata(file["id"])
+    if int(metadata.get("size", 0)) > DISCORD_UPLOAD_LIMIT:
+        return too_big_message(file["id"], metadata)
+
+    with await media_cache.cache.open(file["id"], metadata=metadata) as buffered:
+        return prefetch.PrefetchedFile(file, buffered.read())
 
 async def send_video(ctx, file_id, file_name):
     """
     Works exactly the same way as send_photo, but without the embed since you can't embed videos with discord.py(I may be wrong)
     """
 
-    video_name = google_drive_feat.download_file(file_id, file_name)
-
-    # Reads file from local storage
-    buffered = open(google_drive_feat.temp_dir + video_name, "rb")
-    file_video = discord.File(buffered, filename=video_name)
-    # insert embed code here, if possible
+    # Videos are not transcoded. Don't download one Discord won't take
+    metadata = await drive_batch.get_file_metadata(file_id)
+    if int(metadata.get("size", 0)) > DISCORD_UPLOAD_LIMIT:
+        return await send_queue.send(ctx, too_big_message(file_id, metadata))
 
-    await ctx.send("Sending Video from Google Drive", file=file_video)
+    # Downloads the video straight into memory, unless it is already cached
+    with await media_cache.cache.open(file_id, metadata=metadata) as buffered:
+        await upload_video(ctx, buffered, file_name)
 
-    buffered.close()
+async def upload_video(ctx, buffered, file_name):
+    """
+    Uploads a downloaded video to where the command is issued
+    """
+    file_video = discord.File(buffered, filename=file_name)
+    # insert embed code here, if possible
 
-    # Deletes file from local storage
-    os.remove(google_drive_feat.temp_dir + video_name)
+    await send_queue.send(ctx, "Sending Video from Google Drive", file=file_video)
 
-    return
\ No newline at end of file
+def too_big_message(file_id, metadata):
+    return "The video is too big to upload. {0}".format(metadata.get("webViewLink") or media_prep.view_link(file_id))